@@ -7,10 +7,34 @@ import win32ui
 from time import sleep, time
 import image_process
 import logging
+from cv_positioning import CV_SCREENSHOT_RESOLUTION_X, CV_SCREENSHOT_RESOLUTION_Y
 
 logger = logging.getLogger('bgo_script.attacher')
 
 
+def _crop_screenshot_regions(img: np.ndarray, rois: Sequence[Tuple[int, int, int, int]]) -> List[np.ndarray]:
+    """
+    Crop the regions from the screenshot in its native resolution, then resize the crops to the normalized size
+
+    :param img: the screenshot in native resolution, shapes [h, w, c]
+    :param rois: the regions (y1, y2, x1, x2) in normalized coordinate space (CV_SCREENSHOT_RESOLUTION_X *
+        CV_SCREENSHOT_RESOLUTION_Y)
+    :return: the cropped regions, shapes [y2 - y1, x2 - x1, c], they may be views of the screenshot
+    """
+    scale_y = img.shape[0] / CV_SCREENSHOT_RESOLUTION_Y
+    scale_x = img.shape[1] / CV_SCREENSHOT_RESOLUTION_X
+    ret_list = []
+    for y1, y2, x1, x2 in rois:
+        native_y1, native_x1 = int(round(y1 * scale_y)), int(round(x1 * scale_x))
+        native_y2 = max(int(round(y2 * scale_y)), native_y1 + 1)
+        native_x2 = max(int(round(x2 * scale_x)), native_x1 + 1)
+        region = img[native_y1:native_y2, native_x1:native_x2, ...]
+        if region.shape[:2] != (y2 - y1, x2 - x1):
+            region = image_process.resize(region, x2 - x1, y2 - y1)
+        ret_list.append(region)
+    return ret_list
+
+
 class AbstractAttacher:
     """
     AbstractAttacher defines the basic interface to interact with the game application
@@ -18,6 +42,29 @@ class AbstractAttacher:
     def get_screenshot(self, width: Optional[int] = None, height: Optional[int] = None) -> np.ndarray:
         raise NotImplementedError
 
+    def get_frame(self, width: Optional[int] = None, height: Optional[int] = None) -> image_process.Frame:
+        """
+        Get the current screenshot wrapped in a Frame, its derived representations (gray, HSV, ROIs) are computed
+        lazily and shared by all consumers of the same capture
+
+        :param width: the width of reshaped screenshot (in pixels), default: screen width
+        :param height: the height of reshaped screenshot (in pixels), default: screen height
+        :return: the captured frame
+        """
+        return image_process.Frame(self.get_screenshot(width, height))
+
+    def get_screenshot_regions(self, rois: Sequence[Tuple[int, int, int, int]]) -> List[np.ndarray]:
+        """
+        Get the regions of the current screenshot, only the regions are resized instead of the whole screenshot, it is
+        much cheaper than get_screenshot(CV_SCREENSHOT_RESOLUTION_X, CV_SCREENSHOT_RESOLUTION_Y) for polling a few small
+        regions
+
+        :param rois: the regions (y1, y2, x1, x2) in normalized coordinate space (CV_SCREENSHOT_RESOLUTION_X *
+            CV_SCREENSHOT_RESOLUTION_Y), the same as cv_positioning
+        :return: the regions in RGB order, shapes [y2 - y1, x2 - x1, 3]
+        """
+        return _crop_screenshot_regions(self.get_screenshot(), rois)
+
     def send_click(self, x: float, y: float, stay_time: float = 0.1):
         raise NotImplementedError
 
@@ -71,7 +118,7 @@ class HandleBasedAttacher(AbstractAttacher):
             width = window_width
         if height is None:
             height = window_height
-        if width != window_width or height != window_width:
+        if width != window_width or height != window_height:
             screenshot = image_process.resize(screenshot, width, height)
         return screenshot
 
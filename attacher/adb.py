@@ -4,7 +4,7 @@ from typing import *
 import sys
 import os
 import logging
-from util import spawn_process_raw, spawn_process
+from util import spawn_process_raw, spawn_process, AdbShellSession
 import image_process
 import struct
 import threading
@@ -34,18 +34,20 @@ class AdbAttacher(AbstractAttacher):
             assert os.path.isfile(adb_executable), 'Adb (Android Debug Bridge) executable not exists'
             self._adb = adb_executable
         else:
+            adb_file_name = 'adb.exe' if os.name == 'nt' else 'adb'
             candidate_paths = list(sys.path)
-            candidate_paths.extend(os.getenv('PATH').split(os.pathsep))
+            candidate_paths.extend(os.getenv('PATH', '').split(os.pathsep))
             for path in candidate_paths:
-                candidate_file = os.path.join(path, 'adb.exe')
+                candidate_file = os.path.join(path, adb_file_name)
                 if os.path.isfile(candidate_file):
                     self._adb = candidate_file
                     break
             if self._adb is None:
-                raise RuntimeError('Could not find adb.exe in PATH, please specify it by parameter')
-            logger.info('Found adb.exe in %s' % self._adb)
+                raise RuntimeError('Could not find %s in PATH, please specify it by parameter' % adb_file_name)
+            logger.info('Found %s in %s' % (adb_file_name, self._adb))
         # spawn_process([self._adb, 'kill-server'])
         spawn_process([self._adb, 'start-server'])
+        self._shell = AdbShellSession(self._adb)
         thd = threading.Thread(target=self._shutdown_adb_server, daemon=False, name='Adb server shutdown thread')
         thd.start()
         self._crop_16_9 = False
@@ -60,6 +62,7 @@ class AdbAttacher(AbstractAttacher):
         while threading.main_thread().is_alive():
             sleep(0.2)
         logger.info('Main thread exited, terminate adb server process')
+        self._shell.close()
         spawn_process_raw([self._adb, 'kill-server'])
 
     def _translate_normalized_coord(self, x: float, y: float) -> Tuple[int, int]:
@@ -97,12 +100,32 @@ class AdbAttacher(AbstractAttacher):
         img = self._get_screenshot_internal()
         width = width or img.shape[1]
         height = height or img.shape[0]
+        if img.shape[:2] == (height, width):
+            return img
         return image_process.resize(img, width, height)
 
+    def _shell_input(self, cmd: str, duration: float = 0) -> str:
+        """
+        Execute the input command in the shell session, failures are logged instead of raised (same as spawning a new
+        adb process for each command), since the command will never be replayed once it is sent
+
+        :param cmd: the command
+        :param duration: the duration (in seconds) of the input itself, which is added to the timeout of the session
+        :return: the output of the command, or empty string if failed
+        """
+        try:
+            ret_code, stdout = self._shell.execute(cmd, self._shell.timeout + duration)
+        except RuntimeError as ex:
+            logger.error('Adb shell command "%s" failed' % cmd, exc_info=ex)
+            return ''
+        if ret_code != 0:
+            logger.error('Adb shell command "%s" exited with non-zero value: %d' % (cmd, ret_code))
+        return stdout
+
     def send_click(self, x: float, y: float, stay_time: float = 0.1):
         px, py = self._translate_normalized_coord(x, y)
-        stdout = _handle_adb_ipc_output(spawn_process([self._adb, 'shell', 'input touchscreen swipe %d %d %d %d %d' %
-                                                       (px, py, px, py, int(round(stay_time*1000)))]))
+        stdout = self._shell_input('input touchscreen swipe %d %d %d %d %d' %
+                                   (px, py, px, py, int(round(stay_time*1000))), stay_time)
         if len(stdout) > 0:
             logger.debug('Adb output: %s' % stdout)
 
@@ -113,7 +136,7 @@ class AdbAttacher(AbstractAttacher):
         if not self.__warn_func_disabled:
             self.__warn_func_disabled = True
             logger.warning('Param stay_time_before_move and stay_time_after_move is disabled for Adb attacher')
-        stdout = _handle_adb_ipc_output(spawn_process(['adb', 'shell', 'input touchscreen swipe %d %d %d %d %d' %
-                                                       (p1[0], p1[1], p2[0], p2[1], int(round(stay_time_move*1000)))]))
+        stdout = self._shell_input('input touchscreen swipe %d %d %d %d %d' %
+                                   (p1[0], p1[1], p2[0], p2[1], int(round(stay_time_move*1000))), stay_time_move)
         if len(stdout) > 0:
             logger.debug('Adb output: %s' % stdout)
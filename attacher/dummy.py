@@ -12,6 +12,10 @@ class DummyAttacher(AbstractAttacher):
         logger.info('Method called: get_screenshot(%s, %s)' % (str(width), str(height)))
         return np.zeros([height, width, 3], dtype='uint8')
 
+    def get_screenshot_regions(self, rois: Sequence[Tuple[int, int, int, int]]) -> List[np.ndarray]:
+        logger.info('Method called: get_screenshot_regions(%s)' % str(rois))
+        return [np.zeros([y2 - y1, x2 - x1, 3], dtype='uint8') for y1, y2, x1, x2 in rois]
+
     def send_slide(self, p_from: Tuple[float, float], p_to: Tuple[float, float], stay_time_before_move: float = 0.1,
                    stay_time_move: float = 0.8, stay_time_after_move: float = 0.1):
         logger.info('Method called: send_slice(%s, %s, %s, %s, %s)' %
@@ -6,7 +6,7 @@ from cv_positioning import *
 import image_process
 import logging
 from time import time
-from matcher import ServantCommandCardMatcher
+from matcher import ServantCommandCardMatcher, warm_up_matchers
 
 logger = logging.getLogger('bgo_script.battle_control')
 
@@ -24,46 +24,96 @@ def _proc_cmd_card_alpha():
     return ret
 
 
+def _proc_cmd_card_type_anchor():
+    # gray and alpha of the type anchors in integer, used for computing mean_gray_diff_err in vectorized form
+    ret = []
+    for file in CV_COMMAND_CARD_TYPE_FILES:
+        gray, alpha = image_process.split_gray_alpha(image_process.imread(file))
+        ret.append((gray.astype(np.int32), alpha.astype(np.int32)))
+    return ret
+
+
+def _gray_int(img: np.ndarray) -> np.ndarray:
+    # round(mean(r, g, b)) == (r + g + b + 1) // 3, same as split_gray_alpha
+    gray = np.add.reduce(img[..., :3], axis=-1, dtype=np.int32)
+    gray += 1
+    gray //= 3
+    return gray
+
+
 class CommandCardDetector:
-    _command_card_type_anchor = [image_process.imread(x) for x in CV_COMMAND_CARD_TYPE_FILES]
+    _command_card_type_anchor = _proc_cmd_card_type_anchor()
     _command_card_rev_alpha = _proc_cmd_card_alpha()
     _servant_matcher = ServantCommandCardMatcher()
     _command_card_support_anchor = image_process.imread(CV_COMMAND_CARD_SUPPORT_ANCHOR_FILE)
     _command_card_support_rev_alpha = _rev_alpha(CV_COMMAND_CARD_SUPPORT_ANCHOR_FILE)
 
+    @classmethod
+    def warm_up(cls):
+        """
+        Load the servant command card database in background
+        """
+        warm_up_matchers([cls._servant_matcher])
+
+    @staticmethod
+    def _detect_card_type(gray: np.ndarray) -> Tuple[int, int]:
+        """
+        Find the command card type and its vertical offset, all offsets of all types are scored in one vectorized pass
+        over the sliding windows, giving the same score as mean_gray_diff_err
+
+        :param gray: gray scale image of the card (in int32), starts from CV_COMMAND_CARD_Y
+        :return: the index of card type and the y offset of the card in screenshot
+        """
+        card_type = 0
+        target_err = float('inf')
+        y_offset = 0
+        for idx, ((anchor_gray, anchor_alpha), offset) in enumerate(zip(CommandCardDetector._command_card_type_anchor,
+                                                                        CV_COMMAND_CARD_TYPE_OFFSET)):
+            h, w = anchor_gray.shape
+            y1 = CV_COMMAND_CARD_Y_DETECTION_OFFSET
+            band = gray[y1:y1+CV_COMMAND_CARD_Y_DETECTION_LENGTH+h-1]
+            # shapes (CV_COMMAND_CARD_Y_DETECTION_LENGTH, h, w)
+            windows = np.lib.stride_tricks.sliding_window_view(band, (h, w))[:, 0]
+            err = np.abs(windows - anchor_gray)
+            err *= anchor_alpha
+            score = np.sum(err, axis=(1, 2), dtype=np.int64)
+            i = int(np.argmin(score))
+            min_score = score[i] / (255.0 * h * w)
+            if min_score < target_err:
+                card_type = idx
+                target_err = min_score
+                y_offset = i + CV_COMMAND_CARD_Y_DETECTION_OFFSET - offset + CV_COMMAND_CARD_Y
+        return card_type, y_offset
+
     @staticmethod
-    def detect_command_cards(img: np.ndarray) -> List[DispatchedCommandCard]:
+    def detect_command_cards(img: Union[np.ndarray, image_process.Frame],
+                             candidate_servants: Optional[Collection[int]] = None,
+                             support_candidate_servants: Optional[Collection[int]] = None) \
+            -> List[DispatchedCommandCard]:
         """
         Detect in-battle command card for current turn (attack button must be pressed before calling this method!)
 
-        :param img: In-game screenshot, with shape (h, w, 3) in RGB format or (h, w, 4) in RGBA format (A channel will
-         be ignored)
+        :param img: In-game screenshot (or the captured frame), with shape (h, w, 3) in RGB format or (h, w, 4) in RGBA
+         format (A channel will be ignored)
+        :param candidate_servants: Servant ids which may appear in current battle (e.g. servants in the team), the
+         whole servant database is scanned only when the card does not match any of them
+        :param support_candidate_servants: Servant ids which may appear in the cards of support servant (e.g. the
+         configured support servant), the cards of support servant are matched by full scan if not specified
         :return: A list containing command card info
         """
+        if isinstance(img, image_process.Frame):
+            img = img.rgb
         assert len(img.shape) == 3, 'Invalid image shape, expected RGB format'
         if img.shape[-1] == 4:
-            img = img.shape[..., :3]
+            img = img[..., :3]
         ret_list = []
 
         # 从者头像与指令卡的padding: Top 25px, Left 42px, Right 42px, Bottom 12px
         t = time()
+        # gray scale conversion is done once for all cards
+        gray = _gray_int(img[CV_COMMAND_CARD_Y:])
         for card_idx, (x1, x2) in enumerate(zip(CV_COMMAND_CARD_X1S, CV_COMMAND_CARD_X2S)):
-            command_card = img[CV_COMMAND_CARD_Y:, x1:x2, :3].copy()
-            card_type = 0
-            target_err = float('inf')
-            y_offset = 0
-            for idx, (command_card_type, offset) in enumerate(zip(CommandCardDetector._command_card_type_anchor,
-                                                                  CV_COMMAND_CARD_TYPE_OFFSET)):
-                score = np.empty(CV_COMMAND_CARD_Y_DETECTION_LENGTH, np.float)
-                h = command_card_type.shape[0]
-                for i in range(CV_COMMAND_CARD_Y_DETECTION_LENGTH):
-                    y = CV_COMMAND_CARD_Y_DETECTION_OFFSET + i
-                    score[i] = image_process.mean_gray_diff_err(command_card[y:y+h, ...], command_card_type)
-                min_score = np.min(score)
-                if min_score < target_err:
-                    card_type = idx
-                    target_err = min_score
-                    y_offset = np.argmin(score) + CV_COMMAND_CARD_Y_DETECTION_OFFSET - offset + CV_COMMAND_CARD_Y
+            card_type, y_offset = CommandCardDetector._detect_card_type(gray[:, x1:x2])
             # Extend pixels
             command_card = img[y_offset-CV_COMMAND_CARD_EXTEND_TOP:
                                y_offset+CV_COMMAND_CARD_EXTEND_BOTTOM+CV_COMMAND_CARD_HEIGHT,
@@ -88,7 +138,8 @@ class CommandCardDetector:
                       CV_COMMAND_CARD_SUPPORT_X1:CV_COMMAND_CARD_SUPPORT_X2] = \
                     CommandCardDetector._command_card_support_rev_alpha
             command_card = np.concatenate([command_card, np.expand_dims(alpha, 2)], 2)
-            servant_id = CommandCardDetector._servant_matcher.match(command_card)
+            candidates = support_candidate_servants if is_support else candidate_servants
+            servant_id = CommandCardDetector._servant_matcher.match(command_card, candidates)
             ret_list.append(DispatchedCommandCard(servant_id, CommandCardType(card_type+1), card_idx, is_support, 0))
         logger.info('Detected command card data: %s (used %f sec(s))' % (str(ret_list), time() - t))
         return ret_list
@@ -9,7 +9,8 @@ logger = logging.getLogger('bgo_script.battle_control')
 class ScriptConfiguration:
     def __init__(self, eat_apple_type: EatAppleType, battle_controller: Type[BattleController],
                  team_config: TeamConfiguration, max_ap: Optional[int] = None,
-                 detect_command_card: Optional[bool] = None, enable_continuous_battle_feature: bool = True):
+                 detect_command_card: Optional[bool] = None, enable_continuous_battle_feature: bool = True,
+                 support_selection_diagnostics: bool = False):
         self.eat_apple_type = eat_apple_type
         self.battle_controller = battle_controller
         self.team_config = team_config
@@ -21,3 +22,4 @@ class ScriptConfiguration:
         self.detect_command_card = detect_command_card
         self.DO_NOT_MODIFY_BATTLE_VARS = {}  # type: Dict[str, Any]
         self.enable_continuous_battle = enable_continuous_battle_feature
+        self.support_selection_diagnostics = support_selection_diagnostics
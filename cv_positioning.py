@@ -48,6 +48,24 @@ CV_SUPPORT_SERVANT_X2 = 212
 CV_SUPPORT_SERVANT_IMG_SIZE = (144, 132)
 # 助战从者与礼装分割位置
 CV_SUPPORT_SERVANT_SPLIT_Y = 107
+# 只验证指定助战从者时可接受的最大HSV误差
+# 验证时还要求其误差不高于最相似的非指定从者，该阈值只用于拒绝数据库中不存在的从者
+CV_SUPPORT_SERVANT_CANDIDATE_HSV_THRESHOLD = 8
+# 匹配助战从者时，HSV误差不超过该值即提前结束匹配
+# 默认不启用（可能返回最近匹配过的从者而非最佳结果），需通过early_exit_threshold参数启用
+CV_SUPPORT_SERVANT_EARLY_EXIT_HSV_THRESHOLD = 2
+# 匹配助战从者时，先用缩略图筛选，再逐像素比较的候选数量（None为不筛选）
+CV_SUPPORT_SERVANT_CASCADE_TOP_K = 32
+# 只验证指定助战礼装时所需的最少SIFT匹配点数
+# 验证时还要求其匹配点数多于任何非指定礼装，该阈值只用于拒绝匹配点过少的低置信度结果
+CV_SUPPORT_CRAFT_ESSENCE_VERIFY_MIN_MATCHES = 5
+# 助战礼装识别结果的最大缓存数量
+CV_SUPPORT_CRAFT_ESSENCE_CACHE_CAPACITY = 1024
+# 助战礼装识别缓存中，判定为同一礼装的缩略图（4倍下采样灰度图）最大平均灰度误差
+# 下采样会平均掉大部分差异：不同礼装的误差约为5~7（原图约12以上），同一礼装的截图噪声约为0.5
+CV_SUPPORT_CRAFT_ESSENCE_CACHE_CONFLICT_TOL = 2
+# HSV图标匹配时，用于初步筛选的缩略图大小
+CV_HSV_CASCADE_SIGNATURE_SIZE = 8
 # 助战识别
 CV_FGO_DATABASE_FILE = 'cv_data/fgo_new.db'
 CV_SUPPORT_EMPTY_FILE = 'cv_data/support_empty.png'
@@ -136,6 +154,13 @@ CV_COMMAND_CARD_EXTEND_BOTTOM = 12
 CV_COMMAND_CARD_EXTEND_LEFT = 42
 CV_COMMAND_CARD_EXTEND_RIGHT = 42
 CV_COMMAND_CARD_IMG_SIZE = (256, 256)
+# 仅匹配队伍内从者时可接受的最大HSV误差，超过该值时回退到全数据库匹配
+CV_COMMAND_CARD_CANDIDATE_HSV_THRESHOLD = 6
+# 匹配指令卡从者时，HSV误差不超过该值即提前结束匹配
+# 默认不启用（可能返回最近匹配过的从者而非最佳结果），需通过early_exit_threshold参数启用
+CV_COMMAND_CARD_EARLY_EXIT_HSV_THRESHOLD = 1.5
+# 匹配指令卡从者时，先用缩略图筛选，再逐像素比较的候选数量（None为不筛选）
+CV_COMMAND_CARD_CASCADE_TOP_K = 32
 # 助战指令卡标志（相对每张指令卡的坐标）
 CV_COMMAND_CARD_SUPPORT_Y1 = 29
 CV_COMMAND_CARD_SUPPORT_Y2 = 54
@@ -153,3 +178,7 @@ CV_SUPPORT_REFRESH_REFUSED_DETECTION_S_THRESHOLD = 5
 CV_REQUEST_SUPPORT_UI_FILE = 'cv_data/request_support_ui.png'
 CV_EAT_APPLE_UI_FILE = 'cv_data/eat_apple_ui.png'
 CV_CONTINUOUS_BATTLE_UI_FILE = 'cv_data/continuous_battle.png'
+# 全屏界面锚点比较时的采样步长（长宽方向各隔N个像素取一个）
+CV_UI_ANCHOR_DOWNSAMPLE = 2
+# 图像处理后端自动选择（测速）的结果缓存文件
+CV_BACKEND_AUTOTUNE_FILE = 'cv_data/backend_autotune.json'
@@ -258,8 +258,8 @@ class BattleSequenceExecutor:
         if should_detect_command_card:
             self._enter_attack_mode()
             sleep(0.5)
-            img = self.attacher.get_screenshot(CV_SCREENSHOT_RESOLUTION_X, CV_SCREENSHOT_RESOLUTION_Y)
-            new_cards = CommandCardDetector.detect_command_cards(img[..., :3])
+            frame = self.attacher.get_frame(CV_SCREENSHOT_RESOLUTION_X, CV_SCREENSHOT_RESOLUTION_Y)
+            new_cards = CommandCardDetector.detect_command_cards(frame, *self._command_card_candidates())
             if self._dispatched_cards is None:
                 self._dispatched_cards = new_cards
             else:
@@ -268,6 +268,16 @@ class BattleSequenceExecutor:
         else:
             self._dispatched_cards = None
 
+    def _command_card_candidates(self) -> Tuple[List[int], Optional[List[int]]]:
+        # only the servants in current team could appear in command cards, returns the candidates of the cards of own
+        # servants and support servant respectively
+        candidates = [x for x in self._servants if x >= 0]
+        support_svt_id = self.team_config.support_servant.svt_id
+        # support servant with svt_id = 0 (any servant) is unknown here, its cards are matched by full scan
+        if SERVANT_ID_SUPPORT in self._servants and support_svt_id > 0:
+            return candidates, [support_svt_id]
+        return candidates, None
+
     def refresh_command_card_list(self):
         self._refresh_command_card_list(force=True)
 
@@ -1,7 +1,6 @@
 from .state_handler import ConfigurableStateHandler, WaitFufuStateHandler
 from attacher import AbstractAttacher
 from cv_positioning import *
-import numpy as np
 import logging
 from click_positioning import *
 from time import sleep
@@ -17,7 +16,8 @@ def _imread_to_screen_size(path):
 
 
 class EatAppleHandler(ConfigurableStateHandler):
-    _eat_apple_ui_anchor = _imread_to_screen_size(CV_EAT_APPLE_UI_FILE)
+    _eat_apple_ui_anchor = image_process.AnchorTemplate(_imread_to_screen_size(CV_EAT_APPLE_UI_FILE),
+                                                        CV_UI_ANCHOR_DOWNSAMPLE)
     _y_mapper = {EatAppleType.GoldApple: EAT_GOLD_APPLE_CLICK_Y, EatAppleType.SilverApple: EAT_SILVER_APPLE_CLICK_Y,
                  EatAppleType.BronzeApple: EAT_BRONZE_APPLE_CLICK_Y, EatAppleType.SaintQuartz: EAT_SAINT_QUARTZ_CLICK_Y}
     __warned_eat_saint_quartz = False
@@ -28,8 +28,8 @@ class EatAppleHandler(ConfigurableStateHandler):
         self.forward_state = forward_state
 
     def run_and_transit_state(self) -> FgoState:
-        screenshot = self.attacher.get_screenshot(CV_SCREENSHOT_RESOLUTION_X, CV_SCREENSHOT_RESOLUTION_Y)
-        if self.is_in_eat_apple_ui(screenshot):
+        frame = self.attacher.get_frame(CV_SCREENSHOT_RESOLUTION_X, CV_SCREENSHOT_RESOLUTION_Y)
+        if self.is_in_eat_apple_ui(frame):
             if self._cfg.eat_apple_type == EatAppleType.DontEatMyApple:
                 logger.warning('AP is not enough to enter quest, exit')
                 self.attacher.send_click(CANCEL_EAT_APPLE_BUTTON_X, CANCEL_EAT_APPLE_BUTTON_Y)
@@ -50,7 +50,7 @@ class EatAppleHandler(ConfigurableStateHandler):
             return self.forward_state
 
     @classmethod
-    def is_in_eat_apple_ui(cls, img: np.ndarray):
-        v = image_process.mean_gray_diff_err(cls._eat_apple_ui_anchor, img)
-        logger.debug('DEBUG value: mean_gray_diff_err = %f' % v)
+    def is_in_eat_apple_ui(cls, frame: image_process.Frame):
+        v = cls._eat_apple_ui_anchor.compare(frame.rgb)
+        logger.debug('DEBUG value: eat apple ui anchor diff = %f' % v)
         return v < 3
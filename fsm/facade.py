@@ -10,7 +10,7 @@ from .in_battle_handler import EnterQuestHandler, WaitAttackOrExitQuestHandler,
 from .post_quest_handler import ExitQuestHandler, FriendUIHandler, ContinuousBattleHandler
 import logging
 from _version import VERSION
-from battle_control import ScriptConfiguration
+from battle_control import ScriptConfiguration, CommandCardDetector
 
 logger = logging.getLogger('bgo_script.fsm')
 s = FgoState
@@ -25,6 +25,15 @@ class FgoFSMFacadeAbstract:
         self.executor = FSMExecutor()
         self.attacher = attacher
         self.cfg = cfg
+        # loading matchers while navigating to the states using them
+        self.warm_up()
+
+    @classmethod
+    def warm_up(cls):
+        """
+        Load the matchers used by this facade in background, it could be called before initializing the facade
+        """
+        pass
 
     def run(self):
         self.executor.run()
@@ -42,6 +51,10 @@ class FgoFSMFacadeBattleLoop(FgoFSMFacadeAbstract):
         self.executor.add_state_handler(s.STATE_BATTLE_LOOP_ATK, BattleLoopAttackHandler(attacher, cfg))
         self.executor.add_state_handler(s.STATE_EXIT_QUEST, DirectStateForwarder(s.STATE_FINISH))
 
+    @classmethod
+    def warm_up(cls):
+        CommandCardDetector.warm_up()
+
 
 class FgoFSMFacade(FgoFSMFacadeBattleLoop):
     def __init__(self, attacher: AbstractAttacher, cfg: ScriptConfiguration):
@@ -72,9 +85,19 @@ class FgoFSMFacade(FgoFSMFacadeBattleLoop):
         self.executor.add_state_handler(s.STATE_SELECT_SUPPORT_CONTINUOUS_BATTLE,
                                         SelectSupportHandler(attacher, s.STATE_ENTER_QUEST, cfg))
 
+    @classmethod
+    def warm_up(cls):
+        # support selection comes first
+        SelectSupportHandler.warm_up()
+        super().warm_up()
+
 
 class FgoFSMFacadeSelectSupport(FgoFSMFacadeAbstract):
     def __init__(self, attacher: AbstractAttacher, cfg: ScriptConfiguration):
         super().__init__(attacher, cfg)
         self.executor.add_state_handler(s.STATE_BEGIN, DirectStateForwarder(s.STATE_SELECT_SUPPORT))
         self.executor.add_state_handler(s.STATE_SELECT_SUPPORT, SelectSupportHandler(attacher, s.STATE_FINISH, cfg))
+
+    @classmethod
+    def warm_up(cls):
+        SelectSupportHandler.warm_up()
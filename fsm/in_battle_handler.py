@@ -27,7 +27,7 @@ class EnterQuestHandler(ConfigurableStateHandler):
 
 
 class WaitAttackOrExitQuestHandler(ConfigurableStateHandler):
-    _attack_button_anchor = image_process.imread(CV_ATTACK_BUTTON_ANCHOR)
+    _attack_button_anchor = image_process.AnchorTemplate(image_process.imread(CV_ATTACK_BUTTON_ANCHOR))
 
     def __init__(self, attacher: AbstractAttacher, cfg: ScriptConfiguration):
         super().__init__(cfg)
@@ -36,36 +36,37 @@ class WaitAttackOrExitQuestHandler(ConfigurableStateHandler):
     def run_and_transit_state(self) -> FgoState:
         while True:
             sleep(0.2)
-            img = self.attacher.get_screenshot(CV_SCREENSHOT_RESOLUTION_X, CV_SCREENSHOT_RESOLUTION_Y)[..., :3]
-            gray = np.mean(img, -1)
+            frame = self.attacher.get_frame(CV_SCREENSHOT_RESOLUTION_X, CV_SCREENSHOT_RESOLUTION_Y)
+            gray = frame.gray()
             blank_val = np.mean(np.less(gray, CV_IN_BATTLE_BLANK_SCREEN_THRESHOLD))
             logger.debug('DEBUG value: blank ratio: %f' % blank_val)
             # skip blank screen frame
             if blank_val >= CV_IN_BATTLE_BLANK_SCREEN_RATIO:
                 continue
-            if self._can_attack(gray):
+            if self._can_attack(frame):
                 return FgoState.STATE_BATTLE_LOOP_ATK
-            if self._is_exit_quest_scene(img):
+            if self._is_exit_quest_scene(frame):
                 self._cfg.DO_NOT_MODIFY_BATTLE_VARS['BATTLE_LOOP_NEXT_STATE'] = FgoState.STATE_EXIT_QUEST
                 self._cfg.DO_NOT_MODIFY_BATTLE_VARS['SGN_BATTLE_STATE_CHANGED'].set()
                 return FgoState.STATE_EXIT_QUEST
 
-    def _can_attack(self, img: np.ndarray) -> bool:
-        btn_area = img[CV_ATTACK_BUTTON_Y1:CV_ATTACK_BUTTON_Y2, CV_ATTACK_BUTTON_X1:CV_ATTACK_BUTTON_X2]
-        abs_gray_diff = image_process.mean_gray_diff_err(btn_area, self._attack_button_anchor)
-        logger.debug('DEBUG value: attack button mean_gray_diff_err = %f' % abs_gray_diff)
+    def _can_attack(self, frame: image_process.Frame) -> bool:
+        btn_area = frame.roi((CV_ATTACK_BUTTON_Y1, CV_ATTACK_BUTTON_Y2, CV_ATTACK_BUTTON_X1, CV_ATTACK_BUTTON_X2))
+        abs_gray_diff = self._attack_button_anchor.compare(btn_area)
+        logger.debug('DEBUG value: attack button anchor diff = %f' % abs_gray_diff)
         return abs_gray_diff < CV_ATTACK_DIFF_THRESHOLD
 
     @staticmethod
-    def _is_exit_quest_scene(img: np.ndarray) -> bool:
-        img = img[CV_EXIT_QUEST_Y1:CV_EXIT_QUEST_Y2, CV_EXIT_QUEST_X1:CV_EXIT_QUEST_X2, :].copy()
-        h, w = img.shape[:2]
-        img[int(h*CV_EXIT_QUEST_TITLE_MASK_Y1):int(h*CV_EXIT_QUEST_TITLE_MASK_Y2),
-            int(w*CV_EXIT_QUEST_TITLE_MASK_X1):int(w*CV_EXIT_QUEST_TITLE_MASK_Y2), :] = 0
+    def _is_exit_quest_scene(frame: image_process.Frame) -> bool:
+        # masking the gray image is the same as masking the RGB image before graying
+        gray = frame.gray((CV_EXIT_QUEST_Y1, CV_EXIT_QUEST_Y2, CV_EXIT_QUEST_X1, CV_EXIT_QUEST_X2)).copy()
+        h, w = gray.shape
+        gray[int(h*CV_EXIT_QUEST_TITLE_MASK_Y1):int(h*CV_EXIT_QUEST_TITLE_MASK_Y2),
+             int(w*CV_EXIT_QUEST_TITLE_MASK_X1):int(w*CV_EXIT_QUEST_TITLE_MASK_Y2)] = 0
         for i in range(len(CV_EXIT_QUEST_SERVANT_MASK_X1S)):
-            img[int(h*CV_EXIT_QUEST_SERVANT_MASK_Y1):int(h*CV_EXIT_QUEST_SERVANT_MASK_Y2),
-                int(w*CV_EXIT_QUEST_SERVANT_MASK_X1S[i]):int(w*CV_EXIT_QUEST_SERVANT_MASK_X2S[i]), :] = 0
-        gray = np.mean(img, -1) < CV_EXIT_QUEST_GRAY_THRESHOLD
+            gray[int(h*CV_EXIT_QUEST_SERVANT_MASK_Y1):int(h*CV_EXIT_QUEST_SERVANT_MASK_Y2),
+                 int(w*CV_EXIT_QUEST_SERVANT_MASK_X1S[i]):int(w*CV_EXIT_QUEST_SERVANT_MASK_X2S[i])] = 0
+        gray = gray < CV_EXIT_QUEST_GRAY_THRESHOLD
         ratio = np.mean(gray)
         logger.debug('DEBUG value: exit quest gray ratio: %f' % ratio)
         return ratio >= CV_EXIT_QUEST_GRAY_RATIO_THRESHOLD
@@ -89,9 +90,10 @@ class BattleLoopAttackHandler(ConfigurableStateHandler):
     #             min_digit = candidate_digit
     #     return min_digit
 
-    def _get_current_battle(self, img: np.ndarray) -> Tuple[int, int]:
-        img = img[CV_BATTLE_DETECTION_Y1:CV_BATTLE_DETECTION_Y2, CV_BATTLE_DETECTION_X1:CV_BATTLE_DETECTION_X2, :]
-        s = np.greater(image_process.rgb_to_hsv(img)[..., 2], CV_BATTLE_DIGIT_THRESHOLD)
+    def _get_current_battle(self, frame: image_process.Frame) -> Tuple[int, int]:
+        hsv = frame.hsv((CV_BATTLE_DETECTION_Y1, CV_BATTLE_DETECTION_Y2,
+                         CV_BATTLE_DETECTION_X1, CV_BATTLE_DETECTION_X2))
+        s = np.greater(hsv[..., 2], CV_BATTLE_DIGIT_THRESHOLD)
         s = s.astype('uint8') * 255
         # split digits
         rects = image_process.split_image(s)
@@ -107,14 +109,15 @@ class BattleLoopAttackHandler(ConfigurableStateHandler):
                                 ' or maybe recognition corrupted'
         # return self._digit_recognize(image_process.normalize_image(rects[0].get_image_segment(), [20, 10])), \
         #     self._digit_recognize(image_process.normalize_image(rects[-1].get_image_segment(), [20, 10]))
-        return self._digit_recognizer.recognize(rects[0].get_image_segment()), \
-            self._digit_recognizer.recognize(rects[-1].get_image_segment())
+        (current_battle, _), (max_battle, _) = self._digit_recognizer.recognize_batch(
+            [rects[0].get_image_segment(), rects[-1].get_image_segment()])
+        return current_battle, max_battle
 
     def run_and_transit_state(self) -> FgoState:
         var = self._cfg.DO_NOT_MODIFY_BATTLE_VARS
         if not var['SKIP_QUEST_INFO_DETECTION']:
-            img = self.attacher.get_screenshot(CV_SCREENSHOT_RESOLUTION_X, CV_SCREENSHOT_RESOLUTION_Y)[..., :3]
-            cur_battle, max_battle = self._get_current_battle(img)
+            frame = self.attacher.get_frame(CV_SCREENSHOT_RESOLUTION_X, CV_SCREENSHOT_RESOLUTION_Y)
+            cur_battle, max_battle = self._get_current_battle(frame)
             if cur_battle != var['CURRENT_BATTLE']:
                 var['TURN'] = 1  # reset turn
             else:
@@ -4,7 +4,6 @@ from click_positioning import *
 from time import sleep
 import image_process
 from cv_positioning import *
-from image_process import mean_gray_diff_err
 import logging
 from battle_control import ScriptConfiguration
 from .fgo_state import FgoState
@@ -29,17 +28,17 @@ class ExitQuestHandler(StateHandler):
 
 
 class FriendUIHandler(StateHandler):
-    _support_anchor = _imread_to_screen_size(CV_REQUEST_SUPPORT_UI_FILE)
+    _support_anchor = image_process.AnchorTemplate(_imread_to_screen_size(CV_REQUEST_SUPPORT_UI_FILE),
+                                                   CV_UI_ANCHOR_DOWNSAMPLE)
 
     def __init__(self, attacher: AbstractAttacher, forward_state: FgoState):
         self.attacher = attacher
         self.forward_state = forward_state
 
     def _is_in_requesting_friend_ui(self) -> bool:
-        img = self.attacher.get_screenshot(CV_SCREENSHOT_RESOLUTION_X, CV_SCREENSHOT_RESOLUTION_Y)
-        val = mean_gray_diff_err(image_process.resize(img, self._support_anchor.shape[1],
-                                                      self._support_anchor.shape[0]), self._support_anchor)
-        logger.debug('DEBUG value friend_ui mean_gray_diff_err = %f' % val)
+        frame = self.attacher.get_frame(CV_SCREENSHOT_RESOLUTION_X, CV_SCREENSHOT_RESOLUTION_Y)
+        val = self._support_anchor.compare(frame.rgb)
+        logger.debug('DEBUG value friend_ui anchor diff = %f' % val)
         return val < 10
 
     def run_and_transit_state(self) -> FgoState:
@@ -53,7 +52,8 @@ class FriendUIHandler(StateHandler):
 
 
 class ContinuousBattleHandler(ConfigurableStateHandler):
-    _anchor = _imread_to_screen_size(CV_CONTINUOUS_BATTLE_UI_FILE)
+    _anchor = image_process.AnchorTemplate(_imread_to_screen_size(CV_CONTINUOUS_BATTLE_UI_FILE),
+                                           CV_UI_ANCHOR_DOWNSAMPLE)
 
     def __init__(self, attacher: AbstractAttacher, forward_state_pos: FgoState, forward_state_neg: FgoState,
                  cfg: ScriptConfiguration):
@@ -63,9 +63,9 @@ class ContinuousBattleHandler(ConfigurableStateHandler):
         self.forward_state_neg = forward_state_neg
 
     def _is_in_continuous_battle_confirm_ui(self) -> bool:
-        img = self.attacher.get_screenshot(CV_SCREENSHOT_RESOLUTION_X, CV_SCREENSHOT_RESOLUTION_Y)
-        v = image_process.mean_gray_diff_err(self._anchor, img)
-        logger.debug('DEBUG value: is_in_continuous_battle_confirm_ui mean_gray_diff_err = %f' % v)
+        frame = self.attacher.get_frame(CV_SCREENSHOT_RESOLUTION_X, CV_SCREENSHOT_RESOLUTION_Y)
+        v = self._anchor.compare(frame.rgb)
+        logger.debug('DEBUG value: is_in_continuous_battle_confirm_ui anchor diff = %f' % v)
         return v < 10
 
     def run_and_transit_state(self) -> FgoState:
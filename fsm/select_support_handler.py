@@ -1,6 +1,6 @@
 from .state_handler import ConfigurableStateHandler, WaitFufuStateHandler
 from attacher import AbstractAttacher, MumuAttacher, AdbAttacher
-from matcher import SupportServantMatcher, SupportCraftEssenceMatcher
+from matcher import SupportServantMatcher, SupportCraftEssenceMatcher, warm_up_matchers
 import logging
 from typing import *
 from cv_positioning import *
@@ -61,13 +61,20 @@ class SelectSupportHandler(ConfigurableStateHandler):
         self._scroll_down_y = self._scroll_down_y_mapper[type(attacher)]
         self._digit_recognizer = DigitRecognizer(CV_SUPPORT_SKILL_DIGIT_DIR)
 
+    @classmethod
+    def warm_up(cls):
+        """
+        Load the support servant and craft essence database in background
+        """
+        warm_up_matchers([cls.servant_matcher, cls.craft_essence_matcher])
+
     def run_and_transit_state(self) -> FgoState:
         suc = False
         while True:
             sleep(0.5)
-            img = self.attacher.get_screenshot(CV_SCREENSHOT_RESOLUTION_X, CV_SCREENSHOT_RESOLUTION_Y)[..., :3]
-            support_range = self._split_support_image(img)
-            svt_data = self.match_support_servant(img, support_range)
+            frame = self.attacher.get_frame(CV_SCREENSHOT_RESOLUTION_X, CV_SCREENSHOT_RESOLUTION_Y)
+            support_range = self._split_support_image(frame)
+            svt_data = self.match_support_servant(frame, support_range)
             for i in range(len(svt_data)):
                 if self._check_config(svt_data[i]):
                     # servant matched
@@ -79,7 +86,7 @@ class SelectSupportHandler(ConfigurableStateHandler):
                     break
             if suc:
                 break
-            _, end_pos = self._get_scrollbar_pos(img)
+            _, end_pos = self._get_scrollbar_pos(frame)
             if 0.01 <= end_pos < 0.99:
                 self._action_scroll_down()
             else:
@@ -123,10 +130,9 @@ class SelectSupportHandler(ConfigurableStateHandler):
         sleep(1.5)
 
     @classmethod
-    def _split_support_image(cls, img: np.ndarray) -> List[Tuple[int, int]]:
+    def _split_support_image(cls, frame: image_process.Frame) -> List[Tuple[int, int]]:
         # new detection result begins here
-        part = img[:, CV_SUPPORT_DETECT_X1:CV_SUPPORT_DETECT_X2, :]
-        gray = np.mean(part, axis=2)
+        gray = frame.gray((0, frame.height, CV_SUPPORT_DETECT_X1, CV_SUPPORT_DETECT_X2))
         avg = np.mean(gray, axis=1)
         td = np.zeros_like(avg)
         td[:-CV_SUPPORT_TD_PIXEL] = avg[:-CV_SUPPORT_TD_PIXEL] - avg[CV_SUPPORT_TD_PIXEL:]
@@ -161,10 +167,10 @@ class SelectSupportHandler(ConfigurableStateHandler):
         return range_list
 
     @staticmethod
-    def _get_scrollbar_pos(img: np.ndarray) -> Tuple[float, float]:
-        scrollbar = img[CV_SUPPORT_SCROLLBAR_Y1:CV_SUPPORT_SCROLLBAR_Y2,
-                        CV_SUPPORT_SCROLLBAR_X1:CV_SUPPORT_SCROLLBAR_X2, :]
-        score = np.mean(np.mean(scrollbar, -1), -1) < CV_SUPPORT_BAR_GRAY_THRESHOLD
+    def _get_scrollbar_pos(frame: image_process.Frame) -> Tuple[float, float]:
+        scrollbar = frame.gray((CV_SUPPORT_SCROLLBAR_Y1, CV_SUPPORT_SCROLLBAR_Y2,
+                                CV_SUPPORT_SCROLLBAR_X1, CV_SUPPORT_SCROLLBAR_X2))
+        score = np.mean(scrollbar, -1) < CV_SUPPORT_BAR_GRAY_THRESHOLD
         start_y, end_y = 0, 0
         for y in range(score.shape[0]):
             if not score[y]:
@@ -186,10 +192,10 @@ class SelectSupportHandler(ConfigurableStateHandler):
             self.attacher.send_click(SUPPORT_REFRESH_BUTTON_X, SUPPORT_REFRESH_BUTTON_Y)
             sleep(0.5)
             # Check clickable
-            img = self.attacher.get_screenshot(CV_SCREENSHOT_RESOLUTION_X, CV_SCREENSHOT_RESOLUTION_Y)
-            img = image_process.rgb_to_hsv(img[..., :3])[
-                  CV_SUPPORT_REFRESH_REFUSED_DETECTION_Y1:CV_SUPPORT_REFRESH_REFUSED_DETECTION_Y2,
-                  CV_SUPPORT_REFRESH_REFUSED_DETECTION_X1:CV_SUPPORT_REFRESH_REFUSED_DETECTION_X2, 1]
+            img, = self.attacher.get_screenshot_regions([
+                (CV_SUPPORT_REFRESH_REFUSED_DETECTION_Y1, CV_SUPPORT_REFRESH_REFUSED_DETECTION_Y2,
+                 CV_SUPPORT_REFRESH_REFUSED_DETECTION_X1, CV_SUPPORT_REFRESH_REFUSED_DETECTION_X2)])
+            img = image_process.rgb_to_hsv(img[..., :3])[..., 1]
             if np.mean(img) < CV_SUPPORT_REFRESH_REFUSED_DETECTION_S_THRESHOLD:
                 self.attacher.send_click(SUPPORT_REFRESH_REFUSED_CONFIRM_X, SUPPORT_REFRESH_REFUSED_CONFIRM_Y)
                 logger.info('Could not refresh support temporarily, retry in 5 secs')
@@ -202,13 +208,23 @@ class SelectSupportHandler(ConfigurableStateHandler):
         assert WaitFufuStateHandler(self.attacher, FgoState.STATE_BEGIN).run_and_transit_state() == FgoState.STATE_BEGIN
         sleep(0.5)
 
-    def match_support_servant(self, img: np.ndarray, range_list: List[Tuple[int, int]]) -> List[SupportServant]:
+    def match_support_servant(self, frame: image_process.Frame,
+                              range_list: List[Tuple[int, int]]) -> List[SupportServant]:
         # match servant
         def _servant_empty_check(img1, img2):
             v = mean_gray_diff_err(image_process.resize(img1, img2.shape[1], img2.shape[0]), img2)
             logger.debug('DEBUG value: empty support servant check: mean_gray_diff_err = %f' % v)
             return v < 10
-        svt_id, t = self._wrap_call_matcher(self.servant_matcher.match, _servant_empty_check, img,
+        required_svt = self._support_svt
+        diagnostics = self._cfg.support_selection_diagnostics
+        # only the configured servant is compared unless any servant is acceptable or diagnostics is enabled, servant
+        # id is 0 for the rows those are not the configured one
+        verify_servant = required_svt is not None and required_svt.svt_id != 0 and not diagnostics
+        if verify_servant:
+            svt_matcher_func = lambda x: self.servant_matcher.verify(x, [required_svt.svt_id])[0]
+        else:
+            svt_matcher_func = self.servant_matcher.match
+        svt_id, t = self._wrap_call_matcher(svt_matcher_func, _servant_empty_check, frame,
                                             self._support_empty_img, range_list)
         logger.debug('Detected support servant ID: %s (used %f sec(s))' % (str(svt_id), t))
 
@@ -221,8 +237,17 @@ class SelectSupportHandler(ConfigurableStateHandler):
             logger.debug('DEBUG value: empty support craft essence check: mean_gray_diff_err = %f' % v)
             return v < 10
         # todo fix bug when empty servant and non-empty craft essence
-        ce_id, t = self._wrap_call_matcher(self.craft_essence_matcher.match, _craft_essence_empty_check, img,
-                                           self._support_craft_essence_img, range_list)
+        skip_list = None
+        ce_matcher_func = self.craft_essence_matcher.match
+        if required_svt is not None and not diagnostics:
+            if verify_servant:
+                # the rows of other servants could not satisfy the configuration whatever the craft essence is
+                skip_list = [x == 0 for x in svt_id]
+            candidate_ce_ids = [x.id for x in required_svt.craft_essence_cfg]
+            if len(candidate_ce_ids) > 0 and 0 not in candidate_ce_ids:
+                ce_matcher_func = lambda x: self.craft_essence_matcher.verify(x, candidate_ce_ids)[0]
+        ce_id, t = self._wrap_call_matcher(ce_matcher_func, _craft_essence_empty_check, frame,
+                                           self._support_craft_essence_img, range_list, skip_list)
         logger.debug('Detected support craft essence ID: %s (used %f sec(s))' % (str(ce_id), t))
         ret_list = [SupportServant(x, y) for x, y in zip(svt_id, ce_id)]
         for i, (y1, y2) in enumerate(range_list):
@@ -230,7 +255,7 @@ class SelectSupportHandler(ConfigurableStateHandler):
             if ce_id[i] == 0:
                 ret_list[i].craft_essence_max_break = False
             else:
-                icon = img[y1:y2, CV_SUPPORT_SERVANT_X1:CV_SUPPORT_SERVANT_X2, :]
+                icon = frame.roi((y1, y2, CV_SUPPORT_SERVANT_X1, CV_SUPPORT_SERVANT_X2))
                 icon = icon[CV_SUPPORT_CRAFT_ESSENCE_MAX_BREAK_Y1:CV_SUPPORT_CRAFT_ESSENCE_MAX_BREAK_Y2,
                             CV_SUPPORT_CRAFT_ESSENCE_MAX_BREAK_X1:CV_SUPPORT_CRAFT_ESSENCE_MAX_BREAK_X2, :]
                 if self._support_craft_essence_img_resized is None:
@@ -249,8 +274,8 @@ class SelectSupportHandler(ConfigurableStateHandler):
             if svt_id[i] == 0:
                 continue
             # detect friend state
-            friend_img = img[y1+CV_SUPPORT_FRIEND_DETECT_Y1:y1+CV_SUPPORT_FRIEND_DETECT_Y2,
-                             CV_SUPPORT_FRIEND_DETECT_X1:CV_SUPPORT_FRIEND_DETECT_X2, :]
+            friend_img = frame.roi((y1+CV_SUPPORT_FRIEND_DETECT_Y1, y1+CV_SUPPORT_FRIEND_DETECT_Y2,
+                                    CV_SUPPORT_FRIEND_DETECT_X1, CV_SUPPORT_FRIEND_DETECT_X2))
             # omit B channel here
             friend_part_binary = np.greater_equal(np.mean(friend_img[..., :2], 2),
                                                   CV_SUPPORT_FRIEND_DISCRETE_THRESHOLD)
@@ -258,9 +283,9 @@ class SelectSupportHandler(ConfigurableStateHandler):
             ret_list[i].is_friend = is_friend
 
             # skill level detection
-            skill_img = img[y1+CV_SUPPORT_SKILL_BOX_OFFSET_Y:y1+CV_SUPPORT_SKILL_BOX_OFFSET_Y+CV_SUPPORT_SKILL_BOX_SIZE,
-                            CV_SUPPORT_SKILL_BOX_OFFSET_X1:CV_SUPPORT_SKILL_BOX_OFFSET_X2, :3].copy()
-            gray = np.mean(skill_img, -1)
+            skill_y1 = y1 + CV_SUPPORT_SKILL_BOX_OFFSET_Y
+            skill_y2 = skill_y1 + CV_SUPPORT_SKILL_BOX_SIZE
+            gray = frame.gray((skill_y1, skill_y2, CV_SUPPORT_SKILL_BOX_OFFSET_X1, CV_SUPPORT_SKILL_BOX_OFFSET_X2))
             vertical_diff = np.zeros_like(gray, dtype=np.float32)
             step_size = CV_SUPPORT_SKILL_V_DIFF_STEP_SIZE  # pixel offset for computing abs difference
             vertical_diff[:-step_size, :] = np.abs(gray[:-step_size, :] - gray[step_size:, :])
@@ -274,18 +299,19 @@ class SelectSupportHandler(ConfigurableStateHandler):
                                         np.max(v_diff_current_skill[-edge_size:]))
                 if max_v_diff > CV_SUPPORT_SKILL_V_DIFF_THRESHOLD:
                     # digit recognition, using SSIM metric, split by S (-> 0) and V (-> 255)
-                    current_skill_img = skill_img[:, begin_x:begin_x + CV_SUPPORT_SKILL_BOX_SIZE, :]
-                    hsv = image_process.rgb_to_hsv(current_skill_img).astype(np.float32)
+                    hsv = frame.hsv((skill_y1, skill_y2, CV_SUPPORT_SKILL_BOX_OFFSET_X1S[j],
+                                     CV_SUPPORT_SKILL_BOX_OFFSET_X2S[j])).astype(np.float32)
                     img_digit_part = (1. - hsv[..., 1] / 255.) * (hsv[..., 2] / 255.)
                     img_digit_part = img_digit_part[30:, 3:30]
                     bin_digits = np.greater_equal(img_digit_part, CV_SUPPORT_SKILL_BINARIZATION_THRESHOLD)
                     digit_segments = image_process.split_image(bin_digits)
-                    digits = []
+                    digit_imgs = []
                     for segment in sorted(digit_segments, key=lambda x: (x.max_x + x.min_x)):
                         if 50 < segment.associated_pixels.shape[0] < 150 \
                                 and abs(segment.min_y + segment.max_y - 26) <= 3 \
                                 and segment.max_x - segment.min_x < 14 <= segment.max_y - segment.min_y:
-                            digits.append(self._digit_recognizer.recognize(segment.get_image_segment()))
+                            digit_imgs.append(segment.get_image_segment())
+                    digits = [x[0] for x in self._digit_recognizer.recognize_batch(digit_imgs)]
                     if len(digits) == 2:
                         skill_lvl = digits[0] * 10 + digits[1]
                         if skill_lvl != 10:
@@ -306,12 +332,16 @@ class SelectSupportHandler(ConfigurableStateHandler):
     @staticmethod
     def _wrap_call_matcher(func: Callable[[np.ndarray], int],
                            empty_check_func: Callable[[np.ndarray, np.ndarray], bool],
-                           img: np.ndarray, empty_img: Union[np.ndarray, None],
-                           range_list: List[Tuple[int, int]]) -> Tuple[List[int], float]:
+                           frame: image_process.Frame, empty_img: Union[np.ndarray, None],
+                           range_list: List[Tuple[int, int]],
+                           skip_list: Optional[List[bool]] = None) -> Tuple[List[int], float]:
         t = time()
         ret = []
-        for y1, y2 in range_list:
-            icon = img[y1:y2, CV_SUPPORT_SERVANT_X1:CV_SUPPORT_SERVANT_X2, :]
+        for i, (y1, y2) in enumerate(range_list):
+            if skip_list is not None and skip_list[i]:
+                ret.append(0)
+                continue
+            icon = frame.roi((y1, y2, CV_SUPPORT_SERVANT_X1, CV_SUPPORT_SERVANT_X2))
             if empty_img is not None and empty_check_func(icon, empty_img):
                 ret.append(0)
             else:
@@ -1,12 +1,14 @@
+from ._backend_determine import backend_function, backend_name, register_backend_sample, autotune_backends
 from .resize import resize
 from .imread import imread
-from .rgb_hsv import rgb_to_hsv, hsv_to_rgb
+from .rgb_hsv import rgb_to_hsv, hsv_to_rgb, downsample_hsv, hsv_hue_period
 from .imdecode import imdecode
 from .imcmp import *
+from .anchor_template import AnchorTemplate
+from .frame import Frame
 from ._cv_sift_import import sift_class
-from .bk_tree import BKTree
-from .image_hash_cacher import ImageHashCacher
-from .phash import perception_hash
+from .bk_tree import BKTree, HammingIndex
+from .image_hash_cacher import ImageHashCacher, gray_thumbnail
+from .phash import perception_hash, perception_hash_batch, PERCEPTION_HASH_VERSION
 from .gauss_blur import gauss_blur
 from .misc import extend_alpha_1px, split_image, ImageSegment, normalize_image, read_digit_label_dir
-from .run_benchmark import run_all_benchmark
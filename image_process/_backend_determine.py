@@ -1,6 +1,12 @@
-__all__ = ['backend_call', 'backend_support', 'backend_determine']
+__all__ = ['backend_call', 'backend_support', 'backend_determine', 'backend_function', 'backend_name',
+           'bind_backend', 'register_backend_sample', 'sample_image', 'autotune_backends']
 from typing import *
 import logging
+import json
+import os
+import sys
+import numpy as np
+from time import perf_counter
 
 logger = logging.getLogger('bgo_script.image_process')
 
@@ -55,20 +61,259 @@ _cached_backend_funcs = {}  # type: Dict[str, Dict[int, List[Callable]]]
 _determined_funcs = {}  # type: Dict[str, Any]
 
 
+def _candidate_funcs(group_name: str) -> List[Callable]:
+    func_prior_dict = _cached_backend_funcs.get(group_name, None)
+    if func_prior_dict is None:
+        raise KeyError(f'Group {group_name} is not presented, check your annotations.')
+    func_list = []
+    for prior in sorted(func_prior_dict.keys(), reverse=True):
+        func_list.extend(func_prior_dict[prior])
+    if len(func_list) == 0:
+        raise ValueError(f'Group {group_name} has no available function.')
+    return func_list
+
+
 def backend_call(group_name: str, *args, **kwargs):
     func = _determined_funcs.get(group_name, None)
     if func is None:
-        func_prior_dict = _cached_backend_funcs.get(group_name, None)
-        if func_prior_dict is None:
-            raise KeyError(f'Group {group_name} is not presented, check your annotations.')
-        func_list = []
-        for prior in sorted(func_prior_dict.keys(), reverse=True):
-            func_list.extend(func_prior_dict[prior])
-        if len(func_list) == 0:
-            raise ValueError(f'Group {group_name} has no available function.')
-        func, ret_val = backend_determine(func_list, args, kwargs)
-        _determined_funcs[group_name] = func
+        func, ret_val = backend_determine(_candidate_funcs(group_name), args, kwargs)
+        _set_determined_func(group_name, func)
         logger.debug(f'Selected {str(func)} for group "{group_name}"')
         return ret_val
     else:
         return func(*args, **kwargs)
+
+
+# Autotune support
+# Usage:
+# register_backend_sample('resize', lambda: {'img': ..., 'width': 96, 'height': 96}, tolerance=0.1)
+# autotune_backends('cv_data/backend_autotune.json')  # at startup
+# resize_func = backend_function('resize')  # direct reference, skips per-call dispatch
+# _resize_func = bind_backend('resize', globals(), '_resize_func')  # module global, re-bound after autotune
+class _BackendSample:
+    def __init__(self, kwargs_factory: Callable[[], Dict[str, Any]], tolerance: float,
+                 diff_func: Optional[Callable[[Any, Any], float]]):
+        self.kwargs_factory = kwargs_factory
+        self.tolerance = tolerance
+        self.diff_func = diff_func
+
+
+_backend_samples = {}  # type: Dict[str, _BackendSample]
+_backend_bindings = {}  # type: Dict[str, List[Tuple[Dict[str, Any], str]]]
+AUTOTUNE_FORMAT_VERSION = 1
+
+
+def register_backend_sample(group_name: str, kwargs_factory: Callable[[], Dict[str, Any]], tolerance: float = 0.1,
+                            diff_func: Optional[Callable[[Any, Any], float]] = None):
+    """
+    Register representative arguments of a redundancy group, used for determining the backend without calling the
+    public function and autotuning
+
+    :param group_name: The name of redundancy group
+    :param kwargs_factory: A callable returning the keyword arguments of a representative call
+    :param tolerance: The maximum difference between the output of a candidate function and the default one (the
+     highest priority available function), candidates exceeding the tolerance are never selected by autotuning
+    :param diff_func: A callable computing the difference of two outputs, default: mean absolute difference of arrays
+    :return: null
+    """
+    _backend_samples[group_name] = _BackendSample(kwargs_factory, tolerance, diff_func)
+
+
+def sample_image(height: int, width: int, channels: int, seed: int = 0) -> np.ndarray:
+    """
+    Generate a screenshot-like image for backend samples: smooth gradients with a few flat rectangles (hard edges),
+    random noise is not representative since the outputs of different interpolations diverge far more on it
+
+    :param height: image height
+    :param width: image width
+    :param channels: number of channels
+    :param seed: random seed
+    :return: the image in uint8, shapes (height, width, channels)
+    """
+    rng = np.random.RandomState(seed)
+    cell = 16
+    coarse = rng.uniform(0, 255, [height // cell + 2, width // cell + 2, channels])
+    ys, xs = np.arange(height) / cell, np.arange(width) / cell
+    y0, x0 = ys.astype(np.int64), xs.astype(np.int64)
+    fy, fx = (ys - y0)[:, None, None], (xs - x0)[None, :, None]
+    top = coarse[y0][:, x0] * (1 - fx) + coarse[y0][:, x0 + 1] * fx
+    bottom = coarse[y0 + 1][:, x0] * (1 - fx) + coarse[y0 + 1][:, x0 + 1] * fx
+    img = np.round(top * (1 - fy) + bottom * fy).astype(np.uint8)
+    for _ in range(4):
+        y1, x1 = rng.randint(0, height // 2), rng.randint(0, width // 2)
+        img[y1:y1 + height // 4, x1:x1 + width // 4] = rng.randint(0, 256, channels)
+    return img
+
+
+def _default_diff(a: Any, b: Any) -> float:
+    if isinstance(a, tuple) and isinstance(b, tuple):
+        if len(a) != len(b):
+            return float('inf')
+        return max([_default_diff(x, y) for x, y in zip(a, b)] + [0.0])
+    if isinstance(a, np.ndarray) and isinstance(b, np.ndarray):
+        if a.shape != b.shape:
+            return float('inf')
+        return float(np.mean(np.abs(a.astype(np.float64) - b)))
+    return 0.0 if a == b else float('inf')
+
+
+def backend_function(group_name: str) -> Callable:
+    """
+    Get the selected function of a redundancy group, hot call sites may keep the returned reference to skip the per-call
+    dispatch of backend_call. The representative arguments must be registered if no function has been selected yet.
+
+    :param group_name: The name of redundancy group
+    :return: the selected function, which has the same signature as the functions annotated by backend_support
+    """
+    func = _determined_funcs.get(group_name, None)
+    if func is None:
+        sample = _backend_samples.get(group_name, None)
+        if sample is None:
+            raise KeyError(f'Group {group_name} has no registered sample, call backend_call instead')
+        func, _ = backend_determine(_candidate_funcs(group_name), kwargs=sample.kwargs_factory())
+        _set_determined_func(group_name, func)
+        logger.debug(f'Selected {str(func)} for group "{group_name}"')
+    return func
+
+
+def backend_name(group_name: str) -> str:
+    """
+    Get the qualified name of the selected function of a redundancy group (the function is selected if not yet), used
+    for invalidating the data produced by a different backend (e.g. pre-computed features)
+
+    :param group_name: The name of redundancy group, must have a registered sample
+    :return: the name of the selected function, e.g. "image_process.resize._resize_opencv"
+    """
+    return _func_name(backend_function(group_name))
+
+
+def _set_determined_func(group_name: str, func: Callable):
+    _determined_funcs[group_name] = func
+    for namespace, name in _backend_bindings.get(group_name, []):
+        namespace[name] = func
+
+
+def bind_backend(group_name: str, namespace: Dict[str, Any], name: str) -> Callable:
+    """
+    Bind the selected function of a redundancy group to a global variable of the caller module, so that hot call sites
+    call the selected function directly without any per-call dispatch. The variable is re-bound whenever the selection
+    is changed (e.g. by autotuning).
+
+    :param group_name: The name of redundancy group
+    :param namespace: The globals() of the caller module
+    :param name: The name of the global variable
+    :return: the function to be assigned to the variable, which selects the function on its first call if no function
+     has been selected yet
+    """
+    _backend_bindings.setdefault(group_name, []).append((namespace, name))
+    func = _determined_funcs.get(group_name, None)
+    if func is not None:
+        return func
+
+    def _select_and_call(*args, **kwargs):
+        return backend_function(group_name)(*args, **kwargs)
+    return _select_and_call
+
+
+def _func_name(func: Callable) -> str:
+    return f'{func.__module__}.{func.__qualname__}'
+
+
+def _module_version(module_name: str) -> str:
+    try:
+        module = __import__(module_name)
+    except ImportError:
+        return f'{module_name}:none'
+    return f'{module_name}:{getattr(module, "__version__", "unknown")}'
+
+
+def _autotune_environment() -> str:
+    # the cached choices are invalidated when the interpreter, the backend libraries or candidate functions are changed
+    names = sorted([_func_name(f) for group in _backend_samples for f in _candidate_funcs(group)])
+    versions = [_module_version(x) for x in ['cv2', 'PIL', 'skimage', 'scipy']]
+    return '|'.join([sys.version, np.__version__] + versions + names)
+
+
+def _benchmark_group(group_name: str, repeat: int) -> Optional[Callable]:
+    sample = _backend_samples[group_name]
+    kwargs = sample.kwargs_factory()
+    diff_func = _default_diff if sample.diff_func is None else sample.diff_func
+    reference = None
+    best_func, best_time = None, float('inf')
+    for func in _candidate_funcs(group_name):
+        try:
+            output = func(**kwargs)
+        except ImportError:
+            continue
+        except Exception as ex:
+            # e.g. API removed in newer version of the backend library
+            logger.warning(f'Autotune "{group_name}": {_func_name(func)} skipped, it raised an exception', exc_info=ex)
+            continue
+        if reference is None:
+            # the default selection of backend_call is the reference
+            reference = output
+        else:
+            diff = diff_func(reference, output)
+            if diff > sample.tolerance:
+                logger.debug(f'Autotune "{group_name}": {_func_name(func)} rejected, difference {diff} exceeds '
+                             f'tolerance {sample.tolerance}')
+                continue
+        elapsed = []
+        for _ in range(repeat):
+            t = perf_counter()
+            func(**kwargs)
+            elapsed.append(perf_counter() - t)
+        median = float(np.median(elapsed))
+        logger.debug(f'Autotune "{group_name}": {_func_name(func)} median time {median * 1000:.3f} ms')
+        if median < best_time:
+            best_func, best_time = func, median
+    return best_func
+
+
+def autotune_backends(cache_file: Optional[str] = None, repeat: int = 10) -> Dict[str, str]:
+    """
+    Select the fastest function for each redundancy group with registered sample, by micro-benchmarking all available
+    candidates whose outputs are within the parity tolerance. The choices are loaded from the cache file if it is
+    valid, or saved to it otherwise.
+
+    :param cache_file: The path of the JSON cache file, None to disable the cache
+    :param repeat: The number of timed calls of each candidate
+    :return: A dict mapping the group name to the selected function name
+    """
+    environment = _autotune_environment()
+    choices = None
+    if cache_file is not None and os.path.isfile(cache_file):
+        try:
+            with open(cache_file, 'r', encoding='utf8') as f:
+                state = json.load(f)
+            if state.get('version', None) == AUTOTUNE_FORMAT_VERSION and state.get('environment', None) == environment:
+                choices = state['choices']
+            else:
+                logger.info('Backend autotune cache %s is outdated, ignored' % cache_file)
+        except (OSError, ValueError, KeyError) as ex:
+            logger.warning('Failed to load backend autotune cache from %s' % cache_file, exc_info=ex)
+    if choices is not None:
+        for group_name, name in choices.items():
+            func_dict = {_func_name(f): f for f in _candidate_funcs(group_name)} \
+                if group_name in _cached_backend_funcs else {}
+            if name in func_dict:
+                _set_determined_func(group_name, func_dict[name])
+        logger.info('Loaded backend autotune result from %s: %s' % (cache_file, str(choices)))
+        return choices
+    choices = {}
+    for group_name in sorted(_backend_samples):
+        func = _benchmark_group(group_name, repeat)
+        if func is None:
+            logger.warning(f'Autotune "{group_name}": no available function')
+            continue
+        _set_determined_func(group_name, func)
+        choices[group_name] = _func_name(func)
+    logger.info('Backend autotune result: %s' % str(choices))
+    if cache_file is not None:
+        try:
+            with open(cache_file, 'w', encoding='utf8') as f:
+                json.dump({'version': AUTOTUNE_FORMAT_VERSION, 'environment': environment, 'choices': choices}, f,
+                          indent=2)
+        except OSError as ex:
+            logger.warning('Failed to save backend autotune cache to %s' % cache_file, exc_info=ex)
+    return choices
@@ -0,0 +1,71 @@
+import numpy as np
+from typing import *
+from threading import Lock
+from .imcmp import split_gray_alpha
+from .resize import resize
+
+
+class AnchorTemplate:
+    """
+    Pre-compiled anchor image for repeated comparison against screenshots (or fixed regions of screenshots). The gray
+    scale, alpha weights and the region covered by non-transparent pixels of the anchor are computed once, the
+    comparison is done in integer arithmetic over the (downsampled) region with pre-allocated scratch buffers.
+
+    The comparison gives the same value as mean_gray_diff_err(anchor, img) (with default arguments) when downsample is
+    1, and the alpha channel of the compared image (if any) is ignored, that is, it is assumed to be fully opaque.
+    """
+    def __init__(self, anchor: np.ndarray, downsample: int = 1):
+        """
+        :param anchor: the anchor image, shapes (h, w), (h, w, 3) or (h, w, 4), the compared images must have the same
+            height and width
+        :param downsample: the sampling stride of both height and width
+        """
+        gray, alpha = split_gray_alpha(anchor)
+        self.shape = gray.shape
+        self.downsample = downsample
+        # the bounding box of non-transparent pixels, aligned to the sampling grid
+        ys, xs = np.nonzero(alpha)
+        if len(ys) == 0:
+            ys, xs = np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64)
+        self.y1 = int(ys.min()) // downsample * downsample
+        self.x1 = int(xs.min()) // downsample * downsample
+        self.y2 = int(ys.max()) + 1
+        self.x2 = int(xs.max()) + 1
+        roi = (slice(self.y1, self.y2, downsample), slice(self.x1, self.x2, downsample))
+        self._gray = gray[roi].astype(np.int32)
+        self._alpha = alpha[roi].astype(np.int32)
+        # the transparent pixels outside the region are also counted, as mean_gray_diff_err does
+        self._scale = 255.0 * (-(-self.shape[0] // downsample)) * (-(-self.shape[1] // downsample))
+        self._buffer = np.empty_like(self._gray)
+        self._lock = Lock()
+
+    def _roi(self, img: np.ndarray) -> np.ndarray:
+        return img[self.y1:self.y2:self.downsample, self.x1:self.x2:self.downsample, ...]
+
+    def compare(self, img: np.ndarray) -> float:
+        """
+        Compute the mean absolute gray difference between the anchor and the image
+
+        :param img: image array, shapes (h, w), (h, w, 3) or (h, w, 4), it is resized to the shape of the anchor if the
+            shape is mismatched
+        :return: the alpha weighted mean absolute gray difference
+        """
+        if img.shape[:2] != self.shape:
+            img = resize(img, self.shape[1], self.shape[0])
+        roi = self._roi(img)
+        with self._lock:
+            buffer = self._buffer
+            if len(roi.shape) == 3:
+                # round(mean(r, g, b)) == (r + g + b + 1) // 3, since the fraction part is never 0.5
+                np.add.reduce(roi[..., :3], axis=-1, dtype=np.int32, out=buffer)
+                buffer += 1
+                buffer //= 3
+            elif roi.dtype == np.uint8:
+                buffer[...] = roi
+            else:
+                np.rint(roi, out=buffer, casting='unsafe')
+            buffer -= self._gray
+            np.abs(buffer, out=buffer)
+            buffer *= self._alpha
+            total = int(np.sum(buffer, dtype=np.int64))
+        return total / self._scale
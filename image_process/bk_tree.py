@@ -1,11 +1,18 @@
 # B-K Tree, original implemented in project image-hash
 # Author: Zhou Xuebin
-# Version: 1.0
+# Version: 1.2
 # Changelog:
-#
+# v1.1: added array-backed HammingIndex, replaced the list queue of BKTree with deque
+# v1.2: added save / load
 
 import numpy as np
+import os
+from collections import deque
 from typing import *
+from util.compressed_pickle import pickle_dump, pickle_load
+
+# bump this value if the on-disk format of the trees / indices is changed
+PERSIST_FORMAT_VERSION = 1
 
 # quick hamming distance lookup
 _nbits = np.array(
@@ -24,14 +31,53 @@ _nbits = np.array(
 
 
 def hamming_distance_i64(x: int, y: int) -> int:
-    xor_result = x ^ y
-    return _nbits[xor_result & 0xff] + _nbits[(xor_result >> 8) & 0xff] + _nbits[(xor_result >> 16) & 0xff] + \
-        _nbits[(xor_result >> 24) & 0xff] + _nbits[(xor_result >> 32) & 0xff] + _nbits[(xor_result >> 40) & 0xff] + \
-        _nbits[(xor_result >> 48) & 0xff] + _nbits[(xor_result >> 56) & 0xff]
+    # popcount of python int is much faster than the table lookups of numpy scalars
+    return bin(x ^ y).count('1')
 
 
 def hamming_distance_i128(x: int, y: int) -> int:
-    return hamming_distance_i64(x >> 64, y >> 64) + hamming_distance_i64(x & 0xffffffff, y & 0xffffffff)
+    return bin(x ^ y).count('1')
+
+
+def save_versioned(path: str, kind: str, payload: Any):
+    """
+    Save the payload to file in compressed pickle format along with its kind and format version, the file is written
+    to a temporary file first then replaced, so a broken file will never be loaded
+    :param path: file path
+    :param kind: the kind of payload, checked on loading
+    :param payload: the data to save
+    """
+    with open(path + '.tmp', 'wb') as f:
+        pickle_dump({'kind': kind, 'version': PERSIST_FORMAT_VERSION, 'payload': payload}, f)
+    os.replace(path + '.tmp', path)
+
+
+def load_versioned(path: str, kind: str) -> Any:
+    """
+    Load the payload saved by save_versioned
+    :param path: file path
+    :param kind: the expected kind of payload
+    :return: the payload
+    :raises ValueError: if the kind or version does not match
+    """
+    with open(path, 'rb') as f:
+        data = pickle_load(f)
+    if not isinstance(data, dict) or data.get('kind', None) != kind:
+        raise ValueError('File %s is not a saved %s' % (path, kind))
+    if data.get('version', None) != PERSIST_FORMAT_VERSION:
+        raise ValueError('Incompatible format version of %s: expected %d, but got %s' %
+                         (path, PERSIST_FORMAT_VERSION, str(data.get('version', None))))
+    return data['payload']
+
+
+def _popcount_u64(x: np.ndarray) -> np.ndarray:
+    """
+    Vectorized popcount of uint64 array, sums over the last axis (words)
+    """
+    if hasattr(np, 'bitwise_count'):
+        # numpy >= 2.0
+        return np.sum(np.bitwise_count(x), axis=-1, dtype=np.int32)
+    return np.sum(_nbits[x.view(np.uint8)], axis=-1, dtype=np.int32)
 
 
 class KeyValuePairTreeNode:
@@ -84,10 +130,10 @@ class BKTree:
         """
         if self.root is None:
             return []
-        nodes = [self.root]
+        nodes = deque([self.root])
         ret_list = []
         while len(nodes) > 0:
-            node = nodes.pop(0)
+            node = nodes.popleft()
             distance = hamming_distance_i64(node.key, query)
             if distance <= tol:
                 ret_list.append((node.value, int(node.key), int(distance)))
@@ -97,3 +143,175 @@ class BKTree:
                 if min_range <= child_distance <= max_range:
                     nodes.append(node.children[child_distance])
         return ret_list
+
+    def query_many(self, queries: Sequence[int], tol: int) -> List[List[Tuple[Any, int, int]]]:
+        """
+        querying multiple points, see approximate_query
+        :param queries: query points
+        :param tol: tolerance
+        :return: the results of each query point
+        """
+        return [self.approximate_query(x, tol) for x in queries]
+
+    def save(self, path: str):
+        """
+        saving the tree to file, nodes are flattened in breadth-first order (values must be picklable)
+        :param path: file path
+        """
+        nodes = []
+        queue = deque([self.root] if self.root is not None else [])
+        while len(queue) > 0:
+            node = queue.popleft()
+            nodes.append((node.key, node.value))
+            queue.extend(node.children.values())
+        save_versioned(path, 'BKTree', nodes)
+
+    @classmethod
+    def load(cls, path: str) -> 'BKTree':
+        """
+        loading the tree saved by save, re-inserting the nodes in breadth-first order rebuilds the same tree
+        :param path: file path
+        :return: the loaded tree
+        """
+        tree = cls()
+        for key, values in load_versioned(path, 'BKTree'):
+            for value in values:
+                tree.add_node(key, value)
+        return tree
+
+
+# Flat hamming index backed by contiguous uint64 array, all keys are compared at once with vectorized popcount, which
+# is much faster than walking the BK-Tree in python for the cache sizes used here (up to thousands of keys)
+class HammingIndex:
+    def __init__(self, words: int = 1, initial_capacity: int = 64):
+        """
+        :param words: the number of 64-bit words of each key, keys longer than 64 * words bits are rejected
+        :param initial_capacity: initial capacity of the key array, it grows by doubling
+        """
+        self.words = words
+        self._keys = np.zeros([max(initial_capacity, 1), words], dtype=np.uint64)
+        self._key_ints = []  # type: List[int]
+        self._values = []  # type: List[List[Any]]
+        self._key_to_index = {}  # type: Dict[int, int]
+
+    def __len__(self):
+        return len(self._key_ints)
+
+    def _key_to_words(self, key: int) -> np.ndarray:
+        if key < 0 or key >> (64 * self.words) != 0:
+            raise ValueError('Key %d exceeds %d bits' % (key, 64 * self.words))
+        return np.array([(key >> (64 * i)) & 0xffffffffffffffff for i in range(self.words)], dtype=np.uint64)
+
+    def add_node(self, key: int, value: Any):
+        """
+        adding a key-value into index, values of the same key are grouped together
+        :param key: non-negative int key, compared in hamming distance
+        :param value: value of current node
+        :return: none
+        """
+        idx = self._key_to_index.get(key, None)
+        if idx is not None:
+            self._values[idx].append(value)
+            return
+        idx = len(self._key_ints)
+        if idx == self._keys.shape[0]:
+            self._keys = np.concatenate([self._keys, np.zeros_like(self._keys)], 0)
+        self._keys[idx] = self._key_to_words(key)
+        self._key_ints.append(key)
+        self._values.append([value])
+        self._key_to_index[key] = idx
+
+    def remove_node(self, key: int, value: Any) -> bool:
+        """
+        removing a key-value from index, the key is removed once all its values are removed
+        :param key: key of the node
+        :param value: the value to be removed, compared by equality
+        :return: whether the key-value is found and removed
+        """
+        idx = self._key_to_index.get(key, None)
+        if idx is None or value not in self._values[idx]:
+            return False
+        self._values[idx].remove(value)
+        if len(self._values[idx]) > 0:
+            return True
+        # move the last key to the removed slot
+        last = len(self._key_ints) - 1
+        del self._key_to_index[key]
+        if idx != last:
+            self._keys[idx] = self._keys[last]
+            self._key_ints[idx] = self._key_ints[last]
+            self._values[idx] = self._values[last]
+            self._key_to_index[self._key_ints[idx]] = idx
+        self._key_ints.pop()
+        self._values.pop()
+        return True
+
+    def distances(self, query: int) -> np.ndarray:
+        """
+        hamming distances from the query point to all keys, in insertion order
+        :param query: query point
+        :return: int32 array of distances
+        """
+        n = len(self._key_ints)
+        return _popcount_u64(np.bitwise_xor(self._keys[:n], self._key_to_words(query)))
+
+    def approximate_query(self, query: int, tol: int) -> List[Tuple[Any, int, int]]:
+        """
+        querying all values with a distance tolerance (tol) specified to the query point, returns a list of
+        tuples (values, key, distance), same as BKTree
+        :param query: query point
+        :param tol: tolerance
+        :return: all candidate values within the tolerance distance, sorted by distance
+        """
+        if len(self._key_ints) == 0:
+            return []
+        dist = self.distances(query)
+        indices = np.nonzero(dist <= tol)[0]
+        indices = indices[np.argsort(dist[indices], kind='stable')]
+        return [(self._values[i], self._key_ints[i], int(dist[i])) for i in indices]
+
+    def save(self, path: str):
+        """
+        saving the index to file (values must be picklable)
+        :param path: file path
+        """
+        n = len(self._key_ints)
+        save_versioned(path, 'HammingIndex', (self.words, self._keys[:n].copy(), self._key_ints, self._values))
+
+    @classmethod
+    def load(cls, path: str) -> 'HammingIndex':
+        """
+        loading the index saved by save
+        :param path: file path
+        :return: the loaded index
+        """
+        words, keys, key_ints, values = load_versioned(path, 'HammingIndex')
+        index = cls(words, max(len(key_ints), 1))
+        index._keys[:len(key_ints)] = keys
+        index._key_ints = list(key_ints)
+        index._values = [list(x) for x in values]
+        index._key_to_index = {x: i for i, x in enumerate(index._key_ints)}
+        return index
+
+    def query_many(self, queries: Sequence[int], tol: int, chunk_size: int = 256) -> List[List[Tuple[Any, int, int]]]:
+        """
+        querying multiple points in one pass, see approximate_query
+        :param queries: query points
+        :param tol: tolerance
+        :param chunk_size: the number of query points compared at once, bounds the (chunk_size, n) distance matrix
+        :return: the results of each query point
+        """
+        n = len(self._key_ints)
+        if n == 0:
+            return [[] for _ in queries]
+        query_words = np.stack([self._key_to_words(x) for x in queries], 0) if len(queries) > 0 else \
+            np.zeros([0, self.words], dtype=np.uint64)
+        ret_list = []
+        for begin in range(0, query_words.shape[0], chunk_size):
+            chunk = query_words[begin:begin+chunk_size]
+            dist = _popcount_u64(np.bitwise_xor(chunk[:, None, :], self._keys[None, :n, :]))
+            for row in dist:
+                indices = np.nonzero(row <= tol)[0]
+                indices = indices[np.argsort(row[indices], kind='stable')]
+                ret_list.append([(self._values[i], self._key_ints[i], int(row[i])) for i in indices])
+        return ret_list
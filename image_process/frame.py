@@ -0,0 +1,73 @@
+import numpy as np
+from typing import *
+from .rgb_hsv import rgb_to_hsv
+
+# (y1, y2, x1, x2) in pixels, the same order as slicing the image
+Roi = Tuple[int, int, int, int]
+
+
+class Frame:
+    """
+    A captured screenshot with lazily computed and memoized derived representations (gray scale, HSV and the regions
+    of interest of them), so that each conversion is performed at most once per captured frame no matter how many
+    handlers or detectors consume it.
+
+    The derived representations of a region are sliced from the full frame representation if it is already computed,
+    otherwise only the region is converted. The returned arrays are shared between consumers and must not be modified
+    in-place.
+    """
+    def __init__(self, img: np.ndarray):
+        """
+        :param img: the screenshot, shapes (h, w, 3) in RGB format or (h, w, 4) in RGBA format (A channel is ignored)
+        """
+        assert len(img.shape) == 3 and img.shape[-1] in (3, 4), 'Invalid image shape, expected RGB(A) format'
+        self.rgb = img[..., :3]
+        self.height, self.width = img.shape[:2]
+        self._cache = {}  # type: Dict[Tuple[str, Optional[Roi]], np.ndarray]
+
+    @property
+    def shape(self) -> Tuple[int, int, int]:
+        return self.rgb.shape
+
+    def roi(self, roi: Optional[Roi] = None) -> np.ndarray:
+        """
+        Get the RGB view of the region
+
+        :param roi: the region (y1, y2, x1, x2), None for the full frame
+        :return: the RGB image (view) of the region, shapes (y2 - y1, x2 - x1, 3)
+        """
+        if roi is None:
+            return self.rgb
+        y1, y2, x1, x2 = roi
+        return self.rgb[y1:y2, x1:x2, :]
+
+    def _get_or_compute(self, name: str, roi: Optional[Roi], func: Callable[[np.ndarray], np.ndarray]) -> np.ndarray:
+        key = (name, roi)
+        value = self._cache.get(key, None)
+        if value is None:
+            full_value = self._cache.get((name, None), None)
+            if full_value is not None:
+                y1, y2, x1, x2 = roi
+                value = full_value[y1:y2, x1:x2, ...]
+            else:
+                value = func(self.roi(roi))
+            self._cache[key] = value
+        return value
+
+    def gray(self, roi: Optional[Roi] = None) -> np.ndarray:
+        """
+        Get the gray scale image, computed as the mean of RGB channels
+
+        :param roi: the region (y1, y2, x1, x2), None for the full frame
+        :return: the gray scale image in float64, shapes (h, w)
+        """
+        return self._get_or_compute('gray', roi, lambda x: np.mean(x, -1))
+
+    def hsv(self, roi: Optional[Roi] = None) -> np.ndarray:
+        """
+        Get the HSV image, computed by image_process.rgb_to_hsv
+
+        :param roi: the region (y1, y2, x1, x2), None for the full frame
+        :return: the HSV image in uint8, shapes (h, w, 3)
+        """
+        return self._get_or_compute('hsv', roi, rgb_to_hsv)
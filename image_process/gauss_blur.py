@@ -21,7 +21,13 @@ def _gauss_blur_pil(img: np.ndarray, radius: int) -> np.ndarray:
 # NOTE 1: gauss blur between PIL and OpenCV is different!
 # NOTE 2: gauss blur using PIL is much slower than OpenCV!
 def gauss_blur(img: np.ndarray, radius: int) -> np.ndarray:
-    return backend_call('gauss_blur', img=img, radius=radius)
+    return _gauss_blur_func(img, radius)
+
+
+# the backends are not interchangeable (radius means kernel size in OpenCV but sigma in PIL), autotuning only checks
+# the availability of them
+register_backend_sample('gauss_blur', lambda: {'img': sample_image(128, 128, 3), 'radius': 3}, tolerance=0)
+_gauss_blur_func = bind_backend('gauss_blur', globals(), '_gauss_blur_func')
 
 
 def benchmark():
@@ -1,11 +1,18 @@
 # Author: Zhou Xuebin
-# Version: 1.1
+# Version: 1.5
 # Changelog:
 # v1.1: changed cacher hash algorithm from bucket to BK tree
+# v1.2: changed BK tree to array-backed hamming index
+# v1.3: added LRU eviction, compact verification signature and hit / miss / conflict counters
+# v1.4: added save / load
+# v1.5: invalidated saved entries on changing the hash / conflict / signature functions or tolerances
 
 from typing import *
 import numpy as np
-from .bk_tree import BKTree
+import os
+from collections import OrderedDict
+from .bk_tree import HammingIndex, save_versioned, load_versioned
+from .imcmp import split_gray_alpha
 import logging
 
 
@@ -13,68 +20,195 @@ T = TypeVar('T')
 logger = logging.getLogger('bgo_script.image_process')
 
 
+def gray_thumbnail(img: np.ndarray, scale: int = 4) -> np.ndarray:
+    """
+    Compact signature of image for hash conflict detection: the gray scale image downsampled by block averaging
+
+    :param img: image array, shapes (h, w), (h, w, 3) or (h, w, 4) (alpha is ignored)
+    :param scale: the downsample factor of both height and width
+    :return: the thumbnail with shape (h // scale, w // scale) in uint8 type
+    """
+    gray, _ = split_gray_alpha(img)
+    h, w = gray.shape[0] // scale, gray.shape[1] // scale
+    gray = gray[:h*scale, :w*scale].astype(np.float32).reshape(h, scale, w, scale)
+    return np.round(np.mean(gray, axis=(1, 3))).astype(np.uint8)
+
+
+def _func_name(func: Optional[Callable]) -> str:
+    return '' if func is None else '%s.%s' % (getattr(func, '__module__', ''), getattr(func, '__qualname__', ''))
+
+
 class ImageHashCacher:
     """
     A class for caching image-value pair, using low computation cost and image-oriented hash
     """
     def __init__(self, hash_func: Callable[[np.ndarray], int],
                  hash_conflict_func: Callable[[np.ndarray, np.ndarray], float], hash_code_tol: int = 2,
-                 conflict_tol: float = 10):
+                 conflict_tol: float = 10, hash_words: int = 1, capacity: Optional[int] = None,
+                 capacity_bytes: Optional[int] = None,
+                 signature_func: Optional[Callable[[np.ndarray], np.ndarray]] = None):
         """
         Default constructor of this cacher
         :param hash_func: A callable functions that maps image to hash code
         :param hash_conflict_func: A callable function indicating two images are same, used for hash conflict detection
         :param hash_code_tol: The maximum tolerant distance in hamming space to perform a rough similarity query
         :param conflict_tol: The tolerance of hash conflict function, if the hash_conflict_func returned the value less
-            than this tolerance, it will regard two input images as the same image
+            than this tolerance, it will regard two input images as the same image. It is compared with the error of
+            the signatures if signature_func is specified, which is usually much lower than the error of the original
+            images (e.g. block averaging of gray_thumbnail), thus it should be scaled accordingly
+        :param hash_words: The number of 64-bit words of the hash code
+        :param capacity: The maximum number of cached entries, the least recently used entries are evicted once
+            exceeded, None for unlimited
+        :param capacity_bytes: The maximum total bytes of the stored signatures (or images), same as capacity
+        :param signature_func: A callable function that maps image to a compact signature (e.g. gray_thumbnail), the
+            signatures are stored and compared by hash_conflict_func instead of the original images if specified
         """
         self.hash_func = hash_func
         self.hash_conflict_func = hash_conflict_func
-        self.hash_tree = BKTree()
+        self.hash_tree = HammingIndex(hash_words)
         self.tol = hash_code_tol
         self.conflict_tol = conflict_tol
+        self.capacity = capacity
+        self.capacity_bytes = capacity_bytes
+        self.signature_func = signature_func
+        # entry id -> (hash value, signature, value), ordered from the least recently used to the most recently used
+        self._entries = OrderedDict()  # type: OrderedDict[int, Tuple[int, np.ndarray, Any]]
+        self._next_entry_id = 0
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        # the number of candidates within hash tolerance but rejected by hash_conflict_func
+        self.conflicts = 0
+        self.evictions = 0
 
-    def add_image(self, image: np.ndarray, value: Optional[T] = None) -> bool:
+    def __len__(self):
+        return len(self._entries)
+
+    def _signature(self, image: np.ndarray) -> np.ndarray:
         if type(image) != np.ndarray:
             raise TypeError('image must be numpy.ndarray instance')
-        hash_value = self.hash_func(image)
+        return image if self.signature_func is None else self.signature_func(image)
+
+    def _lookup(self, hash_value: int, signature: np.ndarray) -> Optional[int]:
+        """
+        Find the cached entry of the same image
+
+        :param hash_value: hash code of the image
+        :param signature: signature of the image
+        :return: the entry id if found, or None otherwise
+        """
         candidate_conflict_images = self.hash_tree.approximate_query(hash_value, tol=self.tol)
-        for candidate_image_list, _, _ in candidate_conflict_images:
-            for candidate_image, _ in candidate_image_list:
-                v = self.hash_conflict_func(image, candidate_image)
+        for entry_id_list, key, dis in candidate_conflict_images:
+            for entry_id in entry_id_list:
+                _, candidate_signature, value = self._entries[entry_id]
+                v = self.hash_conflict_func(signature, candidate_signature)
+                logger.debug('Candidate from node %d (distance: %d) with value %s: conflict func returned %s' %
+                             (key, dis, str(value), str(v)))
                 if (isinstance(v, bool) and v) or (isinstance(v, float) and v < self.conflict_tol):
-                    return False
+                    self._entries.move_to_end(entry_id)
+                    return entry_id
+                self.conflicts += 1
+        return None
+
+    def _evict(self):
+        while len(self._entries) > 0 and \
+                ((self.capacity is not None and len(self._entries) > self.capacity) or
+                 (self.capacity_bytes is not None and self._total_bytes > self.capacity_bytes)):
+            entry_id, (hash_value, signature, value) = self._entries.popitem(last=False)
+            self.hash_tree.remove_node(hash_value, entry_id)
+            self._total_bytes -= signature.nbytes
+            self.evictions += 1
+            logger.debug('Evicted value "%s" in node %d' % (str(value), hash_value))
+
+    def add_image(self, image: np.ndarray, value: Optional[T] = None) -> bool:
+        signature = self._signature(image)
+        hash_value = self.hash_func(image)
+        if self._lookup(hash_value, signature) is not None:
+            return False
         logger.debug('Added value "%s" in node %d' % (str(value), hash_value))
-        self.hash_tree.add_node(hash_value, (image, value))
+        entry_id = self._next_entry_id
+        self._next_entry_id += 1
+        self._entries[entry_id] = (hash_value, signature, value)
+        self._total_bytes += signature.nbytes
+        self.hash_tree.add_node(hash_value, entry_id)
+        self._evict()
         return True
 
     def contains(self, image: np.ndarray) -> bool:
-        if type(image) != np.ndarray:
-            raise TypeError('image must be numpy.ndarray instance')
-        hash_value = self.hash_func(image)
-        candidate_conflict_images = self.hash_tree.approximate_query(hash_value, tol=self.tol)
-        for candidate_image_list, key, dis in candidate_conflict_images:
-            for candidate_image, val in candidate_image_list:
-                v = self.hash_conflict_func(image, candidate_image)
-                logger.debug('Candidate from node %d (distance: %d) with value %s: conflict func returned %s' %
-                             (key, dis, str(val), str(v)))
-                if (isinstance(v, bool) and v) or (isinstance(v, float) and v < self.conflict_tol):
-                    return True
-        return False
+        entry_id = self._lookup(self.hash_func(image), self._signature(image))
+        return entry_id is not None
 
     def get_value(self, image: np.ndarray) -> Optional[T]:
-        if type(image) != np.ndarray:
-            raise TypeError('image must be numpy.ndarray instance')
-        hash_value = self.hash_func(image)
-        candidate_conflict_images = self.hash_tree.approximate_query(hash_value, tol=self.tol)
-        for candidate_image_list, key, dis in candidate_conflict_images:
-            for candidate_image, value in candidate_image_list:
-                v = self.hash_conflict_func(image, candidate_image)
-                logger.debug('Candidate from node %d (distance: %d) with value %s: conflict func returned %s' %
-                             (key, dis, str(value), str(v)))
-                if (isinstance(v, bool) and v) or (isinstance(v, float) and v < self.conflict_tol):
-                    return value
-        raise KeyError('image not found')
+        entry_id = self._lookup(self.hash_func(image), self._signature(image))
+        if entry_id is None:
+            self.misses += 1
+            raise KeyError('image not found')
+        self.hits += 1
+        return self._entries[entry_id][2]
+
+    def save(self, path: str, fingerprint: str = ''):
+        """
+        Save the cached entries (hash codes, signatures and values) to file, the hash index is rebuilt on loading
+
+        :param path: file path
+        :param fingerprint: the fingerprint of the cached values (e.g. the database and the constants producing the
+            images), the saved file is ignored on loading if it does not match
+        """
+        entries = [x for x in self._entries.values()]
+        state = self._header(fingerprint)
+        state['entries'] = entries
+        save_versioned(path, 'ImageHashCacher', state)
+        logger.debug('Saved %d entries of image hash cacher to %s' % (len(entries), path))
+
+    def load(self, path: str, fingerprint: str = '') -> bool:
+        """
+        Replace the cached entries with the ones saved in file, the least recently used ones are evicted if the capacity
+        is exceeded
+
+        :param path: file path
+        :param fingerprint: the expected fingerprint, see save
+        :return: whether the entries are loaded
+        """
+        if not os.path.isfile(path):
+            return False
+        try:
+            state = load_versioned(path, 'ImageHashCacher')
+        except Exception as ex:
+            logger.warning('Failed to load image hash cacher from %s' % path, exc_info=ex)
+            return False
+        header = self._header(fingerprint)
+        if any(state.get(key, None) != value for key, value in header.items()):
+            logger.info('Image hash cacher saved in %s is outdated, ignored' % path)
+            return False
+        self.hash_tree = HammingIndex(self.hash_tree.words)
+        self._entries.clear()
+        self._total_bytes = 0
+        for hash_value, signature, value in state['entries']:
+            entry_id = self._next_entry_id
+            self._next_entry_id += 1
+            self._entries[entry_id] = (hash_value, signature, value)
+            self._total_bytes += signature.nbytes
+            self.hash_tree.add_node(hash_value, entry_id)
+        self._evict()
+        logger.info('Loaded %d entries of image hash cacher from %s' % (len(self._entries), path))
+        return True
+
+    def _header(self, fingerprint: str) -> Dict[str, Any]:
+        # the saved entries are outdated if any of the functions or tolerances deciding whether two images are the same
+        # is changed, since the entries merged (or kept apart) by the old ones are not the same
+        return {'fingerprint': fingerprint, 'hash_words': self.hash_tree.words, 'hash_func': _func_name(self.hash_func),
+                'hash_conflict_func': _func_name(self.hash_conflict_func),
+                'signature': _func_name(self.signature_func), 'hash_code_tol': self.tol,
+                'conflict_tol': self.conflict_tol}
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get the counters of this cacher, used for tuning the tolerances
+
+        :return: a dict containing the entries, bytes, hits, misses, conflicts and evictions
+        """
+        return {'entries': len(self._entries), 'bytes': self._total_bytes, 'hits': self.hits, 'misses': self.misses,
+                'conflicts': self.conflicts, 'evictions': self.evictions}
 
     def __contains__(self, item):
         return self.contains(item)
@@ -1,4 +1,5 @@
-__all__ = ['split_gray_alpha', 'split_rgb_alpha', 'mean_gray_diff_err', 'mean_hsv_diff_err', 'mean_hsv_diff_err_dbg']
+__all__ = ['split_gray_alpha', 'split_rgb_alpha', 'mean_gray_diff_err', 'mean_hsv_diff_err', 'mean_hsv_diff_err_dbg',
+           'mean_hsv_diff_err_batch', 'structural_similarity_batch']
 
 import numpy as np
 from typing import *
@@ -153,3 +154,107 @@ def mean_hsv_diff_err(a: np.ndarray, b: np.ndarray, fmt_a: str = 'rgb', fmt_b: s
     """
     err = float(np.mean(mean_hsv_diff_err_dbg(a, b, fmt_a, fmt_b, v_mode, alpha_mode)))
     return err
+
+
+def _sum(a, b):
+    return a + b
+
+
+# integer versions of the handles above, averaging is performed by sum here and compensated by the scale factor
+_alpha_mode_handle_dict_int = {
+    'min': (np.minimum, 1),
+    'max': (np.maximum, 1),
+    'avg': (_sum, 2),
+}
+_v_mode_handle_dict_int = dict(_alpha_mode_handle_dict_int)
+_v_mode_handle_dict_int['diff'] = (_abs_diff, 1)
+
+
+def mean_hsv_diff_err_batch(a: np.ndarray, b: np.ndarray, v_mode: str = 'diff', alpha_mode: str = 'min',
+                            chunk_size: int = 16) -> np.ndarray:
+    """
+    Batched version of mean_hsv_diff_err, compute the HSV difference between a stack of images and a single image in
+    one pass (both are in HSV format). Computation is done in integer arithmetic, which gives the same result as
+    mean_hsv_diff_err
+
+    :param a: stacked image array in HSV(A) format with uint8 type, shapes (n, h, w, 3) or (n, h, w, 4)
+    :param b: image array in HSV(A) format with uint8 type, shapes (h, w, 3) or (h, w, 4)
+    :param v_mode: the mode for handling value (brightness) of two image, one of "diff" (compute the absolute
+        difference), "min" (compute the minimum brightness), "max", or "avg"
+    :param alpha_mode: One of the "min", "max", or "avg", indicating using the minimum / maximum / mean alpha value
+        from two images
+    :param chunk_size: the number of images computed at once, used to bound the memory of temporary arrays
+    :return: HSV difference between each image in the stack and the given image, shapes (n,)
+    """
+    if len(a.shape) != 4 or len(b.shape) != 3:
+        raise ValueError('Unsupported input shape, expected (n, h, w, c) and (h, w, c), but got %s and %s' %
+                         (str(a.shape), str(b.shape)))
+    if a.shape[1:3] != b.shape[:2]:
+        raise ValueError('Invalid comparison: %s and %s' % (str(a.shape[1:3]), str(b.shape[:2])))
+    alpha_func, alpha_scale = _alpha_mode_handle_dict_int[alpha_mode.lower()]
+    value_func, value_scale = _v_mode_handle_dict_int[v_mode.lower()]
+    hsv_b, alpha_b = split_rgb_alpha(b)
+    hue_b = hsv_b[..., 0].astype(np.int16)
+    val_b = hsv_b[..., 2].astype(np.int16)
+    alpha_b = alpha_b.astype(np.int16)
+    has_alpha_a = a.shape[-1] == 4
+    # hue (<= 127) * value (<= 510) * alpha (<= 510) fits in int32
+    scale = 255.0 * 255.0 * value_scale * alpha_scale * a.shape[1] * a.shape[2]
+    ret = np.empty(a.shape[0], dtype=np.float64)
+    for begin in range(0, a.shape[0], chunk_size):
+        chunk = a[begin:begin+chunk_size]
+        # hue ring difference
+        hue_diff = np.abs(chunk[..., 0].astype(np.int16) - hue_b)
+        np.minimum(hue_diff, 255 - hue_diff, out=hue_diff)
+        err = hue_diff.astype(np.int32)
+        # value (brightness)
+        err *= value_func(chunk[..., 2].astype(np.int16), val_b)
+        if has_alpha_a:
+            err *= alpha_func(chunk[..., 3].astype(np.int16), alpha_b)
+        else:
+            err *= alpha_func(np.int16(255), alpha_b)
+        ret[begin:begin+chunk.shape[0]] = np.sum(err, axis=(1, 2), dtype=np.int64) / scale
+    return ret
+
+
+def _window_mean(img: np.ndarray, win_size: int) -> np.ndarray:
+    # mean over all valid (fully inside) windows of the last two axes, computed by integral image
+    integral = np.zeros(img.shape[:-2] + (img.shape[-2] + 1, img.shape[-1] + 1), dtype=np.float64)
+    np.cumsum(np.cumsum(img, -2), -1, out=integral[..., 1:, 1:])
+    s = integral[..., win_size:, win_size:] - integral[..., :-win_size, win_size:] - \
+        integral[..., win_size:, :-win_size] + integral[..., :-win_size, :-win_size]
+    return s / (win_size * win_size)
+
+
+def structural_similarity_batch(a: np.ndarray, b: np.ndarray, data_range: float = 255, win_size: int = 7,
+                                k1: float = 0.01, k2: float = 0.03) -> np.ndarray:
+    """
+    Batched version of skimage.metrics.structural_similarity with its default arguments (uniform window, sample
+    covariance), computing the mean SSIM between every pair of images in two stacks of gray scale images
+
+    :param a: stacked gray scale images, shapes (n, h, w)
+    :param b: stacked gray scale images, shapes (k, h, w)
+    :param data_range: the data range of the images (255 for uint8 images)
+    :param win_size: the side length of the sliding window
+    :param k1: algorithm parameter K1
+    :param k2: algorithm parameter K2
+    :return: SSIM matrix, shapes (n, k)
+    """
+    if len(a.shape) != 3 or len(b.shape) != 3 or a.shape[1:] != b.shape[1:]:
+        raise ValueError('Invalid comparison: %s and %s' % (str(a.shape), str(b.shape)))
+    if a.shape[1] < win_size or a.shape[2] < win_size:
+        raise ValueError('win_size exceeds image extent')
+    a = a.astype(np.float64)[:, None, ...]
+    b = b.astype(np.float64)[None, ...]
+    # the edges (win_size // 2 px) are excluded from the mean SSIM by skimage, so only the windows fully inside the
+    # image are computed here
+    ux = _window_mean(a, win_size)
+    uy = _window_mean(b, win_size)
+    cov_norm = win_size * win_size / (win_size * win_size - 1.0)
+    vx = cov_norm * (_window_mean(a * a, win_size) - ux * ux)
+    vy = cov_norm * (_window_mean(b * b, win_size) - uy * uy)
+    vxy = cov_norm * (_window_mean(a * b, win_size) - ux * uy)
+    c1 = (k1 * data_range) ** 2
+    c2 = (k2 * data_range) ** 2
+    s = ((2 * ux * uy + c1) * (2 * vxy + c2)) / ((ux * ux + uy * uy + c1) * (vx + vy + c2))
+    return np.mean(s, axis=(-2, -1))
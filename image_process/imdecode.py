@@ -1,30 +1,63 @@
 import numpy as np
+from typing import *
 from ._backend_determine import *
+from .resize import resize
 
 
-@backend_support('imdecode', 0)
-def _imdecode_opencv(b: bytes) -> np.ndarray:
+@backend_support('imdecode', 1)
+def _imdecode_opencv(b: bytes, target_size: Optional[Tuple[int, int]] = None) -> np.ndarray:
     import cv2
-    b = np.array(bytearray(b), 'uint8')
     # noinspection PyUnresolvedReferences
-    value = cv2.imdecode(b, cv2.IMREAD_UNCHANGED)
+    value = cv2.imdecode(np.frombuffer(b, 'uint8'), cv2.IMREAD_UNCHANGED)
     if len(value.shape) == 3:
-        # reverse BGRA to RGBA
-        value[..., :3] = value[..., 2::-1]
+        # reverse BGR(A) to RGB(A)
+        # noinspection PyUnresolvedReferences
+        value = cv2.cvtColor(value, cv2.COLOR_BGRA2RGBA if value.shape[-1] == 4 else cv2.COLOR_BGR2RGB)
+    if target_size is not None and value.shape[:2] != tuple(target_size):
+        value = resize(value, target_size[1], target_size[0])
     return value
 
 
-@backend_support('imdecode', 1)
-def _imdecode_pil(b: bytes) -> np.ndarray:
+@backend_support('imdecode', 0)
+def _imdecode_pil(b: bytes, target_size: Optional[Tuple[int, int]] = None) -> np.ndarray:
     from PIL import Image
     from io import BytesIO
     with BytesIO(b) as f:
         img = Image.open(f)
-        return np.asarray(img, 'uint8')
+        if target_size is None or img.size == (target_size[1], target_size[0]):
+            return np.asarray(img, 'uint8')
+        if img.format == 'JPEG':
+            # reduced resolution decoding (DCT scaling), the decoded size is not less than the target size
+            img.draft(img.mode, (target_size[1], target_size[0]))
+        if img.mode in ('L', 'RGB', 'RGBA'):
+            # same as resizing the decoded array by PIL backend, without converting to array in between
+            # noinspection PyUnresolvedReferences
+            return np.asarray(img.resize((target_size[1], target_size[0]), Image.LANCZOS), dtype='uint8')
+        return resize(np.asarray(img, 'uint8'), target_size[1], target_size[0])
+
+
+def imdecode(b: bytes, target_size: Optional[Tuple[int, int]] = None) -> np.ndarray:
+    """
+    Decode the image from bytes
+
+    :param b: the encoded image
+    :param target_size: resize the decoded image to (h, w) if specified, the resizing is fused into decoding (e.g. JPEG
+        images are decoded at reduced resolution) where the format allows
+    :return: the decoded image in RGB(A) format
+    """
+    return _imdecode_func(b, target_size)
+
+
+def _imdecode_sample():
+    from PIL import Image
+    from io import BytesIO
+    with BytesIO() as f:
+        Image.fromarray(np.random.RandomState(0).randint(0, 256, [237, 237, 4], 'uint8')).save(f, 'PNG')
+        return {'b': f.getvalue()}
 
 
-def imdecode(b: bytes) -> np.ndarray:
-    return backend_call('imdecode', b=b)
+register_backend_sample('imdecode', _imdecode_sample, tolerance=0)
+_imdecode_func = bind_backend('imdecode', globals(), '_imdecode_func')
 
 
 # noinspection DuplicatedCode
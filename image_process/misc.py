@@ -4,6 +4,7 @@ import logging
 from util import LazyValue
 from .resize import resize
 from .imread import imread
+from ._backend_determine import *
 import os
 
 logger = logging.getLogger('bgo_script.image_process')
@@ -11,11 +12,13 @@ try:
     # noinspection PyUnresolvedReferences
     import numba
     jit_no_python = numba.njit
+    numba_available = True
     logger.info('Package "numba" found, using @njit to accelerate computation')
 except ImportError:
     def jit_no_python(fn):
         # default decorator
         return fn
+    numba_available = False
     logger.info('Package "numba" not found, it is an optional package which can improve image processing speed')
 
 
@@ -48,116 +51,219 @@ class ImageSegment:
                f'{self.associated_pixels.shape[0]}, boundary pixels={self.boundary_pixels.shape[0]}>'
 
 
-# UPDATED: newer version (supports numba jit decorator) implemented in BDCI'20 flood fill algorithm
 @jit_no_python
-def _dfs_visit_internal(img, visited, x, y, cls, assoc_loc, bnd_loc):
-    pos_queue = [(x, y)]
-    assoc_ofs = 0
-    bnd_ofs = 0
-    while len(pos_queue) > 0:
-        x, y = pos_queue.pop()
-        if (visited[y, x] & 1) != 0:
-            continue
-        if cls != img[y, x]:
-            if (visited[y, x] & 2) == 0:
-                bnd_loc[bnd_ofs] = (y, x)
-                visited[y, x] |= 2
-                bnd_ofs += 1
-            continue
-        visited[y, x] |= 1
-        assoc_loc[assoc_ofs, :] = (y, x)
-        assoc_ofs += 1
-        # left
-        if x > 0:
-            pos_queue.append((x-1, y))
-        # right
-        if x + 1 < img.shape[1]:
-            pos_queue.append((x+1, y))
-        # up
-        if y > 0:
-            pos_queue.append((x, y-1))
-        # down
-        if y + 1 < img.shape[0]:
-            pos_queue.append((x, y+1))
-    return assoc_ofs, bnd_ofs
-
-
-def _dfs_visit(img):
-    visited = np.zeros_like(img, dtype=np.uint8)
+def _label_components_kernel(mask, labels, parent):
+    # two-pass union-find labelling with 4-connectivity, labels are ordered by the raster position of their first pixel
+    h, w = mask.shape
+    n = 0
+    for y in range(h):
+        for x in range(w):
+            if not mask[y, x]:
+                continue
+            up = labels[y-1, x] if y > 0 else 0
+            left = labels[y, x-1] if x > 0 else 0
+            if up == 0 and left == 0:
+                n += 1
+                parent[n] = n
+                labels[y, x] = n
+            elif up == 0 or left == 0:
+                labels[y, x] = up + left
+            else:
+                while parent[up] != up:
+                    up = parent[up]
+                while parent[left] != left:
+                    left = parent[left]
+                if up < left:
+                    parent[left] = up
+                    labels[y, x] = up
+                else:
+                    parent[up] = left
+                    labels[y, x] = left
+    # flatten the trees and compact the labels, roots are always visited before their children
+    remap = np.zeros(n + 1, dtype=np.int32)
+    cnt = 0
+    for i in range(1, n + 1):
+        if parent[i] == i:
+            cnt += 1
+            remap[i] = cnt
+        else:
+            remap[i] = remap[parent[i]]
+    for y in range(h):
+        for x in range(w):
+            labels[y, x] = remap[labels[y, x]]
+    return cnt
+
+
+@backend_support('label_components', 2)
+def _label_components_opencv(mask: np.ndarray) -> Tuple[np.ndarray, int]:
+    import cv2
+    n, labels = cv2.connectedComponents(mask.astype(np.uint8), connectivity=4, ltype=cv2.CV_32S)
+    return labels, n - 1
+
+
+@backend_support('label_components', 1)
+def _label_components_scipy(mask: np.ndarray) -> Tuple[np.ndarray, int]:
+    import scipy.ndimage
+    # the default structure is 4-connectivity
+    labels, n = scipy.ndimage.label(mask, output=np.int32)
+    return labels, n
+
+
+@backend_support('label_components', 0)
+def _label_components_python(mask: np.ndarray) -> Tuple[np.ndarray, int]:
+    labels = np.zeros(mask.shape, dtype=np.int32)
+    parent = np.zeros(mask.shape[0] * mask.shape[1] + 1, dtype=np.int32)
+    n = _label_components_kernel(mask, labels, parent)
+    return labels, n
+
+
+def _label_components_diff(a: Tuple[np.ndarray, int], b: Tuple[np.ndarray, int]) -> float:
+    # label values may be different between backends, the components are the same if the numbers of them are equal
+    return 0.0 if a[1] == b[1] and np.array_equal(a[0] > 0, b[0] > 0) else float('inf')
+
+
+register_backend_sample('label_components', lambda: {'mask': np.random.RandomState(0).uniform(size=[40, 120]) < 0.5},
+                        tolerance=0, diff_func=_label_components_diff)
+_label_components_func = bind_backend('label_components', globals(), '_label_components_func')
+
+
+def label_components(img: np.ndarray) -> Tuple[np.ndarray, int]:
+    """
+    Label the 4-connected components of the image, each component contains the pixels with the same non-zero value
+
+    :param img: image with shape (h, w), zero pixels are treated as background
+    :return: the label image in int32 (0 for background, labels are ordered by the raster position of the first pixel
+        of each component) and the number of components
+    """
+    values = np.unique(img)
+    values = values[values != 0]
+    if len(values) <= 1:
+        labels, n = _label_components_func(img != 0)
+    else:
+        # rare case: multiple classes, labelled separately
+        labels = np.zeros(img.shape, dtype=np.int32)
+        n = 0
+        for value in values:
+            class_labels, class_n = _label_components_func(img == value)
+            labels += np.where(class_labels > 0, class_labels + n, 0).astype(np.int32)
+            n += class_n
+    labels = labels.astype(np.int32, copy=False)
+    # re-order the labels by the raster position of their first pixel (backends may differ)
+    flat = labels.ravel()
+    pixel_idx = np.flatnonzero(flat)
+    _, first_idx = np.unique(flat[pixel_idx], return_index=True)
+    order = np.argsort(first_idx, kind='stable')
+    if np.any(order != np.arange(n)):
+        remap = np.zeros(n + 1, dtype=np.int32)
+        remap[order + 1] = np.arange(1, n + 1, dtype=np.int32)
+        labels = remap[labels]
+    return labels, n
+
+
+def _segments_from_labels(img: np.ndarray, labels: np.ndarray, n: int) -> List[ImageSegment]:
+    h, w = labels.shape
+    flat = labels.ravel()
+    # associated pixels, grouped by label in raster order
+    pixel_idx = np.flatnonzero(flat)
+    pixel_idx = pixel_idx[np.argsort(flat[pixel_idx], kind='stable')]
+    pixel_label = flat[pixel_idx]
+    pixel_loc = np.stack([pixel_idx // w, pixel_idx % w], 1).astype(np.int32)
+    pixel_split = np.searchsorted(pixel_label, np.arange(1, n + 2))
+    # boundary pixels: the 4-neighbours of each component which are not in it
+    bnd_keys = []
+    for dst, src in [((slice(None, -1), slice(None)), (slice(1, None), slice(None))),
+                     ((slice(1, None), slice(None)), (slice(None, -1), slice(None))),
+                     ((slice(None), slice(None, -1)), (slice(None), slice(1, None))),
+                     ((slice(None), slice(1, None)), (slice(None), slice(None, -1)))]:
+        src_label = labels[src]
+        valid = (src_label != 0) & (src_label != labels[dst])
+        dst_idx = np.arange(h * w, dtype=np.int64).reshape(h, w)[dst][valid]
+        bnd_keys.append(src_label[valid].astype(np.int64) * (h * w) + dst_idx)
+    bnd_keys = np.unique(np.concatenate(bnd_keys))
+    bnd_label = bnd_keys // (h * w)
+    bnd_idx = bnd_keys % (h * w)
+    bnd_loc = np.stack([bnd_idx // w, bnd_idx % w], 1).astype(np.int32)
+    bnd_split = np.searchsorted(bnd_label, np.arange(1, n + 2))
     ret_list = []
-    for y in range(img.shape[0]):
-        for x in range(img.shape[1]):
-            if img[y, x] != 0 and visited[y, x] == 0:
-                assoc_loc = np.empty([img.shape[0]*img.shape[1], 2], dtype=np.int32)
-                bnd_loc = np.empty_like(assoc_loc, dtype=np.int32)
-                v_tmp = np.zeros_like(visited, dtype=np.uint8)
-                cnt, bnd_cnt = _dfs_visit_internal(img, v_tmp, x, y, img[y, x], assoc_loc, bnd_loc)
-                visited |= (v_tmp & 1)
-                assoc_loc = assoc_loc[:cnt, :]
-                bnd_loc = bnd_loc[:bnd_cnt, :]
-                result = ImageSegment(img, int(np.min(assoc_loc[:, 1])), int(np.min(assoc_loc[:, 0])),
-                                      int(np.max(assoc_loc[:, 1]))+1, int(np.max(assoc_loc[:, 0]))+1,
-                                      assoc_loc, bnd_loc)
-                ret_list.append(result)
+    for i in range(n):
+        assoc_loc = pixel_loc[pixel_split[i]:pixel_split[i+1]]
+        bnd = bnd_loc[bnd_split[i]:bnd_split[i+1]]
+        ret_list.append(ImageSegment(img, int(np.min(assoc_loc[:, 1])), int(np.min(assoc_loc[:, 0])),
+                                     int(np.max(assoc_loc[:, 1]))+1, int(np.max(assoc_loc[:, 0]))+1,
+                                     assoc_loc, bnd))
     return ret_list
 
 
 def split_image(img: np.ndarray) -> List[ImageSegment]:
     """
-    Split an image into multiple connected segments using DFS
+    Split an image into multiple connected segments, using a single pass connected component labelling
 
     :param img: The binarized image with shape (h, w) (equivalent class: positive (!= 0) and negative (= 0))
-    :return: A list containing (y_min, x_min, y_max, x_max, available_pixels)
+    :return: A list of ImageSegment, ordered by the raster position of the first pixel of each segment
     """
     assert len(img.shape) == 2, 'Incompatible image shape, 2D image only'
-    return _dfs_visit(img)
+    labels, n = label_components(img)
+    return _segments_from_labels(img, labels, n)
 
 
-def extend_alpha_1px(alpha: np.ndarray) -> np.ndarray:
-    """
-    Extend the edge of alpha mask by 1 pixel
-
-    :param alpha: original alpha mask, shape (h, w) with uint8 type
-    :return: extended alpha mask
-    """
-    if len(alpha.shape) == 3 and alpha.shape[-1] == 1:
-        alpha = np.squeeze(alpha, -1)
-    elif len(alpha.shape) != 2:
-        raise ValueError('Invalid alpha shape')
-    v = np.zeros_like(alpha, dtype='uint8')
-    for y in range(alpha.shape[0]):
-        for x in range(alpha.shape[1]):
-            if alpha[y, x] > 127:
-                # broadcast
-                if y > 0:
-                    v[y-1, x] |= 1
-                if y < alpha.shape[0] - 1:
-                    v[y+1, x] |= 2
-                if x > 0:
-                    v[y, x-1] |= 4
-                if x < alpha.shape[1] - 1:
-                    v[y, x+1] |= 8
-    alpha_new = np.empty_like(alpha, dtype=np.float)
-    for y in range(alpha.shape[0]):
-        for x in range(alpha.shape[1]):
+@jit_no_python
+def _extend_alpha_1px_kernel(alpha, alpha_new):
+    h, w = alpha.shape
+    for y in range(h):
+        for x in range(w):
             c = 0
             t = 0
-            if v[y, x] & 1:
+            if y < h - 1 and alpha[y+1, x] > 127:
                 c += 1
                 t += alpha[y+1, x]
-            if v[y, x] & 2:
+            if y > 0 and alpha[y-1, x] > 127:
                 c += 1
                 t += alpha[y-1, x]
-            if v[y, x] & 4:
+            if x < w - 1 and alpha[y, x+1] > 127:
                 c += 1
                 t += alpha[y, x+1]
-            if v[y, x] & 8:
+            if x > 0 and alpha[y, x-1] > 127:
                 c += 1
                 t += alpha[y, x-1]
             if c > 0:
                 alpha_new[y, x] = t / c
             else:
                 alpha_new[y, x] = 0
+
+
+def _extend_alpha_1px_vectorized(alpha, alpha_new):
+    # masked sum and count of the 4 neighbours, computed by shifted views
+    masked = np.where(alpha > 127, alpha, 0)
+    mask = (alpha > 127).astype(np.int32)
+    t = np.zeros(alpha.shape, dtype=np.int32)
+    c = np.zeros(alpha.shape, dtype=np.int32)
+    for dst, src in [((slice(None, -1), slice(None)), (slice(1, None), slice(None))),
+                     ((slice(1, None), slice(None)), (slice(None, -1), slice(None))),
+                     ((slice(None), slice(None, -1)), (slice(None), slice(1, None))),
+                     ((slice(None), slice(1, None)), (slice(None), slice(None, -1)))]:
+        t[dst] += masked[src]
+        c[dst] += mask[src]
+    np.divide(t, c, out=alpha_new, where=c > 0)
+
+
+def extend_alpha_1px(alpha: np.ndarray) -> np.ndarray:
+    """
+    Extend the edge of alpha mask by 1 pixel, each pixel takes the mean alpha of its opaque (> 127) 4-neighbours if it
+    is larger than the original value
+
+    :param alpha: original alpha mask, shape (h, w) with uint8 type
+    :return: extended alpha mask
+    """
+    if len(alpha.shape) == 3 and alpha.shape[-1] == 1:
+        alpha = np.squeeze(alpha, -1)
+    elif len(alpha.shape) != 2:
+        raise ValueError('Invalid alpha shape')
+    alpha_int = alpha.astype(np.int32)
+    alpha_new = np.zeros(alpha.shape, dtype=np.float64)
+    if numba_available:
+        _extend_alpha_1px_kernel(alpha_int, alpha_new)
+    else:
+        _extend_alpha_1px_vectorized(alpha_int, alpha_new)
     return np.round(np.maximum(alpha_new, alpha)).astype('uint8')
 
 
@@ -1,6 +1,77 @@
-import scipy.fftpack
 import numpy as np
-from .resize import resize
+from typing import *
+from threading import Lock
+
+# bump this value if the hash code of the same image is changed, the persisted hash codes should be invalidated
+PERCEPTION_HASH_VERSION = 2
+
+_basis_cache = {}  # type: Dict[Tuple[int, int, int, int], Tuple[np.ndarray, np.ndarray]]
+_basis_lock = Lock()
+
+
+def _area_resize_matrix(src_size: int, dst_size: int) -> np.ndarray:
+    """
+    The linear operator of resizing a signal by area averaging (box filter), shapes (dst_size, src_size)
+    """
+    scale = src_size / dst_size
+    begin = np.arange(dst_size)[:, None] * scale
+    end = begin + scale
+    pixel = np.arange(src_size)[None, :]
+    overlap = np.clip(np.minimum(end, pixel + 1) - np.maximum(begin, pixel), 0, None)
+    return (overlap / scale).astype(np.float32)
+
+
+def _dct_matrix(size: int) -> np.ndarray:
+    """
+    The (unnormalized) DCT-II matrix, same as scipy.fftpack.dct with default arguments, shapes (size, size)
+    """
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    return (2 * np.cos(np.pi * k * (2 * n + 1) / (2 * size))).astype(np.float32)
+
+
+def _get_basis(height: int, width: int, hash_size: int, high_freq_factor: int) -> Tuple[np.ndarray, np.ndarray]:
+    key = (height, width, hash_size, high_freq_factor)
+    basis = _basis_cache.get(key, None)
+    if basis is None:
+        image_size = hash_size * high_freq_factor
+        dct = _dct_matrix(image_size)
+        # resizing and DCT are fused: low_freq = row_basis @ img @ col_basis.T, the DC component of horizontal
+        # frequency is skipped
+        row_basis = dct[:hash_size] @ _area_resize_matrix(height, image_size)
+        col_basis = dct[1:hash_size+1] @ _area_resize_matrix(width, image_size)
+        basis = np.ascontiguousarray(row_basis), np.ascontiguousarray(col_basis.T)
+        with _basis_lock:
+            _basis_cache[key] = basis
+    return basis
+
+
+def perception_hash_batch(img: np.ndarray, hash_size: int = 4, high_freq_factor: int = 4) -> np.ndarray:
+    """
+    Batched perception hash (pHash), all images are hashed by two matrix multiplications with the pre-computed 2D DCT
+    basis (resizing is fused in the basis)
+
+    :param img: stacked images, with shape (n, h, w, c) or (n, h, w)
+    :param hash_size: the dimension of hash, the hash will have bit length of hash_size ^ 2
+    :param high_freq_factor: the coefficient used for capturing image high frequent features
+    :return: the hash codes in uint64 array, shapes (n, words) where words = ceil(hash_size ^ 2 / 64), the first word
+        holds the least significant 64 bits (the same layout as HammingIndex)
+    """
+    if len(img.shape) == 4:
+        img = np.mean(img, -1, dtype=np.float32)
+    elif len(img.shape) == 3:
+        img = img.astype(np.float32)
+    else:
+        raise ValueError('Unsupported input shape, expected (n, h, w, c) or (n, h, w), but got %s' % str(img.shape))
+    row_basis, col_basis = _get_basis(img.shape[1], img.shape[2], hash_size, high_freq_factor)
+    dct_low_freq = np.matmul(np.matmul(row_basis, img), col_basis).reshape(img.shape[0], -1)
+    bits = dct_low_freq > np.mean(dct_low_freq, -1, keepdims=True)
+    # pad at the front, so that the first bit is the most significant one
+    n_bits = bits.shape[1]
+    words = (n_bits + 63) // 64
+    bits = np.concatenate([np.zeros([bits.shape[0], words * 64 - n_bits], dtype=np.bool_), bits], 1)
+    codes = np.packbits(bits, axis=1).view('>u8').astype(np.uint64)
+    return np.ascontiguousarray(codes[:, ::-1])
 
 
 def perception_hash(img: np.ndarray, hash_size: int = 4, high_freq_factor: int = 4) -> int:
@@ -11,17 +82,8 @@ def perception_hash(img: np.ndarray, hash_size: int = 4, high_freq_factor: int =
     :param high_freq_factor: the coefficient used for capturing image high frequent features
     :return: the hash code, code address ranges [0, 2^(hash_size^2))
     """
-    if len(img.shape) == 3:
-        img = np.mean(img, -1)
-    image_size = hash_size * high_freq_factor
-    # noinspection PyUnresolvedReferences
-    img = resize(img, image_size, image_size)
-    dct = scipy.fftpack.dct(img)
-    dct_low_freq = dct[:hash_size, 1:hash_size+1]
-    avg_dct = np.mean(dct_low_freq)
-    diff = dct_low_freq > avg_dct
-    hash_bit = np.reshape(diff, -1)
+    words = perception_hash_batch(img[None, ...], hash_size, high_freq_factor)[0]
     code = 0
-    for bit in hash_bit:
-        code = (code << 1) | int(bit)
+    for i, word in enumerate(words):
+        code |= int(word) << (64 * i)
     return code
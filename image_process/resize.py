@@ -19,11 +19,18 @@ def _resize_skimage(img: np.ndarray, width: int, height: int) -> np.ndarray:
 def _resize_pil(img: np.ndarray, width: int, height: int) -> np.ndarray:
     from PIL import Image
     img_obj = Image.fromarray(img)
-    return np.asarray(img_obj.resize((width, height), Image.ANTIALIAS), dtype='uint8')
+    return np.asarray(img_obj.resize((width, height), Image.LANCZOS), dtype='uint8')
+
+
+# screenshot-like content downscaled by 1.5x (the typical scale of capture resizing), the interpolation kernels of
+# the backends differ slightly (bicubic vs lanczos vs bilinear), which is within the tolerance on such content
+register_backend_sample('resize', lambda: {'img': sample_image(240, 240, 4), 'width': 160, 'height': 160},
+                        tolerance=2.5)
+_resize_func = bind_backend('resize', globals(), '_resize_func')
 
 
 def resize(img: np.ndarray, width: int, height: int) -> np.ndarray:
-    return backend_call('resize', img=img, width=width, height=height)
+    return _resize_func(img, width, height)
 
 
 def benchmark():
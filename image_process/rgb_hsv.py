@@ -1,4 +1,5 @@
 import numpy as np
+from typing import *
 from ._backend_determine import *
 
 
@@ -29,11 +30,63 @@ def _hsv_to_rgb_opencv(img: np.ndarray) -> np.ndarray:
 
 
 def rgb_to_hsv(img: np.ndarray) -> np.ndarray:
-    return backend_call('rgb_to_hsv', img=img)
+    return _rgb_to_hsv_func(img)
 
 
 def hsv_to_rgb(img: np.ndarray) -> np.ndarray:
-    return backend_call('hsv_to_rgb', img=img)
+    return _hsv_to_rgb_func(img)
+
+
+# the backends are not interchangeable (hue ranges in [0, 180) in OpenCV but [0, 256) in skimage), autotuning only
+# checks the availability of them
+register_backend_sample('rgb_to_hsv', lambda: {'img': sample_image(128, 128, 3)}, tolerance=0)
+register_backend_sample('hsv_to_rgb', lambda: {'img': sample_image(128, 128, 3)}, tolerance=0)
+_rgb_to_hsv_func = bind_backend('rgb_to_hsv', globals(), '_rgb_to_hsv_func')
+_hsv_to_rgb_func = bind_backend('hsv_to_rgb', globals(), '_hsv_to_rgb_func')
+# the period of hue produced by each rgb_to_hsv backend
+_hue_periods = {'_rgb_to_hsv_opencv': 180, '_rgb_to_hsv_skimage': 256}
+
+
+def hsv_hue_period() -> int:
+    """
+    Get the period of hue produced by the selected rgb_to_hsv backend
+
+    :return: 180 for OpenCV (hue in [0, 180)), or 256 for skimage (hue in [0, 256))
+    """
+    return _hue_periods[backend_function('rgb_to_hsv').__name__]
+
+
+def downsample_hsv(img: np.ndarray, height: int, width: int, hue_period: Optional[int] = None) -> np.ndarray:
+    """
+    Downsample HSV(A) image(s) by block averaging, hue is averaged on the color ring (circular mean) instead of its
+    raw value, so that the red hues near both ends of the ring do not average to cyan
+
+    :param img: image(s) in HSV(A) format with uint8 type, shapes (h, w, c) or (n, h, w, c)
+    :param height: target height, should not be greater than h
+    :param width: target width, should not be greater than w
+    :param hue_period: the period of hue (the length of the color ring), defaults to the one of the selected
+        rgb_to_hsv backend (see hsv_hue_period)
+    :return: the downsampled image(s) in the same format, shapes (height, width, c) or (n, height, width, c)
+    """
+    h, w = img.shape[-3:-1]
+    if height > h or width > w:
+        raise ValueError('Target size (%d, %d) exceeds image size (%d, %d)' % (height, width, h, w))
+    y_bounds = np.linspace(0, h, height + 1).astype(np.int64)
+    x_bounds = np.linspace(0, w, width + 1).astype(np.int64)
+    counts = np.outer(np.diff(y_bounds), np.diff(x_bounds)).astype(np.float32)[..., None]
+
+    def _block_mean(x: np.ndarray) -> np.ndarray:
+        x = np.add.reduceat(x, y_bounds[:-1], axis=-3)
+        return np.add.reduceat(x, x_bounds[:-1], axis=-2) / counts
+
+    if hue_period is None:
+        hue_period = hsv_hue_period()
+    img = img.astype(np.float32)
+    angle = img[..., :1] * np.float32(2 * np.pi / hue_period)
+    hue_vec = _block_mean(np.concatenate([np.cos(angle), np.sin(angle)], -1))
+    hue = np.round(np.arctan2(hue_vec[..., 1:2], hue_vec[..., 0:1]) * np.float32(hue_period / (2 * np.pi))) % hue_period
+    others = np.round(_block_mean(img[..., 1:]))
+    return np.concatenate([hue, others], -1).astype(np.uint8)
 
 
 def benchmark():
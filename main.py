@@ -3,6 +3,8 @@ from attacher import MumuAttacher, AdbAttacher
 from fsm import FgoFSMFacade, FgoFSMFacadeSelectSupport, FgoFSMFacadeBattleLoop
 import argparse
 import config
+import image_process
+from cv_positioning import CV_BACKEND_AUTOTUNE_FILE
 
 
 def main():
@@ -27,6 +29,10 @@ def main():
         exit(1)
     script_logger_root.info('Using attacher class: %s' % str(attacher_class))
     script_logger_root.info('Using execution schemas: %s' % str(schemas_class))
+    # select the fastest image process backends before loading matchers
+    image_process.autotune_backends(CV_BACKEND_AUTOTUNE_FILE)
+    # start loading matchers before attaching to the emulator
+    schemas_class.warm_up()
     script = schemas_class(attacher_class(), config.DEFAULT_CONFIG)
     try:
         script.run()
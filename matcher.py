@@ -2,89 +2,631 @@ import sqlite3
 import os
 import numpy as np
 import cv2
-from util import pickle_loads
+from util import pickle_loads, pickle_load, pickle_dump
 from cv_positioning import *
 import image_process
 import logging
-# from typing import *
+import hashlib
+import glob
+import atexit
+import weakref
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor, Future
+from time import time
+from urllib.request import pathname2url
+from typing import *
 # import matplotlib.pyplot as plt
 
 SQL_PATH = CV_FGO_DATABASE_FILE
 logger = logging.getLogger('bgo_script.matcher')
+# bump this value if the layout of the feature store is changed
+FEATURE_STORE_VERSION = 1
+# pragmas of the read-only database connection: memory map up to 256MB of the file and use 64MB page cache
+SQLITE_MMAP_SIZE = 268435456
+SQLITE_CACHE_SIZE_KB = 65536
+# number of threads decoding the images while loading database
+DECODE_WORKERS = min(8, os.cpu_count() or 1)
+# number of matchers loaded concurrently by the warm-up service
+WARM_UP_WORKERS = 3
+
+# the matchers owning a persisted recognition cache, all of them are saved by a single hook on exit, weak references
+# are used so that the hook never keeps a matcher alive
+_cache_owners = weakref.WeakSet()  # type: weakref.WeakSet
+_db_hash_cache = {}  # type: Dict[Tuple[str, int, int], str]
+_db_hash_lock = Lock()
+
+
+def _save_caches_on_exit():
+    for owner in list(_cache_owners):
+        owner.save_cache()
+
+
+atexit.register(_save_caches_on_exit)
+
+
+def _db_content_hash(sql_path: str) -> str:
+    """
+    Compute the SHA1 hash of the database file content, the hash is cached by path, size and modification time of the
+    file, both in memory and in a file next to the database (e.g. cv_data/fgo_new.content_hash.meta), so that the
+    database is hashed only when it is changed
+
+    :param sql_path: path to the database
+    :return: hex digest of the database content
+    """
+    stat = os.stat(sql_path)
+    cache_key = (os.path.abspath(sql_path), stat.st_size, stat.st_mtime_ns)
+    with _db_hash_lock:
+        digest = _db_hash_cache.get(cache_key, None)
+        if digest is not None:
+            return digest
+        hash_path = '%s.content_hash.meta' % os.path.splitext(sql_path)[0]
+        try:
+            with open(hash_path, 'rb') as f:
+                saved = pickle_load(f)
+            if saved['size'] == stat.st_size and saved['mtime_ns'] == stat.st_mtime_ns:
+                digest = saved['sha1']
+        except Exception as ex:
+            if not isinstance(ex, FileNotFoundError):
+                logger.warning('Failed to load database content hash from %s' % hash_path, exc_info=ex)
+        if digest is None:
+            logger.info('Computing content hash of %s' % sql_path)
+            sha1 = hashlib.sha1()
+            with open(sql_path, 'rb') as f:
+                while True:
+                    chunk = f.read(1048576)
+                    if len(chunk) == 0:
+                        break
+                    sha1.update(chunk)
+            digest = sha1.hexdigest()
+            try:
+                with open(hash_path + '.tmp', 'wb') as f:
+                    pickle_dump({'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': digest}, f)
+                os.replace(hash_path + '.tmp', hash_path)
+            except OSError as ex:
+                logger.warning('Failed to save database content hash to %s' % hash_path, exc_info=ex)
+        _db_hash_cache[cache_key] = digest
+        return digest
 
 
 class AbstractFgoMaterialMatcher:
     def __init__(self, sql_path: str = SQL_PATH):
         self.sql_path = sql_path
         assert os.path.isfile(self.sql_path), 'Given sql_path is not a file'
-        self.sqlite_connection = sqlite3.connect(self.sql_path, check_same_thread=False)
         self.cached_icon_meta = None
-        self.cached_icons = {}
+        self._loaded = False
+        self._load_lock = Lock()
+
+    def _load(self):
+        """
+        Load the features of database, called once by ensure_loaded
+        """
+        raise NotImplementedError()
+
+    def ensure_loaded(self):
+        """
+        Load the features of database if not loaded yet, blocks until they are ready if another thread (e.g. the
+        warm-up service) is loading them
+        """
+        if self._loaded:
+            return
+        with self._load_lock:
+            if not self._loaded:
+                self._load()
+                self._loaded = True
+
+    def precompute(self):
+        """
+        Build (or validate) the feature store of this matcher in advance
+        """
+        self.ensure_loaded()
+
+    def _open_connection(self) -> sqlite3.Connection:
+        """
+        Open a read-only connection tuned for bulk reading, every loading opens its own connection (and closes it
+        afterwards), so that concurrent loaders never contend on a shared one
+
+        :return: the connection
+        """
+        uri = 'file:%s?mode=ro' % pathname2url(os.path.abspath(self.sql_path))
+        conn = sqlite3.connect(uri, uri=True)
+        conn.execute('pragma mmap_size = %d' % SQLITE_MMAP_SIZE)
+        # negative value means the size in KiB instead of pages
+        conn.execute('pragma cache_size = %d' % -SQLITE_CACHE_SIZE_KB)
+        return conn
+
+    def _bulk_load(self, sql: str, decode_func: Callable[[int, str, bytes], Any]) \
+            -> Tuple[List[Tuple[int, str]], List[Any]]:
+        """
+        Fetch the (id, image_key, blob) rows of the given query with a streaming cursor, the blobs are decoded in a
+        thread pool while the rows arrive, rows sharing the same image key are decoded only once
+
+        :param sql: the query returning (id, image_key, blob) rows
+        :param decode_func: function called with (id, image_key, blob) in worker threads
+        :return: a list of (id, image_key) and the decoded results in the same order
+        """
+        icon_meta = []
+        futures = []
+        key_futures = {}
+        conn = self._open_connection()
+        try:
+            with ThreadPoolExecutor(max_workers=DECODE_WORKERS) as pool:
+                cursor = conn.execute(sql)
+                for icon_id, image_key, blob in cursor:
+                    future = key_futures.get(image_key, None)
+                    if future is None:
+                        future = pool.submit(decode_func, icon_id, image_key, blob)
+                        key_futures[image_key] = future
+                    icon_meta.append((icon_id, image_key))
+                    futures.append(future)
+                cursor.close()
+                results = [x.result() for x in futures]
+        finally:
+            conn.close()
+        return icon_meta, results
 
     def match(self, img_arr: np.ndarray) -> int:
         raise NotImplementedError()
 
+    def match_topk(self, img_arr: np.ndarray, k: int = 5) -> List[Tuple[int, float]]:
+        """
+        Find the k best matched ids of the given image along with their scores
 
-class SupportServantMatcher(AbstractFgoMaterialMatcher):
-    __warn_size_mismatch = False
+        :param img_arr: image to be matched
+        :param k: the maximum number of results
+        :return: a list of (id, score) sorted from the best to the worst, the meaning of score depends on the matcher
+        """
+        raise NotImplementedError()
 
-    def __init__(self, sql_path: str = SQL_PATH):
+    def verify(self, img_arr: np.ndarray, candidate_ids: Collection[int]) -> Tuple[int, float]:
+        """
+        Check whether the given image is one of the candidates, only the candidates are compared (instead of the whole
+        database)
+
+        :param img_arr: image to be verified
+        :param candidate_ids: the expected ids
+        :return: a tuple of the matched candidate id (0 if rejected) and the margin to the acceptance threshold, the
+            image is accepted if and only if the margin is non-negative
+        """
+        raise NotImplementedError()
+
+    def _feature_store_path(self, name: str) -> Tuple[str, str]:
+        # feature store is placed next to the database, e.g. cv_data/fgo_new.servant_icon.npy
+        prefix = os.path.splitext(self.sql_path)[0]
+        return '%s.%s.npy' % (prefix, name), '%s.%s.meta' % (prefix, name)
+
+    def _feature_store_fingerprint(self, *args, backend_groups: Sequence[str] = ()) -> str:
+        # DB content hash + the constants used to produce the features + the selected image process backends producing
+        # them (the backends within autotune tolerance still produce slightly different outputs)
+        backends = [image_process.backend_name(x) for x in backend_groups]
+        return '|'.join([str(FEATURE_STORE_VERSION), _db_content_hash(self.sql_path)] + [str(x) for x in args] +
+                        backends)
+
+    def _load_feature_store(self, name: str, fingerprint: str) -> Optional[Tuple[Dict[str, Any], np.ndarray]]:
+        """
+        Load the pre-computed features from disk (memory mapped, read-only)
+
+        :param name: name of the feature store
+        :param fingerprint: expected fingerprint, the store is regarded as outdated if it does not match
+        :return: a tuple of meta data and features, or None if the store is missing or outdated
+        """
+        data_path, meta_path = self._feature_store_path(name)
+        if not os.path.isfile(data_path) or not os.path.isfile(meta_path):
+            return None
+        try:
+            with open(meta_path, 'rb') as f:
+                meta = pickle_load(f)
+            if meta['fingerprint'] != fingerprint:
+                logger.info('Feature store "%s" is outdated, rebuilding' % name)
+                return None
+            return meta, np.load(data_path, mmap_mode='r')
+        except Exception as ex:
+            logger.warning('Failed to load feature store "%s", rebuilding' % name, exc_info=ex)
+            return None
+
+    def _save_feature_store(self, name: str, fingerprint: str, features: np.ndarray, **meta) -> np.ndarray:
+        """
+        Save the pre-computed features to disk, and re-open it in memory mapped mode
+
+        :param name: name of the feature store
+        :param fingerprint: fingerprint of the features
+        :param features: the feature array
+        :param meta: extra meta data saved along with the features, e.g. icon meta (id, image_key)
+        :return: the memory mapped features if succeeded, or the given features otherwise
+        """
+        data_path, meta_path = self._feature_store_path(name)
+        meta['fingerprint'] = fingerprint
+        try:
+            # write to temporary files first, then replace them, so a broken file will never be loaded
+            with open(data_path + '.tmp', 'wb') as f:
+                np.save(f, features)
+            with open(meta_path + '.tmp', 'wb') as f:
+                pickle_dump(meta, f)
+            os.replace(data_path + '.tmp', data_path)
+            os.replace(meta_path + '.tmp', meta_path)
+            logger.info('Saved feature store "%s" to %s' % (name, data_path))
+            return np.load(data_path, mmap_mode='r')
+        except OSError as ex:
+            logger.warning('Failed to save feature store "%s"' % name, exc_info=ex)
+            return features
+
+
+class AbstractHsvIconMatcher(AbstractFgoMaterialMatcher):
+    """
+    Base class of the matchers comparing the HSV color of icons, all icons are pre-processed and stacked into a
+    contiguous array with shape (n, h, w, 4) in HSV+alpha format, which is persisted to the feature store next to the
+    database and memory mapped on loading
+    """
+    _feature_store_name = None  # type: str
+    # the image process backends used for pre-processing the icons
+    _feature_store_backends = ('imdecode', 'resize', 'rgb_to_hsv')
+    # the maximum error accepted when matching with candidate ids, a full scan is performed if exceeded
+    _candidate_threshold = float('inf')
+    # the full scan stops once an icon with error not greater than this value is found, None to disable, it is
+    # disabled by default since the recently hit icons are scored first, an early exit may return one of them instead
+    # of the best matched icon
+    _early_exit_threshold = None  # type: Optional[float]
+    # number of icons scored per batch during the full scan, early exit is checked after each batch
+    _scan_chunk_size = 64
+    # the most frequently matched icons are scored in the first batch
+    _hot_chunk_size = 16
+    # decay factor of hit frequency applied on every match, so that recent hits are preferred
+    _hit_decay = 0.95
+    # coarse-to-fine cascade: all icons are scored on the downsampled signatures first, then only the top-k of them
+    # are scored in full resolution, None to disable (scan all icons in full resolution)
+    _cascade_top_k = None  # type: Optional[int]
+    _cascade_signature_size = CV_HSV_CASCADE_SIGNATURE_SIZE
+    # verify also scores this number of the non-candidate icons most similar to the query (ranked on the cascade
+    # signatures) in full resolution, and rejects the candidate if any of them is better, so that verify agrees with
+    # the ranking of match, 0 to disable (the threshold is the only criterion then)
+    _verify_rival_k = 4
+
+    def __init__(self, sql_path: str = SQL_PATH, early_exit_threshold: Optional[float] = None,
+                 cascade_top_k: Optional[int] = -1, cascade_signature_size: Optional[int] = None):
+        """
+        :param sql_path: path to the database
+        :param early_exit_threshold: enables early exit of the full scan with this threshold if specified (e.g.
+            CV_SUPPORT_SERVANT_EARLY_EXIT_HSV_THRESHOLD), trading accuracy for speed
+        :param cascade_top_k: overrides the number of icons passed to the second stage of cascade if specified, None
+            to disable the cascade, -1 to use the default of this matcher
+        :param cascade_signature_size: overrides the signature size of the first stage of cascade if specified
+        """
         super().__init__(sql_path)
+        # rows of the stacked icons are aligned with _cached_icon_ids
+        self._cached_icon_ids = None  # type: Optional[np.ndarray]
+        self._cached_icon_stack = None  # type: Optional[np.ndarray]
+        self._cached_icon_signature = None  # type: Optional[np.ndarray]
+        self._candidate_indices_cache = {}  # type: Dict[FrozenSet[int], np.ndarray]
+        self._hit_frequency = None  # type: Optional[np.ndarray]
+        if early_exit_threshold is not None:
+            self._early_exit_threshold = early_exit_threshold
+        if cascade_top_k != -1:
+            self._cascade_top_k = cascade_top_k
+        if cascade_signature_size is not None:
+            self._cascade_signature_size = cascade_signature_size
 
-    def match(self, img_arr: np.ndarray) -> int:
-        cursor = self.sqlite_connection.cursor()
+    def _feature_store_args(self) -> tuple:
+        """
+        The constants affecting the pre-processed icons, the feature store will be rebuilt if one of them changes
+        """
+        raise NotImplementedError()
+
+    def _compute_icons(self) -> Tuple[List[Tuple[int, str]], np.ndarray]:
+        """
+        Decode and pre-process all icons from database
+
+        :return: a list of (id, image_key) and the stacked icons in HSV+alpha format
+        """
+        raise NotImplementedError()
+
+    def _preprocess_query(self, img_arr: np.ndarray) -> np.ndarray:
+        raise NotImplementedError()
+
+    def _load_icons(self):
+        fingerprint = self._feature_store_fingerprint(*self._feature_store_args(),
+                                                      backend_groups=self._feature_store_backends)
+        store = self._load_feature_store(self._feature_store_name, fingerprint)
+        if store is not None and store[1].shape[0] != len(store[0]['icon_meta']):
+            logger.warning('Feature store "%s" is corrupted, rebuilding' % self._feature_store_name)
+            store = None
+        if store is None:
+            icon_meta, icon_stack = self._compute_icons()
+            icon_stack = self._save_feature_store(self._feature_store_name, fingerprint, icon_stack,
+                                                  icon_meta=icon_meta)
+        else:
+            icon_meta, icon_stack = store[0]['icon_meta'], store[1]
+            logger.info('Loaded %d icons from feature store "%s"' % (len(icon_meta), self._feature_store_name))
+        self.cached_icon_meta = icon_meta
+        self._cached_icon_ids = np.array([x[0] for x in icon_meta], dtype=np.int32)
+        self._cached_icon_stack = icon_stack
+        if self._cascade_top_k is not None:
+            self._cached_icon_signature = self._load_signatures(fingerprint)
+        self._candidate_indices_cache.clear()
+        self._hit_frequency = np.zeros(len(icon_meta), dtype=np.float64)
+
+    def _load(self):
+        self._load_icons()
+
+    def _load_signatures(self, icon_fingerprint: str) -> np.ndarray:
+        """
+        Load (or compute) the downsampled signatures of the stacked icons for the first stage of cascade
+
+        :param icon_fingerprint: fingerprint of the stacked icons
+        :return: the signatures with shape (n, size, size, 4) in HSV+alpha format
+        """
+        size = self._cascade_signature_size
+        name = self._feature_store_name + '_signature'
+        fingerprint = '%s|%d|%d' % (icon_fingerprint, size, image_process.hsv_hue_period())
+        store = self._load_feature_store(name, fingerprint)
+        if store is not None and store[1].shape[0] == self._cached_icon_stack.shape[0]:
+            return np.ascontiguousarray(store[1])
+        signatures = np.empty([self._cached_icon_stack.shape[0], size, size, 4], dtype=np.uint8)
+        for begin in range(0, signatures.shape[0], self._scan_chunk_size):
+            end = begin + self._scan_chunk_size
+            signatures[begin:end] = image_process.downsample_hsv(self._cached_icon_stack[begin:end], size, size)
+        return np.ascontiguousarray(self._save_feature_store(name, fingerprint, signatures))
+
+    def _candidate_indices(self, candidate_ids: Collection[int]) -> np.ndarray:
+        """
+        Get the row indices of the stacked icons belonging to the given ids
+
+        :param candidate_ids: servant ids
+        :return: row indices of the stacked icons
+        """
+        key = frozenset(candidate_ids)
+        indices = self._candidate_indices_cache.get(key, None)
+        if indices is None:
+            indices = np.nonzero(np.isin(self._cached_icon_ids, list(key)))[0]
+            self._candidate_indices_cache[key] = indices
+        return indices
+
+    def match(self, img_arr: np.ndarray, candidate_ids: Optional[Collection[int]] = None) -> int:
+        """
+        Find the servant id of the given image
+
+        :param img_arr: image to be matched
+        :param candidate_ids: if specified, only the icons of these ids are scored first, the whole database is scanned
+            only when the best score of them exceeds the candidate threshold of this matcher
+        :return: servant id of the best matched icon, or 0 if database is empty
+        """
+        hsv_img = self._preprocess_query(img_arr)
+        self.ensure_loaded()
+        if len(self._cached_icon_ids) == 0:
+            return 0
+        if candidate_ids is not None:
+            indices = self._candidate_indices(candidate_ids)
+            if len(indices) > 0:
+                hsv_err = image_process.mean_hsv_diff_err_batch(self._cached_icon_stack[indices], hsv_img)
+                min_idx = int(indices[np.argmin(hsv_err)])
+                min_err = float(np.min(hsv_err))
+                if min_err <= self._candidate_threshold:
+                    min_servant_id = int(self._cached_icon_ids[min_idx])
+                    logger.debug('svt_id = %d, key = %s, hsv_err = %f (candidate)' %
+                                 (min_servant_id, self.cached_icon_meta[min_idx][1], min_err))
+                    return min_servant_id
+                logger.debug('Best candidate hsv_err = %f exceeds threshold %f, fallback to full scan' %
+                             (min_err, self._candidate_threshold))
+        return self._scan(hsv_img, 1, self._early_exit_threshold)[0][0]
+
+    def match_topk(self, img_arr: np.ndarray, k: int = 5,
+                   early_exit_threshold: Optional[float] = None) -> List[Tuple[int, float]]:
+        """
+        Find the k best matched servant ids of the given image
+
+        :param img_arr: image to be matched
+        :param k: the maximum number of results
+        :param early_exit_threshold: stop scanning once an icon with error not greater than this value is found, the
+            results only cover the scanned icons in that case, defaults to the threshold of this matcher (disabled
+            unless it is specified in constructor)
+        :return: a list of (servant id, hsv error) sorted by error ascending, each servant id appears once, only the
+            survivors of the first stage are ranked if the cascade is enabled
+        """
+        hsv_img = self._preprocess_query(img_arr)
+        self.ensure_loaded()
+        if len(self._cached_icon_ids) == 0:
+            return []
+        if early_exit_threshold is None:
+            early_exit_threshold = self._early_exit_threshold
+        return self._scan(hsv_img, k, early_exit_threshold)
+
+    def _scan(self, hsv_img: np.ndarray, k: int, early_exit_threshold: Optional[float],
+              cascade: bool = True, record_hit: bool = True) -> List[Tuple[int, float]]:
+        """
+        Score the stacked icons batch by batch, the most frequently matched ones first
+
+        :param hsv_img: pre-processed query image
+        :param k: the maximum number of results
+        :param early_exit_threshold: stop scanning once an icon with error not greater than this value is found
+        :param cascade: use the coarse-to-fine cascade if it is enabled in this matcher
+        :param record_hit: update the hit frequency with the best matched icon
+        :return: a list of (servant id, hsv error) sorted by error ascending
+        """
+        n = len(self._cached_icon_ids)
+        hsv_err = np.full(n, np.inf, dtype=np.float64)
+        scanned = 0
+        hot_indices = np.argsort(-self._hit_frequency, kind='stable')[:self._hot_chunk_size]
+        hot_indices = hot_indices[self._hit_frequency[hot_indices] > 0]
+        if len(hot_indices) > 0:
+            hsv_err[hot_indices] = image_process.mean_hsv_diff_err_batch(self._cached_icon_stack[hot_indices],
+                                                                         hsv_img)
+            scanned += len(hot_indices)
+        top_k = self._cascade_top_k
+        if early_exit_threshold is not None and np.min(hsv_err) <= early_exit_threshold:
+            logger.debug('Early exit after scoring %d hot icons' % scanned)
+        elif cascade and top_k is not None and n > top_k:
+            # stage 1: scoring all icons on the downsampled signatures, the scored hot icons are excluded
+            size = self._cascade_signature_size
+            coarse_err = image_process.mean_hsv_diff_err_batch(self._cached_icon_signature,
+                                                               image_process.downsample_hsv(hsv_img, size, size),
+                                                               chunk_size=n)
+            coarse_err[hot_indices] = np.inf
+            # stage 2: scoring the survivors in full resolution, sorted for sequential access of memory mapped icons
+            survivors = np.sort(np.argpartition(coarse_err, top_k)[:top_k])
+            hsv_err[survivors] = image_process.mean_hsv_diff_err_batch(self._cached_icon_stack[survivors], hsv_img)
+            logger.debug('Cascade: %d of %d icons scored in full resolution' % (scanned + top_k, n))
+        else:
+            for begin in range(0, n, self._scan_chunk_size):
+                end = min(begin + self._scan_chunk_size, n)
+                # the hot icons are scored twice here, which is cheaper than gathering the rest of them
+                hsv_err[begin:end] = image_process.mean_hsv_diff_err_batch(self._cached_icon_stack[begin:end],
+                                                                           hsv_img)
+                scanned += end - begin
+                if early_exit_threshold is not None and np.min(hsv_err) <= early_exit_threshold:
+                    logger.debug('Early exit after scoring %d of %d icons' % (scanned, n))
+                    break
+        # top-k of distinct ids, an id may have several icons (e.g. ascensions)
+        results = []
+        for idx in np.argsort(hsv_err, kind='stable'):
+            if len(results) >= k or not np.isfinite(hsv_err[idx]):
+                break
+            servant_id = int(self._cached_icon_ids[idx])
+            if all(servant_id != x[0] for x in results):
+                results.append((servant_id, float(hsv_err[idx])))
+        min_idx = int(np.argmin(hsv_err))
+        if record_hit:
+            self._hit_frequency *= self._hit_decay
+            self._hit_frequency[min_idx] += 1
+        logger.debug('svt_id = %d, key = %s, hsv_err = %f' % (results[0][0], self.cached_icon_meta[min_idx][1],
+                                                              results[0][1]))
+        return results
+
+    def benchmark_cascade(self, img_list: Optional[List[np.ndarray]] = None, samples: int = 50) -> Dict[str, float]:
+        """
+        Compare the cascade with the exhaustive scan in both speed and accuracy (the exhaustive result is regarded as
+        ground truth), early exit and hit frequency are not used here
+
+        :param img_list: images to be matched, if not specified, the icons sampled from database (with random noise)
+            are used instead
+        :param samples: the number of sampled icons if img_list is not specified
+        :return: a dict containing the average time of both scans and the accuracy of cascade
+        """
+        self.ensure_loaded()
+        if img_list is not None:
+            queries = [self._preprocess_query(x) for x in img_list]
+        else:
+            rng = np.random.RandomState(0)
+            indices = rng.choice(len(self._cached_icon_ids), min(samples, len(self._cached_icon_ids)), replace=False)
+            queries = []
+            for idx in indices:
+                noise = rng.randint(-8, 9, self._cached_icon_stack.shape[1:])
+                noise[..., 3] = 0
+                queries.append(np.clip(self._cached_icon_stack[idx] + noise, 0, 255).astype(np.uint8))
+        exhaustive_time = cascade_time = 0.0
+        correct = 0
+        for hsv_img in queries:
+            t = time()
+            expected = self._scan(hsv_img, 1, None, cascade=False, record_hit=False)[0][0]
+            exhaustive_time += time() - t
+            t = time()
+            actual = self._scan(hsv_img, 1, None, cascade=True, record_hit=False)[0][0]
+            cascade_time += time() - t
+            correct += int(expected == actual)
+        result = {'exhaustive_time': exhaustive_time / len(queries), 'cascade_time': cascade_time / len(queries),
+                  'accuracy': correct / len(queries)}
+        logger.info('%s cascade benchmark (%d queries, top-k: %s, signature size: %d): exhaustive %f sec(s), '
+                    'cascade %f sec(s), accuracy %f' %
+                    (type(self).__name__, len(queries), str(self._cascade_top_k), self._cascade_signature_size,
+                     result['exhaustive_time'], result['cascade_time'], result['accuracy']))
+        return result
+
+    def verify(self, img_arr: np.ndarray, candidate_ids: Collection[int]) -> Tuple[int, float]:
+        hsv_img = self._preprocess_query(img_arr)
+        self.ensure_loaded()
+        indices = self._candidate_indices(candidate_ids)
+        if len(indices) == 0:
+            logger.warning('None of the candidates %s is found in database' % str(candidate_ids))
+            return 0, float('-inf')
+        hsv_err = image_process.mean_hsv_diff_err_batch(self._cached_icon_stack[indices], hsv_img)
+        min_idx = int(indices[np.argmin(hsv_err)])
+        min_err = float(np.min(hsv_err))
+        rival_err = self._verify_rival_err(hsv_img, indices)
+        # accepted only if it is within the threshold and it is not worse than the best rival
+        margin = min(self._candidate_threshold - min_err, rival_err - min_err)
+        servant_id = int(self._cached_icon_ids[min_idx])
+        logger.debug('verify svt_id = %d, key = %s, hsv_err = %f, rival hsv_err = %f, margin = %f' %
+                     (servant_id, self.cached_icon_meta[min_idx][1], min_err, rival_err, margin))
+        return (servant_id if margin >= 0 else 0), margin
+
+    def _verify_rival_err(self, hsv_img: np.ndarray, candidate_indices: np.ndarray) -> float:
+        """
+        The lowest error of the non-candidate icons which are the most similar to the query on the cascade signatures
+
+        :param hsv_img: pre-processed query image
+        :param candidate_indices: row indices of the candidate icons, they are excluded
+        :return: the lowest full resolution error among the rivals, inf if no rival is scored
+        """
+        k = min(self._verify_rival_k, len(self._cached_icon_ids) - len(candidate_indices))
+        if k <= 0 or self._cached_icon_signature is None:
+            return float('inf')
+        size = self._cascade_signature_size
+        coarse_err = image_process.mean_hsv_diff_err_batch(self._cached_icon_signature,
+                                                           image_process.downsample_hsv(hsv_img, size, size),
+                                                           chunk_size=len(self._cached_icon_ids))
+        coarse_err[candidate_indices] = np.inf
+        rivals = np.sort(np.argpartition(coarse_err, k - 1)[:k])
+        return float(np.min(image_process.mean_hsv_diff_err_batch(self._cached_icon_stack[rivals], hsv_img)))
+
+
+class SupportServantMatcher(AbstractHsvIconMatcher):
+    __warn_size_mismatch = False
+    _feature_store_name = 'servant_icon'
+    _candidate_threshold = CV_SUPPORT_SERVANT_CANDIDATE_HSV_THRESHOLD
+    _cascade_top_k = CV_SUPPORT_SERVANT_CASCADE_TOP_K
+
+    def __init__(self, sql_path: str = SQL_PATH, early_exit_threshold: Optional[float] = None,
+                 cascade_top_k: Optional[int] = -1, cascade_signature_size: Optional[int] = None):
+        super().__init__(sql_path, early_exit_threshold, cascade_top_k, cascade_signature_size)
+
+    def _feature_store_args(self) -> tuple:
+        return CV_SUPPORT_SERVANT_IMG_SIZE, CV_SUPPORT_SERVANT_SPLIT_Y
+
+    def _preprocess_query(self, img_arr: np.ndarray) -> np.ndarray:
         img_arr_resized = image_process.resize(img_arr, CV_SUPPORT_SERVANT_IMG_SIZE[1], CV_SUPPORT_SERVANT_IMG_SIZE[0])
         servant_part = img_arr_resized[:CV_SUPPORT_SERVANT_SPLIT_Y, :, :3]
-        hsv_servant_part = image_process.rgb_to_hsv(servant_part)
-        # querying servant icon database
-        if self.cached_icon_meta is None:
-            cursor.execute("select id from servant_icon order by id desc limit 1")
-            newest_svt_id = cursor.fetchone()[0]
-            cursor.execute("select count(1) from servant_icon")
-            entries = cursor.fetchone()[0]
-            cursor.execute("select id, image_key from servant_icon")
-            self.cached_icon_meta = cursor.fetchall()
-            logger.info('Finished querying support servant database, %d entries with newest servant id: %d' %
-                        (entries, newest_svt_id))
-        # querying image data
-        min_servant_id = 0
-        min_abs_err = 0
-        for servant_id, image_key in self.cached_icon_meta:
-            if image_key not in self.cached_icons:
-                cursor.execute("select image_data from image where image_key = ?", (image_key,))
-                binary_data = cursor.fetchone()[0]
-                # clipping alpha and opacity border
-                np_image = image_process.imdecode(binary_data)[3:-3, 3:-3, :]
-                if np_image.shape[:2] != CV_SUPPORT_SERVANT_IMG_SIZE:
-                    if not self.__warn_size_mismatch:
-                        self.__warn_size_mismatch = True
-                        logger.warning('The configuration of image size for support servant matching is different from '
-                                       'database size, performance will decrease: servant id: %d, key: %s' %
-                                       (servant_id, image_key))
-                    np_image = image_process.resize(np_image, CV_SUPPORT_SERVANT_IMG_SIZE[1],
-                                                    CV_SUPPORT_SERVANT_IMG_SIZE[0])
-                np_image, alpha = image_process.split_rgb_alpha(np_image)
-                hsv_image = image_process.rgb_to_hsv(np_image)
-                self.cached_icons[image_key] = np.concatenate([hsv_image, np.expand_dims(alpha, 2)], axis=2)
-            anchor_servant_part = self.cached_icons[image_key][:CV_SUPPORT_SERVANT_SPLIT_Y, ...]
-            hsv_err = image_process.mean_hsv_diff_err(anchor_servant_part, hsv_servant_part, 'hsv', 'hsv')
-            if min_servant_id == 0 or hsv_err < min_abs_err:
-                min_servant_id = servant_id
-                min_abs_err = hsv_err
-                logger.debug('svt_id = %d, key = %s, hsv_err = %f' % (servant_id, image_key, hsv_err))
-        cursor.close()
-        return min_servant_id
-
-
-class ServantCommandCardMatcher(AbstractFgoMaterialMatcher):
-    __warn_size_mismatch = False
+        return image_process.rgb_to_hsv(servant_part)
 
-    def __init__(self, sql_path: str = SQL_PATH):
-        super().__init__(sql_path)
+    def _decode_icon(self, servant_id: int, image_key: str, binary_data: bytes) -> np.ndarray:
+        # clipping alpha and opacity border
+        np_image = image_process.imdecode(binary_data)[3:-3, 3:-3, :]
+        if np_image.shape[:2] != CV_SUPPORT_SERVANT_IMG_SIZE:
+            if not self.__warn_size_mismatch:
+                self.__warn_size_mismatch = True
+                logger.warning('The configuration of image size for support servant matching is different from '
+                               'database size, performance will decrease: servant id: %d, key: %s' %
+                               (servant_id, image_key))
+            np_image = image_process.resize(np_image, CV_SUPPORT_SERVANT_IMG_SIZE[1], CV_SUPPORT_SERVANT_IMG_SIZE[0])
+        np_image = np_image[:CV_SUPPORT_SERVANT_SPLIT_Y, ...]
+        np_image, alpha = image_process.split_rgb_alpha(np_image)
+        hsv_image = image_process.rgb_to_hsv(np_image)
+        return np.concatenate([hsv_image, np.expand_dims(alpha, 2)], axis=2)
 
-    def match(self, img_arr: np.ndarray) -> int:
-        blur_radius = 2
-        cursor = self.sqlite_connection.cursor()
+    def _compute_icons(self) -> Tuple[List[Tuple[int, str]], np.ndarray]:
+        # querying servant icons with image data in one pass
+        icon_meta, icons = self._bulk_load("select s.id, s.image_key, i.image_data from servant_icon s "
+                                           "join image i on s.image_key = i.image_key", self._decode_icon)
+        logger.info('Finished querying support servant database, %d entries with newest servant id: %d' %
+                    (len(icon_meta), max([x[0] for x in icon_meta], default=0)))
+        icon_stack = np.empty([len(icon_meta), CV_SUPPORT_SERVANT_SPLIT_Y, CV_SUPPORT_SERVANT_IMG_SIZE[1], 4],
+                              dtype=np.uint8)
+        for i, icon in enumerate(icons):
+            icon_stack[i] = icon
+        return icon_meta, icon_stack
+
+
+class ServantCommandCardMatcher(AbstractHsvIconMatcher):
+    _feature_store_name = 'servant_command_card_icon'
+    _feature_store_backends = ('imdecode', 'resize', 'gauss_blur', 'rgb_to_hsv')
+    _blur_radius = 2
+    _candidate_threshold = CV_COMMAND_CARD_CANDIDATE_HSV_THRESHOLD
+    _cascade_top_k = CV_COMMAND_CARD_CASCADE_TOP_K
+
+    def __init__(self, sql_path: str = SQL_PATH, early_exit_threshold: Optional[float] = None,
+                 cascade_top_k: Optional[int] = -1, cascade_signature_size: Optional[int] = None):
+        super().__init__(sql_path, early_exit_threshold, cascade_top_k, cascade_signature_size)
+
+    def _feature_store_args(self) -> tuple:
+        return CV_COMMAND_CARD_IMG_SIZE, self._blur_radius
+
+    def _preprocess_query(self, img_arr: np.ndarray) -> np.ndarray:
         target_size = CV_COMMAND_CARD_IMG_SIZE
         # import matplotlib.pyplot as plt
         # plt.figure()
@@ -94,50 +636,32 @@ class ServantCommandCardMatcher(AbstractFgoMaterialMatcher):
         img_arr_resized, img_alpha = image_process.split_rgb_alpha(img_arr_resized)
         # use blur to remove high frequency noise introduced by interpolation, but blurring with alpha channel will
         # produce some weird artifacts on the edge of alpha, same ops to db images
-        img_arr_resized = image_process.gauss_blur(img_arr_resized, blur_radius)
-        hsv_img = np.concatenate([image_process.rgb_to_hsv(img_arr_resized), np.expand_dims(img_alpha, 2)], 2)
-        # querying servant icon database
-        if self.cached_icon_meta is None:
-            cursor.execute("select id from servant_command_card_icon order by id desc limit 1")
-            newest_svt_id = cursor.fetchone()[0]
-            cursor.execute("select count(1) from servant_command_card_icon")
-            entries = cursor.fetchone()[0]
-            cursor.execute("select id, image_key from servant_command_card_icon")
-            self.cached_icon_meta = cursor.fetchall()
-            logger.info('Finished querying servant command card database, %d entries with newest servant id: %d' %
-                        (entries, newest_svt_id))
-        # querying image data
-        min_servant_id = 0
-        min_err = 0
-        for servant_id, image_key in self.cached_icon_meta:
-            if image_key not in self.cached_icons:
-                cursor.execute("select image_data, name from image where image_key = ?", (image_key,))
-                binary_data, name = cursor.fetchone()
-                # All icon are PNG file with extra alpha channel
-                np_image = image_process.imdecode(binary_data)
-                # split alpha channel
-                assert np_image.shape[-1] == 4, 'Servant Icon should be RGBA channel'
-                if np_image.shape[:2] != target_size:
-                    if not self.__warn_size_mismatch:
-                        self.__warn_size_mismatch = True
-                        logger.warning('The configuration of image size for command card matching is different from '
-                                       'database size, performance will decrease: servant id: %d, key: %s' %
-                                       (servant_id, image_key))
-                    np_image = image_process.resize(np_image, target_size[1], target_size[0])
-                np_image = image_process.gauss_blur(np_image, blur_radius)
-                np_image, alpha = image_process.split_rgb_alpha(np_image)
-                hsv_image = image_process.rgb_to_hsv(np_image)
-                # weighted by alpha channel size
-                self.cached_icons[image_key] = np.concatenate([hsv_image, np.expand_dims(alpha, 2)], 2)
-            anchor = self.cached_icons[image_key]
-            # err_map = image_process.mean_hsv_diff_err_dbg(anchor, hsv_img, 'hsv', 'hsv')
-            hsv_err = image_process.mean_hsv_diff_err(anchor, hsv_img, 'hsv', 'hsv')
-            if min_servant_id == 0 or hsv_err < min_err:
-                min_servant_id = servant_id
-                min_err = hsv_err
-                logger.debug('svt_id = %d, key = %s, hsv_err = %f' % (servant_id, image_key, hsv_err))
-        cursor.close()
-        return min_servant_id
+        img_arr_resized = image_process.gauss_blur(img_arr_resized, self._blur_radius)
+        return np.concatenate([image_process.rgb_to_hsv(img_arr_resized), np.expand_dims(img_alpha, 2)], 2)
+
+    def _decode_icon(self, servant_id: int, image_key: str, binary_data: bytes) -> np.ndarray:
+        target_size = CV_COMMAND_CARD_IMG_SIZE
+        # All icon are PNG file with extra alpha channel, resized to target size while decoding
+        np_image = image_process.imdecode(binary_data, target_size)
+        # split alpha channel
+        assert np_image.shape[-1] == 4, 'Servant Icon should be RGBA channel'
+        np_image = image_process.gauss_blur(np_image, self._blur_radius)
+        np_image, alpha = image_process.split_rgb_alpha(np_image)
+        hsv_image = image_process.rgb_to_hsv(np_image)
+        # weighted by alpha channel size
+        return np.concatenate([hsv_image, np.expand_dims(alpha, 2)], 2)
+
+    def _compute_icons(self) -> Tuple[List[Tuple[int, str]], np.ndarray]:
+        target_size = CV_COMMAND_CARD_IMG_SIZE
+        # querying command card icons with image data in one pass
+        icon_meta, icons = self._bulk_load("select c.id, c.image_key, i.image_data from servant_command_card_icon c "
+                                           "join image i on c.image_key = i.image_key", self._decode_icon)
+        logger.info('Finished querying servant command card database, %d entries with newest servant id: %d' %
+                    (len(icon_meta), max([x[0] for x in icon_meta], default=0)))
+        icon_stack = np.empty([len(icon_meta), target_size[0], target_size[1], 4], dtype=np.uint8)
+        for i, icon in enumerate(icons):
+            icon_stack[i] = icon
+        return icon_meta, icon_stack
 
 
 def deserialize_cv2_keypoint(serialized_tuple):
@@ -148,58 +672,332 @@ def deserialize_cv2_keypoint(serialized_tuple):
 
 
 class SupportCraftEssenceMatcher(AbstractFgoMaterialMatcher):
+    _feature_store_name = 'craft_essence_descriptor'
+    # FLANN KD-tree index built over the descriptors of all craft essences (same as the default of FLANN based
+    # descriptor matcher), more checks are used since the index is much larger
+    _flann_index_params = dict(algorithm=1, trees=4)
+    _flann_search_params = dict(checks=64)
+    # number of nearest neighbours retrieved from the global index, the ratio test of each craft essence is
+    # performed within these neighbours
+    _knn = 8
+    _ratio_thresh = 0.7
+    # the minimum good matches to accept a craft essence in verify mode
+    _verify_min_matches = CV_SUPPORT_CRAFT_ESSENCE_VERIFY_MIN_MATCHES
+    # the margins (bottom, left and right) clipped from the craft essence part of resized support icon
+    _crop_margin = (3, 2)
+    # the recognized crops are persisted next to the database, saved at most once per interval (and on exit)
+    _cache_name = 'craft_essence_recognition'
+    _cache_save_interval = 60
+
     # noinspection PyUnresolvedReferences
     def __init__(self, sql_path: str = SQL_PATH):
         super(SupportCraftEssenceMatcher, self).__init__(sql_path)
         if image_process.sift_class is None:
             raise RuntimeError('SIFT is disabled due to current OpenCV binaries')
         self.sift_detector = image_process.sift_class.create()
-        self.matcher = cv2.DescriptorMatcher_create(cv2.DescriptorMatcher_FLANNBASED)
-        # self.matcher = cv2.BFMatcher()
+        # only the gray thumbnails of the crops are kept for verifying hash conflicts, the conflict tolerance is scaled
+        # to the thumbnails since downsampling reduces the error between different crops
         self.image_cacher = image_process.ImageHashCacher(image_process.perception_hash,
-                                                          image_process.mean_gray_diff_err)
+                                                          image_process.mean_gray_diff_err,
+                                                          conflict_tol=CV_SUPPORT_CRAFT_ESSENCE_CACHE_CONFLICT_TOL,
+                                                          capacity=CV_SUPPORT_CRAFT_ESSENCE_CACHE_CAPACITY,
+                                                          signature_func=image_process.gray_thumbnail)
+        # concatenated descriptors of all craft essences, and the parallel label array (row index of icon meta)
+        self._descriptors = None  # type: Optional[np.ndarray]
+        self._descriptor_labels = None  # type: Optional[np.ndarray]
+        self._descriptor_offsets = None  # type: Optional[np.ndarray]
+        self._cached_icon_ids = None  # type: Optional[np.ndarray]
+        self._candidate_indices_cache = {}  # type: Dict[FrozenSet[int], np.ndarray]
+        self._flann_index = None
+        self._cache_dirty = False
+        self._cache_save_time = time()
+        _cache_owners.add(self)
 
-    def match(self, img_arr: np.ndarray) -> int:
-        cursor = self.sqlite_connection.cursor()
-        ratio_thresh = 0.7
+    @staticmethod
+    def _decode_descriptors(craft_essence_id: int, image_key: str, descriptor_blob: bytes) -> np.ndarray:
+        # keypoint = [deserialize_cv2_keypoint(x) for x in pickle_loads(keypoint_blob)]
+        descriptors = pickle_loads(descriptor_blob)
+        if descriptors is None:
+            logger.warning('No SIFT descriptor available for craft essence id: %d, key: %s' %
+                           (craft_essence_id, image_key))
+            descriptors = np.empty([0, 128], dtype=np.float32)
+        return descriptors.astype(np.float32)
+
+    def _compute_descriptors(self) -> Tuple[List[Tuple[int, str]], np.ndarray, np.ndarray]:
+        # querying craft essences with descriptors in one pass
+        icon_meta, descriptor_list = self._bulk_load("select c.id, c.image_key, d.descriptors "
+                                                     "from craft_essence_icon c join image_sift_descriptor d "
+                                                     "on c.image_key = d.image_key", self._decode_descriptors)
+        logger.info('Finished querying craft essence database, %d entries with newest craft essence id: %d' %
+                    (len(icon_meta), max([x[0] for x in icon_meta], default=0)))
+        offsets = np.zeros(len(icon_meta) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([x.shape[0] for x in descriptor_list])
+        if len(descriptor_list) > 0:
+            descriptors = np.concatenate(descriptor_list, 0)
+        else:
+            descriptors = np.empty([0, 128], dtype=np.float32)
+        return icon_meta, descriptors, offsets
+
+    def _flann_index_path(self, fingerprint: Optional[str]) -> str:
+        # the file name contains the hash of fingerprint, e.g. cv_data/fgo_new.craft_essence_descriptor.<hash>.flann
+        prefix = os.path.splitext(self._feature_store_path(self._feature_store_name)[0])[0]
+        if fingerprint is None:
+            return '%s.*.flann' % prefix
+        return '%s.%s.flann' % (prefix, hashlib.sha1(fingerprint.encode('utf8')).hexdigest()[:16])
+
+    def _load_descriptors(self):
+        fingerprint = self._feature_store_fingerprint(self._flann_index_params)
+        store = self._load_feature_store(self._feature_store_name, fingerprint)
+        if store is None:
+            icon_meta, descriptors, offsets = self._compute_descriptors()
+            descriptors = self._save_feature_store(self._feature_store_name, fingerprint, descriptors,
+                                                   icon_meta=icon_meta, offsets=offsets)
+        else:
+            icon_meta, offsets, descriptors = store[0]['icon_meta'], store[0]['offsets'], store[1]
+            logger.info('Loaded %d SIFT descriptors of %d craft essences from feature store "%s"' %
+                        (descriptors.shape[0], len(icon_meta), self._feature_store_name))
+        self.cached_icon_meta = icon_meta
+        self._cached_icon_ids = np.array([x[0] for x in icon_meta], dtype=np.int32)
+        self._candidate_indices_cache.clear()
+        self._descriptors = np.ascontiguousarray(descriptors)
+        self._descriptor_labels = np.repeat(np.arange(len(icon_meta), dtype=np.int32), np.diff(offsets))
+        self._descriptor_offsets = offsets
+        # loading or building the global FLANN index
+        if self._descriptors.shape[0] < self._knn:
+            logger.warning('Too few SIFT descriptors in database, craft essence matching is disabled')
+            return
+        index_path = self._flann_index_path(fingerprint)
+        self._flann_index = cv2.flann_Index()
+        if os.path.isfile(index_path) and self._flann_index.load(self._descriptors, index_path):
+            logger.info('Loaded FLANN index from %s' % index_path)
+            return
+        logger.info('Building FLANN index for %d SIFT descriptors' % self._descriptors.shape[0])
+        self._flann_index = cv2.flann_Index(self._descriptors, self._flann_index_params)
+        try:
+            # remove the outdated ones
+            for file in glob.glob(self._flann_index_path(None)):
+                os.remove(file)
+            self._flann_index.save(index_path)
+        except (OSError, cv2.error) as ex:
+            logger.warning('Failed to save FLANN index', exc_info=ex)
+
+    def _load(self):
+        self._load_descriptors()
+        self.image_cacher.load(self._cache_path(), self._cache_fingerprint())
+
+    def _cache_path(self) -> str:
+        # e.g. cv_data/fgo_new.craft_essence_recognition.cache
+        return '%s.%s.cache' % (os.path.splitext(self.sql_path)[0], self._cache_name)
+
+    def _cache_fingerprint(self) -> str:
+        # the cached crops depend on the database, the geometry of cropping and the resize backend, the cached hash
+        # codes depend on the hash algorithm
+        return self._feature_store_fingerprint(self._cache_name, CV_SCREENSHOT_RESOLUTION_X, CV_SCREENSHOT_RESOLUTION_Y,
+                                               CV_SUPPORT_SERVANT_X1, CV_SUPPORT_SERVANT_X2,
+                                               CV_SUPPORT_SERVANT_IMG_SIZE, CV_SUPPORT_SERVANT_SPLIT_Y,
+                                               self._crop_margin, image_process.PERCEPTION_HASH_VERSION,
+                                               backend_groups=('resize',))
+
+    def save_cache(self):
+        """
+        Save the recognized craft essences to disk if there are new ones, it is called periodically while matching and
+        on exit
+        """
+        if not self._cache_dirty:
+            return
+        try:
+            self.image_cacher.save(self._cache_path(), self._cache_fingerprint())
+            self._cache_dirty = False
+        except OSError as ex:
+            logger.warning('Failed to save craft essence recognition cache', exc_info=ex)
+        self._cache_save_time = time()
+
+    def _vote(self, target_descriptor: np.ndarray) -> np.ndarray:
+        """
+        Query the global index with a single knnSearch, perform the ratio test for each craft essence among the
+        retrieved neighbours and count the good matches per craft essence
+
+        :param target_descriptor: SIFT descriptors of the query image
+        :return: the number of good matches for each entry in icon meta
+        """
+        votes = np.zeros(len(self.cached_icon_meta), dtype=np.int32)
+        if self._flann_index is None or target_descriptor is None or target_descriptor.shape[0] == 0:
+            return votes
+        knn = self._knn
+        indices, distances = self._flann_index.knnSearch(target_descriptor.astype(np.float32), knn,
+                                                         params=self._flann_search_params)
+        labels = self._descriptor_labels[indices]
+        # FLANN returns squared L2 distance
+        ratio_thresh = self._ratio_thresh ** 2
+        rows = np.arange(labels.shape[0])
+        # the last neighbour never passes the ratio test since its distance is the lower bound itself
+        for j in range(knn - 1):
+            label = labels[:, j]
+            # only the nearest neighbour of each craft essence is counted
+            is_first = np.all(labels[:, :j] != label[:, None], axis=1)
+            # the second nearest neighbour of the same craft essence, if it is not retrieved, the k-th distance is a
+            # lower bound of its distance
+            same_label = labels[:, j+1:] == label[:, None]
+            has_second = np.any(same_label, axis=1)
+            second_distance = np.where(has_second, distances[rows, j + 1 + np.argmax(same_label, axis=1)],
+                                       distances[:, -1])
+            good = is_first & (distances[:, j] < ratio_thresh * second_distance)
+            np.add.at(votes, label[good], 1)
+        return votes
+
+    def _crop_craft_essence_part(self, img_arr: np.ndarray) -> np.ndarray:
         img_arr_resized = image_process.resize(img_arr, CV_SUPPORT_SERVANT_IMG_SIZE[1], CV_SUPPORT_SERVANT_IMG_SIZE[0])
-        craft_essence_part = img_arr_resized[CV_SUPPORT_SERVANT_SPLIT_Y:-3, 2:-2, :]
+        bottom, side = self._crop_margin
+        return img_arr_resized[CV_SUPPORT_SERVANT_SPLIT_Y:-bottom, side:-side, :]
+
+    def verify(self, img_arr: np.ndarray, candidate_ids: Collection[int]) -> Tuple[int, float]:
+        craft_essence_part = self._crop_craft_essence_part(img_arr)
+        # the saved cache is loaded along with the descriptors
+        self.ensure_loaded()
+        cache_key = self.image_cacher.get(craft_essence_part, None)
+        if cache_key is not None:
+            # already identified by full scan
+            return (cache_key, float('inf')) if cache_key in candidate_ids else (0, float('-inf'))
+        indices = self._candidate_indices(candidate_ids)
+        if len(indices) == 0:
+            logger.warning('None of the candidates %s is found in database' % str(candidate_ids))
+            return 0, float('-inf')
+        _, target_descriptor = self.sift_detector.detectAndCompute(craft_essence_part, None)
+        # the votes of all craft essences come from a single query of the global index (the same as match), so that
+        # the ranking against the non-candidates is kept
+        votes = self._vote(target_descriptor)
+        max_idx = int(indices[np.argmax(votes[indices])])
+        max_matches = int(votes[max_idx])
+        rival_votes = votes.copy()
+        rival_votes[indices] = -1
+        max_rival_matches = int(np.max(rival_votes, initial=0))
+        # accepted only if it has enough good matches and more than any non-candidate
+        margin = float(min(max_matches - self._verify_min_matches, max_matches - max_rival_matches - 1))
+        max_craft_essence_id = self.cached_icon_meta[max_idx][0]
+        logger.debug('verify craft_essence_id = %d, sift_matches = %d, rival sift_matches = %d, margin = %f' %
+                     (max_craft_essence_id, max_matches, max_rival_matches, margin))
+        return (max_craft_essence_id if margin >= 0 else 0), margin
+
+    def _candidate_indices(self, candidate_ids: Collection[int]) -> np.ndarray:
+        """
+        Get the indices of icon meta belonging to the given ids
+
+        :param candidate_ids: craft essence ids
+        :return: indices of icon meta
+        """
+        key = frozenset(candidate_ids)
+        indices = self._candidate_indices_cache.get(key, None)
+        if indices is None:
+            indices = np.nonzero(np.isin(self._cached_icon_ids, list(key)))[0]
+            self._candidate_indices_cache[key] = indices
+        return indices
+
+    def match(self, img_arr: np.ndarray) -> int:
+        craft_essence_part = self._crop_craft_essence_part(img_arr)
+        self.ensure_loaded()
         # CACHE ACCESS
         cache_key = self.image_cacher.get(craft_essence_part, None)
         if cache_key is not None:
             return cache_key
-        if craft_essence_part in self.image_cacher:
-            return self.image_cacher[craft_essence_part]
-        if self.cached_icon_meta is None:
-            cursor.execute("select id from craft_essence_icon order by id desc limit 1")
-            newest_craft_essence_id = cursor.fetchone()[0]
-            cursor.execute("select count(1) from craft_essence_icon")
-            entries = cursor.fetchone()[0]
-            cursor.execute("select id, image_key from craft_essence_icon")
-            self.cached_icon_meta = cursor.fetchall()
-            logger.info('Finished querying craft essence database, %d entries with newest craft essence id: %d' %
-                        (entries, newest_craft_essence_id))
-        _, target_descriptor = self.sift_detector.detectAndCompute(craft_essence_part, None)
-        max_matches = 0
-        max_craft_essence_id = 0
-        for craft_essence_id, image_key in self.cached_icon_meta:
-            if image_key not in self.cached_icons:
-                cursor.execute("select descriptors from image_sift_descriptor where image_key = ?", (image_key,))
-                descriptor_blob = cursor.fetchone()[0]
-                # keypoint = [deserialize_cv2_keypoint(x) for x in pickle_loads(keypoint_blob)]
-                descriptors = pickle_loads(descriptor_blob)
-                self.cached_icons[image_key] = descriptors  # {'key_point': keypoint, 'descriptor': descriptors}
-            knn_matches = self.matcher.knnMatch(target_descriptor, self.cached_icons[image_key], 2)
-            # knn_matches = self.matcher.match(target_descriptor, self.cached_icons[image_key]['descriptor'])
-            good_matches = []
-            for m, n in knn_matches:
-                if m.distance < ratio_thresh * n.distance:
-                    good_matches.append(m)
-            len_good_matches = len(good_matches)
-            if len_good_matches > max_matches:
-                max_matches = len_good_matches
-                max_craft_essence_id = craft_essence_id
-                logger.debug('craft_essence_id = %d, sift_matches = %d' % (craft_essence_id, len_good_matches))
-        cursor.close()
+        results = self._topk_votes(craft_essence_part, 1)
+        max_craft_essence_id = results[0][0] if len(results) > 0 else 0
         self.image_cacher[craft_essence_part] = max_craft_essence_id
+        logger.debug('Craft essence cache stats: %s' % str(self.image_cacher.stats()))
+        self._cache_dirty = True
+        if time() - self._cache_save_time > self._cache_save_interval:
+            self.save_cache()
         return max_craft_essence_id
+
+    def match_topk(self, img_arr: np.ndarray, k: int = 5) -> List[Tuple[int, float]]:
+        """
+        Find the k best matched craft essence ids of the given image, all candidates are voted by a single query of
+        the global index, thus no early exit is needed
+
+        :param img_arr: image to be matched
+        :param k: the maximum number of results
+        :return: a list of (craft essence id, number of good SIFT matches) sorted by matches descending, craft
+            essences without any good match are excluded
+        """
+        return self._topk_votes(self._crop_craft_essence_part(img_arr), k)
+
+    def _topk_votes(self, craft_essence_part: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        self.ensure_loaded()
+        _, target_descriptor = self.sift_detector.detectAndCompute(craft_essence_part, None)
+        votes = self._vote(target_descriptor)
+        results = []
+        for idx in np.argsort(-votes, kind='stable'):
+            if len(results) >= k or votes[idx] == 0:
+                break
+            craft_essence_id = self.cached_icon_meta[idx][0]
+            if all(craft_essence_id != x[0] for x in results):
+                results.append((craft_essence_id, float(votes[idx])))
+        if len(results) > 0:
+            logger.debug('craft_essence_id = %d, sift_matches = %d' % (results[0][0], results[0][1]))
+        return results
+
+
+def precompute_feature_stores(sql_path: str = SQL_PATH):
+    """
+    Pre-compute the matcher-ready icon features of the given database, so that matchers could load them directly
+    without decoding the images on the first match
+
+    :param sql_path: path to the database
+    """
+    matcher_classes = [SupportServantMatcher, ServantCommandCardMatcher]
+    if image_process.sift_class is not None:
+        matcher_classes.append(SupportCraftEssenceMatcher)
+    for matcher_class in matcher_classes:
+        logger.info('Pre-computing feature store for %s' % matcher_class.__name__)
+        matcher_class(sql_path).precompute()
+
+
+_warm_up_executor = None  # type: Optional[ThreadPoolExecutor]
+_warm_up_futures = {}  # type: Dict[int, Future]
+_warm_up_lock = Lock()
+
+
+def _warm_up(matcher: AbstractFgoMaterialMatcher):
+    name = type(matcher).__name__
+    logger.info('Warming up %s' % name)
+    t = time()
+    try:
+        matcher.ensure_loaded()
+    except Exception as ex:
+        # it will be loaded again on the first match
+        logger.error('Failed to warm up %s' % name, exc_info=ex)
+        raise
+    finished, total = warm_up_progress()
+    # the current one is not marked as done yet
+    logger.info('%s is ready in %f sec(s), %d of %d matcher(s) warmed up' % (name, time() - t, finished + 1, total))
+
+
+def warm_up_matchers(matchers: Iterable[AbstractFgoMaterialMatcher]) -> List[Future]:
+    """
+    Load the given matchers in background threads, the matchers submitted before are skipped, matching with a matcher
+    being loaded blocks until it is ready
+
+    :param matchers: the matcher instances to be loaded
+    :return: the futures of loading the given matchers
+    """
+    global _warm_up_executor
+    futures = []
+    with _warm_up_lock:
+        if _warm_up_executor is None:
+            _warm_up_executor = ThreadPoolExecutor(max_workers=WARM_UP_WORKERS, thread_name_prefix='matcher_warm_up')
+        for matcher in matchers:
+            future = _warm_up_futures.get(id(matcher), None)
+            if future is None:
+                future = _warm_up_executor.submit(_warm_up, matcher)
+                _warm_up_futures[id(matcher)] = future
+            futures.append(future)
+    return futures
+
+
+def warm_up_progress() -> Tuple[int, int]:
+    """
+    Get the progress of the warm-up service
+
+    :return: the number of finished (including failed) matchers and the number of submitted matchers
+    """
+    with _warm_up_lock:
+        return sum([1 for x in _warm_up_futures.values() if x.done()]), len(_warm_up_futures)
@@ -0,0 +1,329 @@
+from _logging_config import script_logger_root
+import argparse
+import fnmatch
+import json
+import logging
+import os
+import platform
+import sys
+import numpy as np
+import image_process
+from collections import OrderedDict
+from time import perf_counter
+from typing import *
+from cv_positioning import *
+
+BENCHMARK_FORMAT_VERSION = 1
+# the support rows detected in asset/3.jpg (resized to screen resolution), as (y1, y2)
+_ASSET_SUPPORT_ROWS = [(195, 373), (395, 573)]
+
+
+class SkipBenchmark(Exception):
+    pass
+
+
+_cases = OrderedDict()  # type: OrderedDict[str, Callable[[], Callable[[], Any]]]
+
+
+def benchmark_case(name: str):
+    """
+    Register a benchmark case, the decorated function performs the setup (excluded from timing) and returns the timed
+    callable, it raises SkipBenchmark if the case is unavailable (e.g. the database is missing)
+
+    :param name: the name of the case
+    """
+    def decorator(setup: Callable[[], Callable[[], Any]]):
+        _cases[name] = setup
+        return setup
+    return decorator
+
+
+def _screenshot(path: str) -> np.ndarray:
+    if not os.path.isfile(path):
+        raise SkipBenchmark(f'{path} not found')
+    img = image_process.imread(path)[..., :3]
+    return image_process.resize(img, CV_SCREENSHOT_RESOLUTION_X, CV_SCREENSHOT_RESOLUTION_Y)
+
+
+def _require_database():
+    if not os.path.isfile(CV_FGO_DATABASE_FILE):
+        raise SkipBenchmark(f'database {CV_FGO_DATABASE_FILE} not found')
+
+
+def _support_icon(row: int = 0) -> np.ndarray:
+    y1, y2 = _ASSET_SUPPORT_ROWS[row]
+    return _screenshot('asset/3.jpg')[y1:y2, CV_SUPPORT_SERVANT_X1:CV_SUPPORT_SERVANT_X2, :]
+
+
+def _support_skill_digit_images() -> List[np.ndarray]:
+    # the same binarization as SelectSupportHandler.match_support_servant
+    y1, _ = _ASSET_SUPPORT_ROWS[0]
+    img = _screenshot('asset/3.jpg')
+    skill_img = img[y1+CV_SUPPORT_SKILL_BOX_OFFSET_Y:y1+CV_SUPPORT_SKILL_BOX_OFFSET_Y+CV_SUPPORT_SKILL_BOX_SIZE,
+                    CV_SUPPORT_SKILL_BOX_OFFSET_X1:CV_SUPPORT_SKILL_BOX_OFFSET_X2, :3]
+    ret = []
+    for j in range(3):
+        begin_x = j * (CV_SUPPORT_SKILL_BOX_MARGIN_X + CV_SUPPORT_SKILL_BOX_SIZE)
+        hsv = image_process.rgb_to_hsv(skill_img[:, begin_x:begin_x+CV_SUPPORT_SKILL_BOX_SIZE]).astype(np.float32)
+        img_digit_part = (1. - hsv[..., 1] / 255.) * (hsv[..., 2] / 255.)
+        ret.append(np.greater_equal(img_digit_part[30:, 3:30], CV_SUPPORT_SKILL_BINARIZATION_THRESHOLD))
+    return ret
+
+
+def _support_skill_digit_segments() -> List[np.ndarray]:
+    ret = []
+    for bin_digits in _support_skill_digit_images():
+        for segment in image_process.split_image(bin_digits):
+            if 50 < segment.associated_pixels.shape[0] < 150:
+                ret.append(segment.get_image_segment())
+    return ret
+
+
+@benchmark_case('perception_hash')
+def _case_perception_hash():
+    icon = _support_icon()
+    return lambda: image_process.perception_hash(icon)
+
+
+@benchmark_case('perception_hash_batch')
+def _case_perception_hash_batch():
+    icons = np.stack([_support_icon(0), _support_icon(1)] * 6, 0)
+    return lambda: image_process.perception_hash_batch(icons)
+
+
+def _random_keys(n: int, bits: int) -> List[int]:
+    rng = np.random.RandomState(0)
+    return [int(x) for x in rng.randint(0, 1 << bits, n, dtype=np.int64)]
+
+
+@benchmark_case('bk_tree_query')
+def _case_bk_tree_query():
+    tree = image_process.BKTree()
+    for i, key in enumerate(_random_keys(1024, 16)):
+        tree.add_node(key, i)
+    queries = _random_keys(64, 16)
+    return lambda: tree.query_many(queries, 2)
+
+
+@benchmark_case('hamming_index_query')
+def _case_hamming_index_query():
+    index = image_process.HammingIndex()
+    for i, key in enumerate(_random_keys(1024, 16)):
+        index.add_node(key, i)
+    queries = _random_keys(64, 16)
+    return lambda: index.query_many(queries, 2)
+
+
+@benchmark_case('anchor_eat_apple_ui')
+def _case_anchor_eat_apple_ui():
+    anchor = image_process.resize(image_process.imread(CV_EAT_APPLE_UI_FILE), CV_SCREENSHOT_RESOLUTION_X,
+                                  CV_SCREENSHOT_RESOLUTION_Y)
+    template = image_process.AnchorTemplate(anchor, CV_UI_ANCHOR_DOWNSAMPLE)
+    img = _screenshot('asset/2.jpg')
+    return lambda: template.compare(img)
+
+
+@benchmark_case('anchor_attack_button')
+def _case_anchor_attack_button():
+    template = image_process.AnchorTemplate(image_process.imread(CV_ATTACK_BUTTON_ANCHOR))
+    img = _screenshot('asset/1.jpg')
+    return lambda: template.compare(img[CV_ATTACK_BUTTON_Y1:CV_ATTACK_BUTTON_Y2,
+                                        CV_ATTACK_BUTTON_X1:CV_ATTACK_BUTTON_X2])
+
+
+@benchmark_case('split_image')
+def _case_split_image():
+    images = _support_skill_digit_images()
+    return lambda: [image_process.split_image(x) for x in images]
+
+
+@benchmark_case('digit_recognize')
+def _case_digit_recognize():
+    from util import DigitRecognizer
+    recognizer = DigitRecognizer(CV_SUPPORT_SKILL_DIGIT_DIR, cache_size=0)
+    segments = _support_skill_digit_segments()
+    return lambda: [recognizer.recognize(x) for x in segments]
+
+
+@benchmark_case('digit_recognize_cached')
+def _case_digit_recognize_cached():
+    from util import DigitRecognizer
+    recognizer = DigitRecognizer(CV_SUPPORT_SKILL_DIGIT_DIR)
+    segments = _support_skill_digit_segments()
+    return lambda: recognizer.recognize_batch(segments)
+
+
+@benchmark_case('support_servant_match')
+def _case_support_servant_match():
+    _require_database()
+    from matcher import SupportServantMatcher
+    matcher = SupportServantMatcher()
+    matcher.ensure_loaded()
+    icon = _support_icon()
+    return lambda: matcher.match(icon)
+
+
+@benchmark_case('support_craft_essence_match')
+def _case_support_craft_essence_match():
+    _require_database()
+    from matcher import SupportCraftEssenceMatcher
+    matcher = SupportCraftEssenceMatcher()
+    matcher.ensure_loaded()
+    icon = _support_icon()
+    return lambda: matcher.match(icon)
+
+
+@benchmark_case('support_craft_essence_match_uncached')
+def _case_support_craft_essence_match_uncached():
+    _require_database()
+    from matcher import SupportCraftEssenceMatcher
+    matcher = SupportCraftEssenceMatcher()
+    matcher.ensure_loaded()
+    icon = _support_icon()
+    # match_topk performs the full vote without the recognition cache
+    return lambda: matcher.match_topk(icon, 1)
+
+
+def _command_card_frame() -> np.ndarray:
+    # synthetic command card frame: type anchors composited over a screenshot
+    img = _screenshot('asset/1.jpg').astype(np.float32)
+    for i, (x1, x2) in enumerate(zip(CV_COMMAND_CARD_X1S, CV_COMMAND_CARD_X2S)):
+        anchor = image_process.imread(CV_COMMAND_CARD_TYPE_FILES[i % 3])
+        y1 = CV_COMMAND_CARD_Y + CV_COMMAND_CARD_Y_DETECTION_OFFSET + 2 * i
+        alpha = anchor[..., 3:] / 255.0
+        region = img[y1:y1+anchor.shape[0], x1:x2]
+        img[y1:y1+anchor.shape[0], x1:x2] = anchor[..., :3] * alpha + region * (1 - alpha)
+    return np.round(img).astype(np.uint8)
+
+
+@benchmark_case('anchor_command_card_type')
+def _case_anchor_command_card_type():
+    # the detector loads the servant command card matcher on importing, which requires the database
+    _require_database()
+    from battle_control._command_card_detector import CommandCardDetector, _gray_int
+    img = _command_card_frame()
+
+    def func():
+        # the sliding-window type and offset detection of all cards, without servant matching
+        gray = _gray_int(img[CV_COMMAND_CARD_Y:])
+        return [CommandCardDetector._detect_card_type(gray[:, x1:x2])
+                for x1, x2 in zip(CV_COMMAND_CARD_X1S, CV_COMMAND_CARD_X2S)]
+    return func
+
+
+@benchmark_case('detect_command_cards')
+def _case_detect_command_cards():
+    _require_database()
+    from battle_control import CommandCardDetector
+    img = _command_card_frame()
+    return lambda: CommandCardDetector.detect_command_cards(img)
+
+
+def run_case(name: str, repeat: int) -> Dict[str, float]:
+    """
+    Run a benchmark case, the first call is treated as warm up and excluded from the statistics
+
+    :param name: the name of the case
+    :param repeat: the number of timed calls
+    :return: the statistics of the elapsed time in milliseconds
+    """
+    func = _cases[name]()
+    func()
+    elapsed = np.empty(repeat, dtype=np.float64)
+    for i in range(repeat):
+        t = perf_counter()
+        func()
+        elapsed[i] = perf_counter() - t
+    elapsed *= 1000
+    return {'repeat': repeat, 'mean': float(np.mean(elapsed)), 'min': float(np.min(elapsed)),
+            'p50': float(np.percentile(elapsed, 50)), 'p90': float(np.percentile(elapsed, 90)),
+            'p99': float(np.percentile(elapsed, 99)), 'max': float(np.max(elapsed))}
+
+
+def run_all(patterns: Optional[Sequence[str]] = None, repeat: int = 50) -> Dict[str, Any]:
+    """
+    Run the benchmark cases matching any of the patterns
+
+    :param patterns: fnmatch patterns of case names, None for all cases
+    :param repeat: the number of timed calls of each case
+    :return: the benchmark result, containing environment info, the statistics of cases and the skipped cases
+    """
+    result = {'version': BENCHMARK_FORMAT_VERSION,
+              'environment': {'python': sys.version, 'platform': platform.platform(), 'numpy': np.__version__},
+              'cases': OrderedDict(), 'skipped': OrderedDict()}
+    for name in _cases:
+        if patterns and not any(fnmatch.fnmatch(name, x) for x in patterns):
+            continue
+        try:
+            stats = run_case(name, repeat)
+        except SkipBenchmark as ex:
+            script_logger_root.info('Skipped %s: %s' % (name, str(ex)))
+            result['skipped'][name] = str(ex)
+            continue
+        script_logger_root.info('%s: p50 %.3f ms, p90 %.3f ms, p99 %.3f ms' %
+                                (name, stats['p50'], stats['p90'], stats['p99']))
+        result['cases'][name] = stats
+    return result
+
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """
+    Compare the median time of each case with the baseline
+
+    :param result: the current benchmark result
+    :param baseline: the saved benchmark result
+    :param threshold: the relative slowdown of the median time regarded as regression, e.g. 0.2 for 20%
+    :return: the names of the regressed cases
+    """
+    regressed = []
+    for name, stats in result['cases'].items():
+        base_stats = baseline.get('cases', {}).get(name, None)
+        if base_stats is None:
+            script_logger_root.info('%s: not in baseline' % name)
+            continue
+        ratio = stats['p50'] / max(base_stats['p50'], 1e-9)
+        if ratio > 1 + threshold:
+            state = 'REGRESSION'
+            regressed.append(name)
+        elif ratio < 1 - threshold:
+            state = 'improved'
+        else:
+            state = 'ok'
+        script_logger_root.info('%s: p50 %.3f ms -> %.3f ms (x%.2f) %s' %
+                                (name, base_stats['p50'], stats['p50'], ratio, state))
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('cases', help='fnmatch patterns of the case names to run, all cases by default', nargs='*')
+    parser.add_argument('--list', help='List the case names and exit', action='store_true', default=False)
+    parser.add_argument('--repeat', help='Number of timed calls of each case', type=int, default=50)
+    parser.add_argument('--output', help='Save the result to the JSON file', type=str, default=None)
+    parser.add_argument('--compare', help='Compare the result with the baseline JSON file', type=str, default=None)
+    parser.add_argument('--threshold', help='Relative slowdown of median time regarded as regression', type=float,
+                        default=0.2)
+    parser.add_argument('--verbose', help='Enable debug level log (to screen and log file), it affects the timing',
+                        action='store_true', default=False)
+    args = parser.parse_args()
+    # the debug logs (also written to the log file) are excluded from timing unless requested
+    script_logger_root.setLevel(logging.DEBUG if args.verbose else logging.INFO)
+    if args.list:
+        for name in _cases:
+            print(name)
+        return
+    script_logger_root.info('Starting benchmark')
+    result = run_all(args.cases, args.repeat)
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf8') as f:
+            json.dump(result, f, indent=2)
+        script_logger_root.info('Saved benchmark result to %s' % args.output)
+    if args.compare is not None:
+        with open(args.compare, 'r', encoding='utf8') as f:
+            baseline = json.load(f)
+        if len(compare(result, baseline, args.threshold)) > 0:
+            exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+# A stub of adb executable for testing on Linux: "adb shell" runs each line of stdin with sh (the "input" commands
+# succeed without doing anything, "exit" ends the session), "adb exec-out screencap" outputs a black RGBA screenshot,
+# other commands exit immediately. The received lines are appended to the file specified by environment variable
+# STUB_ADB_LOG.
+import os
+import struct
+import sys
+
+
+def _log(msg: str):
+    path = os.getenv('STUB_ADB_LOG', None)
+    if path is not None:
+        with open(path, 'a') as f:
+            f.write(msg)
+
+
+def main():
+    args = sys.argv[1:]
+    _log('spawn %s\n' % ' '.join(args))
+    if args[:2] == ['exec-out', 'screencap']:
+        w, h = 320, 180
+        sys.stdout.buffer.write(struct.pack('<4I', w, h, 1, 0) + bytes(w * h * 4))
+    elif args == ['shell']:
+        for line in sys.stdin:
+            _log('cmd %s' % line)
+            if line.strip() == 'exit':
+                break
+            if line.startswith('input '):
+                line = 'true' + line[line.index(';'):]
+            os.system(line)
+            sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
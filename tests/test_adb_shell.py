@@ -0,0 +1,86 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from util.adb_shell import AdbShellSession
+
+STUB_ADB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stub_adb.py')
+
+
+@unittest.skipIf(os.name == 'nt', 'the stub adb requires a POSIX shell')
+class AdbShellSessionTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.log_path = tempfile.mkstemp(suffix='.log')
+        os.close(fd)
+        os.environ['STUB_ADB_LOG'] = self.log_path
+        self.session = AdbShellSession(STUB_ADB, timeout=5)
+
+    def tearDown(self):
+        self.session.close()
+        os.environ.pop('STUB_ADB_LOG', None)
+        os.remove(self.log_path)
+
+    def _log_lines(self, prefix: str):
+        with open(self.log_path) as f:
+            return [x for x in f.read().splitlines() if x.startswith(prefix)]
+
+    def test_output(self):
+        self.assertEqual(self.session.execute('echo hello; echo world'), (0, 'hello\nworld'))
+        self.assertEqual(self.session.execute('true'), (0, ''))
+
+    def test_output_without_trailing_new_line(self):
+        self.assertEqual(self.session.execute('printf abc'), (0, 'abc'))
+        self.assertEqual(self.session.execute('printf "abc\\ndef"'), (0, 'abc\ndef'))
+
+    def test_exit_code(self):
+        self.assertEqual(self.session.execute('false'), (1, ''))
+        self.assertEqual(self.session.execute('echo err >&2; sh -c "exit 3"'), (3, 'err'))
+        self.assertEqual(self.session.execute('input touchscreen swipe 1 2 1 2 100'), (0, ''))
+
+    def test_single_session(self):
+        for i in range(10):
+            self.assertEqual(self.session.execute('echo %d' % i), (0, str(i)))
+        self.assertEqual(len(self._log_lines('spawn shell')), 1)
+
+    def test_respawn_after_exit(self):
+        self.session.execute('true')
+        pid = self.session._proc.pid
+        self.session._proc.kill()
+        self.session._proc.wait()
+        self.assertEqual(self.session.execute('echo again'), (0, 'again'))
+        self.assertNotEqual(self.session._proc.pid, pid)
+        self.assertEqual(len(self._log_lines('spawn shell')), 2)
+
+    def test_no_replay_after_timeout(self):
+        with self.assertRaises(RuntimeError):
+            self.session.execute('sleep 2; echo done', timeout=0.5)
+        self.assertEqual(self.session.execute('echo after'), (0, 'after'))
+        self.assertEqual(len(self._log_lines('cmd sleep 2')), 1)
+
+    def test_timeout_covers_duration(self):
+        t = time.time()
+        self.assertEqual(self.session.execute('sleep 1; echo done', timeout=1.5), (0, 'done'))
+        self.assertGreaterEqual(time.time() - t, 1)
+
+    def test_retry_on_broken_pipe(self):
+        self.session.execute('true')
+
+        class _BrokenPipe:
+            def write(self, _):
+                raise BrokenPipeError(32, 'Broken pipe')
+
+            def flush(self):
+                pass
+
+            def close(self):
+                pass
+        self.session._proc.stdin = _BrokenPipe()
+        self.assertEqual(self.session.execute('echo resent'), (0, 'resent'))
+        self.assertEqual(len(self._log_lines('cmd echo resent')), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -192,6 +192,16 @@ def pre_compute_sift_features(sql_conn):
     sql_conn.commit()
 
 
+def pre_compute_icon_features(sql_path):
+    try:
+        from matcher import precompute_feature_stores
+    except ImportError:
+        print('Required dependency (cv2, numpy) is not satisfied, skipping icon feature pre-computation')
+        return
+    print('Pre-computing icon features')
+    precompute_feature_stores(sql_path)
+
+
 def main():
     sys.path.append(os.path.abspath(os.curdir))
     parser = argparse.ArgumentParser()
@@ -203,6 +213,7 @@ def main():
     retrieve_craft_essence_icons(conn)
     pre_compute_sift_features(conn)
     conn.close()
+    pre_compute_icon_features(args.output_db_path)
 
 
 if __name__ == '__main__':
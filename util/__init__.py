@@ -2,3 +2,4 @@ from .lazy_value import LazyValue
 from .compressed_pickle import pickle_load, pickle_dump, pickle_dumps, pickle_loads
 from .misc import spawn_process, spawn_process_raw
 from .digit_recognizer import DigitRecognizer
+from .adb_shell import AdbShellSession
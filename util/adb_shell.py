@@ -0,0 +1,125 @@
+import subprocess
+import threading
+import queue
+import logging
+from typing import *
+
+logger = logging.getLogger('bgo_script.util')
+
+
+class AdbShellSession:
+    """
+    A long-lived "adb shell" process, commands are written to its stdin and the completion of each command is detected
+    by a sentinel echoed after the command, which avoids spawning a new adb process (and its server handshake) for each
+    command. The process is re-spawned automatically if it died.
+    """
+    _sentinel_prefix = '__BGO_SCRIPT_CMD_DONE_'
+
+    def __init__(self, adb_executable: str, timeout: float = 5):
+        """
+        :param adb_executable: the path of adb executable
+        :param timeout: the default maximum waiting time (in seconds) of a single command
+        """
+        self._adb = adb_executable
+        self.timeout = timeout
+        self._proc = None  # type: Optional[subprocess.Popen]
+        self._output = None  # type: Optional[queue.Queue]
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def _spawn(self):
+        logger.debug('Spawning adb shell session')
+        self._proc = subprocess.Popen([self._adb, 'shell'], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                      stderr=subprocess.STDOUT)
+        self._output = queue.Queue()
+        thd = threading.Thread(target=self._read_output, args=(self._proc, self._output), daemon=True,
+                               name='Adb shell output reader thread')
+        thd.start()
+
+    @staticmethod
+    def _read_output(proc: subprocess.Popen, output: queue.Queue):
+        for line in iter(proc.stdout.readline, b''):
+            output.put(line)
+        # EOF: the process is exited
+        output.put(None)
+
+    def _kill(self):
+        if self._proc is not None:
+            try:
+                self._proc.kill()
+                self._proc.wait(self.timeout)
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+            self._proc = None
+            self._output = None
+
+    def is_alive(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None
+
+    def _send(self, cmd: str) -> str:
+        self._counter += 1
+        sentinel = '%s%d__' % (self._sentinel_prefix, self._counter)
+        self._proc.stdin.write(('%s; echo %s $?\n' % (cmd, sentinel)).encode('utf8'))
+        self._proc.stdin.flush()
+        return sentinel
+
+    def _receive(self, sentinel: str, timeout: float) -> Tuple[int, str]:
+        lines = []
+        while True:
+            line = self._output.get(timeout=timeout)
+            if line is None:
+                raise EOFError('Adb shell session exited unexpectedly')
+            line = line.decode('utf8', 'replace').rstrip('\r\n')
+            # the sentinel follows the output directly if the output does not end with a new line
+            idx = line.find(sentinel)
+            if idx >= 0:
+                if idx > 0:
+                    lines.append(line[:idx])
+                return int(line[idx+len(sentinel):]), '\n'.join(lines)
+            lines.append(line)
+
+    def execute(self, cmd: str, timeout: Optional[float] = None) -> Tuple[int, str]:
+        """
+        Execute the shell command in the session and wait for its completion. The command is re-sent with a new session
+        only if it could not be written to the session, it is never replayed once sent (e.g. a timed out swipe may
+        still be performed by the device)
+
+        :param cmd: the command executed in device shell, e.g. "input tap 0 0"
+        :param timeout: the maximum waiting time (in seconds) of this command, it should cover the duration of the
+            command itself (e.g. a long swipe), defaults to the timeout of this session
+        :return: the tuple of exit code and output (stdout and stderr) of the command
+        :raises RuntimeError: if the command could not be sent, or the session exited or timed out after sending it
+        """
+        with self._lock:
+            for i in range(2):
+                if not self.is_alive():
+                    if self._proc is not None:
+                        logger.warning('Adb shell session exited with value %s, re-spawning' % str(self._proc.poll()))
+                        self._kill()
+                    self._spawn()
+                try:
+                    sentinel = self._send(cmd)
+                except OSError as ex:
+                    # broken pipe, the command is not sent, retry once with a new session
+                    self._kill()
+                    if i == 1:
+                        raise RuntimeError('Failed to send command to adb shell session: %s' % cmd) from ex
+                    logger.warning('Adb shell session failed (%s), retrying' % type(ex).__name__)
+                    continue
+                try:
+                    return self._receive(sentinel, self.timeout if timeout is None else timeout)
+                except (EOFError, queue.Empty) as ex:
+                    # process exited or timed out after the command is sent, the state of device is unknown
+                    self._kill()
+                    raise RuntimeError('Failed to execute command in adb shell session: %s' % cmd) from ex
+
+    def close(self):
+        with self._lock:
+            if self.is_alive():
+                try:
+                    self._proc.stdin.write(b'exit\n')
+                    self._proc.stdin.flush()
+                    self._proc.wait(self.timeout)
+                except (OSError, subprocess.TimeoutExpired):
+                    pass
+            self._kill()
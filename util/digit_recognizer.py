@@ -1,11 +1,19 @@
 import image_process
-from skimage.metrics import structural_similarity as ssim
+from typing import *
 import os
 import numpy as np
+from collections import OrderedDict
+import logging
+
+logger = logging.getLogger('bgo_script.util')
 
 
 class DigitRecognizer:
-    def __init__(self, digit_dir: str):
+    def __init__(self, digit_dir: str, cache_size: int = 256):
+        """
+        :param digit_dir: the directory containing the digit templates, named by "<digit>.png"
+        :param cache_size: the maximum number of memoized binary digit images (LRU), 0 to disable memoization
+        """
         assert os.path.isdir(digit_dir), f'{digit_dir} is not a directory'
         digits = image_process.read_digit_label_dir(digit_dir)
         if len(digits) == 0:
@@ -17,9 +25,74 @@ class DigitRecognizer:
                 raise ValueError(f'Inconsistent image shape: expected {first_shape}, but got {img.shape}')
         self.digits = digits
         self._shape = first_shape
+        # all templates are stacked for batched matching
+        self._labels = np.array(sorted(digits), dtype=np.int64)
+        self._templates = np.stack([digits[x] for x in self._labels], 0)
+        # binary image fingerprint -> (digit, confidence), ordered from the least recently used to the most recently
+        # used
+        self._cache = OrderedDict()  # type: OrderedDict[Tuple[str, Tuple[int, ...], bytes], Tuple[int, float]]
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _fingerprint(img: np.ndarray) -> Optional[Tuple[str, Tuple[int, ...], bytes]]:
+        # only binary images (e.g. ImageSegment.get_image_segment()) are memoized, keyed by the packed bits, shape and
+        # dtype
+        if img.dtype != np.bool_ and np.any((img != 0) & (img != 255)):
+            return None
+        return img.dtype.str, img.shape, np.packbits(img != 0).tobytes()
+
+    def recognize_batch(self, imgs: Sequence[np.ndarray]) -> List[Tuple[int, float]]:
+        """
+        Recognize multiple digit images at once, all images are scored against all templates by SSIM in one pass
+
+        :param imgs: digit images (e.g. ImageSegment.get_image_segment()), with arbitrary shapes
+        :return: a list of (digit, confidence) tuples, the confidence is the SSIM margin between the best matched
+            template and the second one (1 if only one template is available)
+        """
+        if len(imgs) == 0:
+            return []
+        keys = [self._fingerprint(x) if self.cache_size > 0 else None for x in imgs]
+        ret_list = [None] * len(imgs)  # type: List[Optional[Tuple[int, float]]]
+        missed = []
+        for i, key in enumerate(keys):
+            if key is not None and key in self._cache:
+                self._cache.move_to_end(key)
+                ret_list[i] = self._cache[key]
+                self.hits += 1
+            else:
+                missed.append(i)
+                self.misses += 1
+        if len(missed) > 0:
+            for i, result in zip(missed, self._recognize_batch_internal([imgs[i] for i in missed])):
+                ret_list[i] = result
+                if keys[i] is not None:
+                    self._cache[keys[i]] = result
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Digit recognizer cache stats: %s', self.stats())
+        return ret_list
+
+    def _recognize_batch_internal(self, imgs: Sequence[np.ndarray]) -> List[Tuple[int, float]]:
+        img_normalized = np.stack([image_process.normalize_image(x, self._shape) for x in imgs], 0)
+        score = image_process.structural_similarity_batch(img_normalized, self._templates)
+        best = np.argmax(score, -1)
+        if score.shape[1] > 1:
+            top2 = -np.partition(-score, 1, -1)[:, :2]
+            confidence = top2[:, 0] - top2[:, 1]
+        else:
+            confidence = np.ones(score.shape[0])
+        return [(int(self._labels[i]), float(c)) for i, c in zip(best, confidence)]
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get the counters of the memoization cache
+
+        :return: a dict containing the entries, hits and misses
+        """
+        return {'entries': len(self._cache), 'hits': self.hits, 'misses': self.misses}
 
-    def recognize(self, img: np.ndarray):
-        img_normalized = image_process.normalize_image(img, self._shape)
-        ret_val = {k: ssim(v, img_normalized) for k, v in self.digits.items()}
-        sorted_keys = sorted(ret_val, key=lambda x: ret_val[x], reverse=True)
-        return sorted_keys[0]
+    def recognize(self, img: np.ndarray) -> int:
+        return self.recognize_batch([img])[0][0]